@@ -1,18 +1,448 @@
 import sqlite3
 import os
-from contextlib import closing
+import threading
+from array import array
+from collections import namedtuple
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+# 把 'YYYY:MM:DD HH:MM:SS'（EXIF 和文件时间使用的格式）或 'YYYY-MM-DD HH:MM:SS' 规范化为可排序的
+# 'YYYY-MM-DD HH:MM:SS'，无法识别的时间为空字符串，{0} 为拍摄时间表达式
+CAPTURE_KEY_SQL = '''
+    CASE WHEN {0} GLOB '[0-9][0-9][0-9][0-9][:-][0-9][0-9][:-][0-9][0-9]*' AND substr({0}, 1, 4) <> '0000'
+         THEN replace(substr({0}, 1, 10), ':', '-') || substr({0}, 11, 9)
+         ELSE '' END
+'''
+
+# 拍摄时间所在的月份 'YYYY-MM'，无法识别的时间为空字符串，{0} 为拍摄时间表达式
+CAPTURE_MONTH_SQL = f'substr({CAPTURE_KEY_SQL}, 1, 7)'
+
+# 照片中所有人物姓名，以空格分隔，用于全文搜索，{0} 为 PhotoID 表达式
+FACE_LABELS_SQL = '''
+    COALESCE((SELECT group_concat(F.FaceLabel, ' ') FROM PhotoFaceLink L JOIN Faces F ON F.FaceID = L.FaceID
+              WHERE L.PhotoID = {0}), '')
+'''
+
+# 按日期分页查询时每页的照片数
+PAGE_SIZE = 500
+# 全文搜索的匹配数不超过该值时按相关度排序，否则按导入先后从新到旧排列
+SEARCH_RANK_LIMIT = 1000
+
+# 每次导入结束后合并全文索引小段时最多写入的页数，限制持有写锁的时间
+SEARCH_MERGE_PAGES = 500
+
+# SQLite 中 PhotoID 的最大值
+MAX_PHOTO_ID = 2 ** 63 - 1
+
+# 每个数据库文件最多保留的空闲只读连接数
+READER_POOL_SIZE = 4
+
+# PhotoInfoTable 最初的 13 列，与其他表连接查询时按这些列的位置取值
+PHOTO_INFO_COLUMNS = ('PhotoID, FileName, FileSize, FileFormat, CaptureTime, IsCaptureTimeAccurate, CaptureLocation, '
+                      'CameraModel, FilePath, Thumbnail, ThumbnailPath, FileHash, IsLandscape')
+
+# 可以按列读取的照片表列
+PHOTO_COLUMNS = tuple(PHOTO_INFO_COLUMNS.split(', ')) + ('CaptureKey',)
+# 网格显示照片需要的列，与 photo_grid.PhotoItem 的字段顺序相同
+GRID_PHOTO_COLUMNS = ('PhotoID', 'FilePath', 'ThumbnailPath', 'CaptureTime', 'FileHash')
+
+
+@lru_cache(maxsize=None)
+def photo_row_type(columns):
+    # 按列名生成的行类型：namedtuple 没有每行一个的 __dict__，可以按列名或按位置取值
+    return namedtuple('PhotoRow', columns)
+
+
+def search_match_expression(text):
+    # 把用户输入转换为 FTS5 查询：每个词加引号作为普通文本（不解析 AND、NEAR 等语法），按前缀匹配，各词之间为 AND
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in text.split())
+
+
+# 数据库结构迁移：第 i 项把 PRAGMA user_version 从 i 升级到 i + 1。
+# 已发布的迁移不能修改，新的结构变化只能追加到末尾。
+SCHEMA_MIGRATIONS = [
+    # 1: FileHash 唯一索引，先合并已有的重复照片记录（保留最小的 PhotoID，人脸关联指向保留的记录，
+    #    合并后重复的 (PhotoID, FaceID) 关联只保留一条）
+    [
+        '''
+        UPDATE PhotoFaceLink SET PhotoID = (
+            SELECT MIN(P2.PhotoID) FROM PhotoInfoTable P1
+            JOIN PhotoInfoTable P2 ON P1.FileHash = P2.FileHash
+            WHERE P1.PhotoID = PhotoFaceLink.PhotoID
+        )
+        WHERE PhotoID IN (
+            SELECT P1.PhotoID FROM PhotoInfoTable P1
+            JOIN PhotoInfoTable P2 ON P1.FileHash = P2.FileHash AND P2.PhotoID < P1.PhotoID
+        )
+        ''',
+        '''
+        DELETE FROM PhotoFaceLink WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM PhotoFaceLink GROUP BY PhotoID, FaceID
+        )
+        ''',
+        '''
+        DELETE FROM PhotoInfoTable WHERE PhotoID IN (
+            SELECT P1.PhotoID FROM PhotoInfoTable P1
+            JOIN PhotoInfoTable P2 ON P1.FileHash = P2.FileHash AND P2.PhotoID < P1.PhotoID
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_PhotoInfo_FileHash ON PhotoInfoTable (FileHash)',
+    ],
+    # 2: 人脸关联和拍摄时间索引
+    [
+        'CREATE INDEX IF NOT EXISTS idx_PhotoFaceLink_PhotoID ON PhotoFaceLink (PhotoID)',
+        'CREATE INDEX IF NOT EXISTS idx_PhotoFaceLink_FaceID ON PhotoFaceLink (FaceID)',
+        'CREATE INDEX IF NOT EXISTS idx_PhotoInfo_CaptureTime ON PhotoInfoTable (CaptureTime)',
+    ],
+    # 3: 源文件指纹缓存，重新导入时未变化的文件无需重新计算哈希
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS FileFingerprints (
+            SourcePath TEXT PRIMARY KEY,
+            FileSize INTEGER,
+            MTime INTEGER,
+            Inode INTEGER,
+            FileHash TEXT
+        )
+        ''',
+    ],
+    # 4: 人脸编码矩阵文件中的行号，FaceID -> 行
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS FaceEmbeddings (
+            FaceID INTEGER PRIMARY KEY,
+            EmbeddingRow INTEGER UNIQUE
+        )
+        ''',
+    ],
+    # 5: 人脸检测和编码结果缓存，按文件哈希和检测/编码设置区分，清除照片数据时保留
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS FaceDetectionCache (
+            FileHash TEXT,
+            SettingsKey TEXT,
+            FaceLocations TEXT,
+            FaceLandmarks TEXT,
+            Encodings BLOB,
+            PRIMARY KEY (FileHash, SettingsKey)
+        )
+        ''',
+    ],
+    # 6: 打包缩略图文件中每张缩略图的位置，按文件哈希和尺寸索引
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS ThumbnailBlobs (
+            FileHash TEXT,
+            Size INTEGER,
+            Offset INTEGER,
+            Length INTEGER,
+            PRIMARY KEY (FileHash, Size)
+        )
+        ''',
+    ],
+    # 7: 由触发器维护的统计信息（照片数、照片总字节数、人脸数、每个人物的照片数），状态栏只需读取一行
+    [
+        'CREATE TABLE IF NOT EXISTS LibraryStats (Name TEXT PRIMARY KEY, Value INTEGER NOT NULL)',
+        '''
+        INSERT OR REPLACE INTO LibraryStats (Name, Value) VALUES
+            ('PhotoCount', (SELECT COUNT(*) FROM PhotoInfoTable)),
+            ('TotalBytes', (SELECT COALESCE(SUM(FileSize), 0) FROM PhotoInfoTable)),
+            ('FaceCount', (SELECT COUNT(*) FROM Faces))
+        ''',
+        'CREATE TABLE IF NOT EXISTS PersonStats (FaceID INTEGER PRIMARY KEY, PhotoCount INTEGER NOT NULL)',
+        '''
+        INSERT OR REPLACE INTO PersonStats (FaceID, PhotoCount)
+        SELECT FaceID, COUNT(*) FROM PhotoFaceLink GROUP BY FaceID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Insert_Stats AFTER INSERT ON PhotoInfoTable BEGIN
+            UPDATE LibraryStats SET Value = Value + 1 WHERE Name = 'PhotoCount';
+            UPDATE LibraryStats SET Value = Value + COALESCE(NEW.FileSize, 0) WHERE Name = 'TotalBytes';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Delete_Stats AFTER DELETE ON PhotoInfoTable BEGIN
+            UPDATE LibraryStats SET Value = Value - 1 WHERE Name = 'PhotoCount';
+            UPDATE LibraryStats SET Value = Value - COALESCE(OLD.FileSize, 0) WHERE Name = 'TotalBytes';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_UpdateSize_Stats AFTER UPDATE OF FileSize ON PhotoInfoTable BEGIN
+            UPDATE LibraryStats SET Value = Value - COALESCE(OLD.FileSize, 0) + COALESCE(NEW.FileSize, 0) WHERE Name = 'TotalBytes';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_Faces_Insert_Stats AFTER INSERT ON Faces BEGIN
+            UPDATE LibraryStats SET Value = Value + 1 WHERE Name = 'FaceCount';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_Faces_Delete_Stats AFTER DELETE ON Faces BEGIN
+            UPDATE LibraryStats SET Value = Value - 1 WHERE Name = 'FaceCount';
+            DELETE FROM PersonStats WHERE FaceID = OLD.FaceID;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoFaceLink_Insert_Stats AFTER INSERT ON PhotoFaceLink BEGIN
+            INSERT OR IGNORE INTO PersonStats (FaceID, PhotoCount) VALUES (NEW.FaceID, 0);
+            UPDATE PersonStats SET PhotoCount = PhotoCount + 1 WHERE FaceID = NEW.FaceID;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoFaceLink_Delete_Stats AFTER DELETE ON PhotoFaceLink BEGIN
+            UPDATE PersonStats SET PhotoCount = PhotoCount - 1 WHERE FaceID = OLD.FaceID;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoFaceLink_Update_Stats AFTER UPDATE OF FaceID ON PhotoFaceLink BEGIN
+            UPDATE PersonStats SET PhotoCount = PhotoCount - 1 WHERE FaceID = OLD.FaceID;
+            INSERT OR IGNORE INTO PersonStats (FaceID, PhotoCount) VALUES (NEW.FaceID, 0);
+            UPDATE PersonStats SET PhotoCount = PhotoCount + 1 WHERE FaceID = NEW.FaceID;
+        END
+        ''',
+    ],
+    # 8: 规范化的拍摄时间 CaptureKey，由触发器维护，与 PhotoID 一起建立索引用于按日期排序和分页
+    [
+        "ALTER TABLE PhotoInfoTable ADD COLUMN CaptureKey TEXT NOT NULL DEFAULT ''",
+        f'UPDATE PhotoInfoTable SET CaptureKey = {CAPTURE_KEY_SQL.format("CaptureTime")}',
+        'CREATE INDEX IF NOT EXISTS idx_PhotoInfo_CaptureKey ON PhotoInfoTable (CaptureKey, PhotoID)',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Insert_CaptureKey AFTER INSERT ON PhotoInfoTable BEGIN
+            UPDATE PhotoInfoTable SET CaptureKey = {CAPTURE_KEY_SQL.format("NEW.CaptureTime")} WHERE PhotoID = NEW.PhotoID;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Update_CaptureKey AFTER UPDATE OF CaptureTime ON PhotoInfoTable BEGIN
+            UPDATE PhotoInfoTable SET CaptureKey = {CAPTURE_KEY_SQL.format("NEW.CaptureTime")} WHERE PhotoID = NEW.PhotoID;
+        END
+        ''',
+    ],
+    # 9: 每月照片数，由触发器随照片的增删和拍摄时间的变化维护，时间轴一次查询即可取得全部月份
+    [
+        'CREATE TABLE IF NOT EXISTS MonthStats (Month TEXT PRIMARY KEY, PhotoCount INTEGER NOT NULL)',
+        '''
+        INSERT OR REPLACE INTO MonthStats (Month, PhotoCount)
+        SELECT substr(CaptureKey, 1, 7), COUNT(*) FROM PhotoInfoTable GROUP BY substr(CaptureKey, 1, 7)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Insert_Month AFTER INSERT ON PhotoInfoTable BEGIN
+            INSERT OR IGNORE INTO MonthStats (Month, PhotoCount) VALUES (substr(NEW.CaptureKey, 1, 7), 0);
+            UPDATE MonthStats SET PhotoCount = PhotoCount + 1 WHERE Month = substr(NEW.CaptureKey, 1, 7);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Delete_Month AFTER DELETE ON PhotoInfoTable BEGIN
+            UPDATE MonthStats SET PhotoCount = PhotoCount - 1 WHERE Month = substr(OLD.CaptureKey, 1, 7);
+            DELETE FROM MonthStats WHERE Month = substr(OLD.CaptureKey, 1, 7) AND PhotoCount <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Update_Month AFTER UPDATE OF CaptureKey ON PhotoInfoTable BEGIN
+            UPDATE MonthStats SET PhotoCount = PhotoCount - 1 WHERE Month = substr(OLD.CaptureKey, 1, 7);
+            DELETE FROM MonthStats WHERE Month = substr(OLD.CaptureKey, 1, 7) AND PhotoCount <= 0;
+            INSERT OR IGNORE INTO MonthStats (Month, PhotoCount) VALUES (substr(NEW.CaptureKey, 1, 7), 0);
+            UPDATE MonthStats SET PhotoCount = PhotoCount + 1 WHERE Month = substr(NEW.CaptureKey, 1, 7);
+        END
+        ''',
+    ],
+    # 10: 按人物分页查询照片的 (FaceID, PhotoID) 唯一索引，取代只有 FaceID 的索引。同一张照片里的多张人脸
+    #     匹配到同一个人物时只保留一条关联，人物的照片数和分页都按照片计算
+    [
+        '''
+        DELETE FROM PhotoFaceLink WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM PhotoFaceLink GROUP BY PhotoID, FaceID
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_PhotoFaceLink_FaceID_PhotoID ON PhotoFaceLink (FaceID, PhotoID)',
+        'DROP INDEX IF EXISTS idx_PhotoFaceLink_FaceID',
+    ],
+    # 11: 文件名、相机型号、拍摄地点和人物姓名的 FTS5 全文索引，rowid 为 PhotoID，由触发器随照片、人脸关联和姓名的变化同步
+    [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS PhotoSearch USING fts5(
+            FileName, CameraModel, CaptureLocation, FaceLabels, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6'
+        )
+        ''',
+        f'''
+        INSERT INTO PhotoSearch (rowid, FileName, CameraModel, CaptureLocation, FaceLabels)
+        SELECT P.PhotoID, P.FileName, P.CameraModel, P.CaptureLocation, {FACE_LABELS_SQL.format("P.PhotoID")}
+        FROM PhotoInfoTable P
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Insert_Search AFTER INSERT ON PhotoInfoTable BEGIN
+            INSERT INTO PhotoSearch (rowid, FileName, CameraModel, CaptureLocation, FaceLabels)
+            VALUES (NEW.PhotoID, NEW.FileName, NEW.CameraModel, NEW.CaptureLocation, '');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Delete_Search AFTER DELETE ON PhotoInfoTable BEGIN
+            DELETE FROM PhotoSearch WHERE rowid = OLD.PhotoID;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Update_Search
+        AFTER UPDATE OF FileName, CameraModel, CaptureLocation ON PhotoInfoTable BEGIN
+            UPDATE PhotoSearch SET FileName = NEW.FileName, CameraModel = NEW.CameraModel, CaptureLocation = NEW.CaptureLocation
+            WHERE rowid = NEW.PhotoID;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoFaceLink_Insert_Search AFTER INSERT ON PhotoFaceLink BEGIN
+            UPDATE PhotoSearch SET FaceLabels = {FACE_LABELS_SQL.format("NEW.PhotoID")} WHERE rowid = NEW.PhotoID;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoFaceLink_Delete_Search AFTER DELETE ON PhotoFaceLink BEGIN
+            UPDATE PhotoSearch SET FaceLabels = {FACE_LABELS_SQL.format("OLD.PhotoID")} WHERE rowid = OLD.PhotoID;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoFaceLink_Update_Search AFTER UPDATE ON PhotoFaceLink BEGIN
+            UPDATE PhotoSearch SET FaceLabels = {FACE_LABELS_SQL.format("PhotoSearch.rowid")} WHERE rowid IN (OLD.PhotoID, NEW.PhotoID);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_Faces_UpdateLabel_Search AFTER UPDATE OF FaceLabel ON Faces BEGIN
+            UPDATE PhotoSearch SET FaceLabels = {FACE_LABELS_SQL.format("PhotoSearch.rowid")}
+            WHERE rowid IN (SELECT PhotoID FROM PhotoFaceLink WHERE FaceID = NEW.FaceID);
+        END
+        ''',
+    ],
+    # 12: 每月照片数的触发器改为由拍摄时间计算月份，不依赖 CaptureKey 触发器的执行顺序，并重新统计
+    [
+        'DROP TRIGGER IF EXISTS trg_PhotoInfo_Insert_Month',
+        'DROP TRIGGER IF EXISTS trg_PhotoInfo_Delete_Month',
+        'DROP TRIGGER IF EXISTS trg_PhotoInfo_Update_Month',
+        'DELETE FROM MonthStats',
+        '''
+        INSERT INTO MonthStats (Month, PhotoCount)
+        SELECT substr(CaptureKey, 1, 7), COUNT(*) FROM PhotoInfoTable GROUP BY substr(CaptureKey, 1, 7)
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Insert_Month AFTER INSERT ON PhotoInfoTable BEGIN
+            INSERT OR IGNORE INTO MonthStats (Month, PhotoCount) VALUES ({CAPTURE_MONTH_SQL.format("NEW.CaptureTime")}, 0);
+            UPDATE MonthStats SET PhotoCount = PhotoCount + 1 WHERE Month = {CAPTURE_MONTH_SQL.format("NEW.CaptureTime")};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Delete_Month AFTER DELETE ON PhotoInfoTable BEGIN
+            UPDATE MonthStats SET PhotoCount = PhotoCount - 1 WHERE Month = {CAPTURE_MONTH_SQL.format("OLD.CaptureTime")};
+            DELETE FROM MonthStats WHERE Month = {CAPTURE_MONTH_SQL.format("OLD.CaptureTime")} AND PhotoCount <= 0;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_PhotoInfo_Update_Month AFTER UPDATE OF CaptureTime ON PhotoInfoTable BEGIN
+            UPDATE MonthStats SET PhotoCount = PhotoCount - 1 WHERE Month = {CAPTURE_MONTH_SQL.format("OLD.CaptureTime")};
+            DELETE FROM MonthStats WHERE Month = {CAPTURE_MONTH_SQL.format("OLD.CaptureTime")} AND PhotoCount <= 0;
+            INSERT OR IGNORE INTO MonthStats (Month, PhotoCount) VALUES ({CAPTURE_MONTH_SQL.format("NEW.CaptureTime")}, 0);
+            UPDATE MonthStats SET PhotoCount = PhotoCount + 1 WHERE Month = {CAPTURE_MONTH_SQL.format("NEW.CaptureTime")};
+        END
+        ''',
+    ],
+]
+
+class ConnectionPool:
+    """
+    一个数据库文件在本进程中的全部连接：一个写连接和一组只读连接
+
+    所有 DBprocess 共用同一个写连接，写操作和事务持有 write_lock 依次执行，不会因为多个写连接互相等待而出现 "database is locked"。
+    WAL 模式下查询从只读连接池借出连接执行，不等待其他线程正在进行的写事务。
+    连接池在第一个 DBprocess 打开时创建，最后一个 DBprocess 关闭时关闭全部连接。
+    """
+    pools = {}  # 数据库文件的绝对路径 -> ConnectionPool
+    pools_lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, db_path, use_wal, connect_writer):
+        """
+        取得数据库文件的连接池，没有时用 connect_writer() 创建写连接
+
+        参数:
+        db_path (str): 数据库文件路径
+        use_wal (bool): 是否使用 WAL 模式，只有 WAL 模式下才使用只读连接
+        connect_writer (callable): 打开写连接的函数，只在创建连接池时调用
+        """
+        key = os.path.abspath(db_path)
+        with cls.pools_lock:
+            pool = cls.pools.get(key)
+            if pool is None:
+                pool = cls.pools[key] = ConnectionPool(key, use_wal, connect_writer())
+            pool.users += 1
+            return pool
+
+    def __init__(self, db_path, use_wal, writer):
+        self.db_path = db_path
+        self.use_readers = bool(use_wal)
+        self.writer = writer
+        self.write_lock = threading.RLock()
+        self.transaction_depth = 0  # 写连接上嵌套事务的层数，大于 0 时不逐条提交
+        self.transaction_thread = None  # 正在执行事务的线程
+        self.readers = []  # 空闲的只读连接
+        self.readers_lock = threading.Lock()
+        self.users = 0  # 使用该连接池的 DBprocess 个数
+
+    def in_transaction(self):
+        # 当前线程是否在事务中
+        return self.transaction_depth > 0 and self.transaction_thread == threading.get_ident()
+
+    @contextmanager
+    def reader(self):
+        # 借出一个只读连接，用完后放回；空闲连接不够时打开新连接
+        with self.readers_lock:
+            conn = self.readers.pop() if self.readers else None
+        if conn is None:
+            db_uri = Path(self.db_path).as_uri() + '?mode=ro'
+            conn = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            with self.readers_lock:
+                if len(self.readers) < READER_POOL_SIZE:
+                    self.readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def release(self):
+        with ConnectionPool.pools_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            del ConnectionPool.pools[self.db_path]
+        with self.readers_lock:
+            for conn in self.readers:
+                conn.close()
+            self.readers = []
+        with self.write_lock:
+            self.writer.close()
+
 
 class DBprocess:
-    def __init__(self, config_path='config.ini'):
+    # 本进程中已经完成建表和结构迁移的数据库文件
+    schema_ready = set()
+
+    def __init__(self, config_path='config.ini', use_wal=None):
+        self.config_path = config_path
         self.config = self.load_config(config_path)
         self.db_path = self.config.get('DatabaseFilePath', 'data/photodata.db')
+        self.use_wal = self.config.get('UseWAL', False) if use_wal is None else use_wal
         self.ensure_directory_exists(os.path.dirname(self.db_path))
-        self.conn = self.create_connection()
+        # 同一进程中打开同一数据库的 DBprocess 共用连接池，不重新连接，也不重复建表和迁移
+        self.pool = ConnectionPool.acquire(self.db_path, self.use_wal, self.create_connection)
+        self.conn = self.pool.writer
+
+    def clone(self):
+        # 用相同的配置取得一个新的 DBprocess，供其他线程使用；与本对象共用连接池，写操作由连接池的锁依次执行
+        return DBprocess(self.config_path, self.use_wal)
 
     def load_config(self, file_path):
         # 这里可以根据实际情况扩展配置文件的加载逻辑
         config = {
-            'DatabaseFilePath': 'data/photodata.db'
+            'DatabaseFilePath': 'data/photodata.db',
+            'EmbeddingFilePath': 'data/face_embeddings.f32',
+            'ThumbnailPackFilePath': 'data/thumbnails.pack',
+            'UseWAL': False  # 是否启用 WAL 日志模式（配合 synchronous=NORMAL）
         }
         # TODO: 从配置文件加载更多设置
         return config
@@ -23,8 +453,16 @@ class DBprocess:
 
     def create_connection(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            self.create_tables(conn)
+            # 写连接由连接池在各线程间共用，由 write_lock 保证同一时刻只有一个线程使用
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            if self.use_wal:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            db_key = os.path.abspath(self.db_path)
+            if db_key not in DBprocess.schema_ready:
+                self.create_tables(conn)
+                self.migrate_schema(conn)
+                DBprocess.schema_ready.add(db_key)
             return conn
         except sqlite3.DatabaseError as e:
             print(f"数据库连接失败: {e}")
@@ -78,46 +516,228 @@ class DBprocess:
             ''')
             conn.commit()
 
+    def get_schema_version(self, conn):
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate_schema(self, conn):
+        # 打开数据库时把旧的数据库原地升级到最新结构，每个迁移在单独的事务中执行
+        version = self.get_schema_version(conn)
+        for target_version in range(version + 1, len(SCHEMA_MIGRATIONS) + 1):
+            with closing(conn.cursor()) as cursor:
+                try:
+                    cursor.execute('BEGIN')
+                    for statement in SCHEMA_MIGRATIONS[target_version - 1]:
+                        cursor.execute(statement)
+                    cursor.execute(f'PRAGMA user_version = {target_version}')
+                    conn.commit()
+                    print(f"数据库结构已升级到版本 {target_version}")
+                except sqlite3.DatabaseError:
+                    conn.rollback()
+                    raise
+
+    @contextmanager
+    def transaction(self):
+        """
+        事务上下文：块内的所有写操作在退出时一次性提交，出现异常时整体回滚。可以嵌套，只有最外层提交。
+        事务期间持有写连接的锁，其他线程的写操作等到事务结束后再执行。
+
+        用法:
+        with db.transaction():
+            db.add_photo_infos(photo_infos)
+        """
+        pool = self.pool
+        with pool.write_lock:
+            pool.transaction_depth += 1
+            pool.transaction_thread = threading.get_ident()
+            try:
+                yield self
+            except Exception:
+                pool.transaction_depth -= 1
+                if pool.transaction_depth == 0 and self.conn is not None:
+                    self.conn.rollback()
+                raise
+            pool.transaction_depth -= 1
+            if pool.transaction_depth == 0:
+                self.commit()
+
+    def commit(self):
+        # 不在事务中时才立即提交
+        with self.pool.write_lock:
+            if self.pool.transaction_depth == 0 and self.conn is not None:
+                self.conn.commit()
+
     def add_face_info(self, face_hash, face_label):
         query = 'INSERT INTO Faces (FaceHash, FaceLabel) VALUES (?, ?)'
-        self.execute_query(query, (face_hash, face_label))
-        return self.execute_query('SELECT last_insert_rowid()', fetch_one=True)[0]  # 返回新插入的FaceID
+        if self.conn is None:
+            print("数据库连接未初始化。")
+            return None
+
+        with self.pool.write_lock, closing(self.conn.cursor()) as cursor:
+            try:
+                cursor.execute(query, (face_hash, face_label))
+                self.commit()
+                return cursor.lastrowid  # 返回新插入的FaceID
+            except sqlite3.DatabaseError as e:
+                print(f"执行查询时出错: {query}, 错误: {e}")
+                return None
+
+    def add_faces(self, faces):
+        """
+        批量添加人脸信息
+
+        参数:
+        faces (list): 每个元素是 (FaceHash, FaceLabel) 元组
+
+        返回:
+        list: 按输入顺序对应的新 FaceID 列表
+        """
+        faces = list(faces)
+        if not faces:
+            return []
+        with self.transaction():
+            if self.execute_many('INSERT INTO Faces (FaceHash, FaceLabel) VALUES (?, ?)', faces) is None:
+                return []
+            # 同一事务内 AUTOINCREMENT 连续分配，由最后一个 FaceID 倒推全部 FaceID
+            last_id = self.execute_query('SELECT last_insert_rowid()', fetch_one=True)[0]
+        return list(range(last_id - len(faces) + 1, last_id + 1))
 
     def execute_query(self, query, params=(), fetch_one=False):
         if self.conn is None:
             print("数据库连接未初始化。")
             return None
 
-        with closing(self.conn.cursor()) as cursor:
+        with self.pool.write_lock, closing(self.conn.cursor()) as cursor:
             try:
                 cursor.execute(query, params)
-                self.conn.commit()
+                self.commit()
                 return cursor.fetchone() if fetch_one else cursor.fetchall()
             except sqlite3.DatabaseError as e:
                 print(f"执行查询时出错: {query}, 错误: {e}")
                 return None
 
+    @contextmanager
+    def read_cursor(self):
+        # 只读游标：WAL 模式下使用连接池中的只读连接，不等待写事务；当前线程在事务中时使用写连接，以读到事务中尚未提交的数据
+        if not self.pool.use_readers or self.pool.in_transaction():
+            with self.pool.write_lock, closing(self.conn.cursor()) as cursor:
+                yield cursor
+        else:
+            with self.pool.reader() as conn, closing(conn.cursor()) as cursor:
+                yield cursor
+
+    def execute_read(self, query, params=(), fetch_one=False, row_type=None):
+        # 只读查询；指定 row_type（namedtuple 类型）时每行转换为该类型
+        if self.conn is None:
+            print("数据库连接未初始化。")
+            return None
+
+        with self.read_cursor() as cursor:
+            try:
+                if row_type is not None:
+                    cursor.row_factory = lambda _, row: row_type._make(row)
+                cursor.execute(query, params)
+                return cursor.fetchone() if fetch_one else cursor.fetchall()
+            except sqlite3.DatabaseError as e:
+                print(f"执行查询时出错: {query}, 错误: {e}")
+                return None
+
+    def query_photo_columns(self, columns, columnar=False):
+        """
+        只读取照片表中指定的列，按 PhotoID 排序
+
+        参数:
+        columns (tuple): 列名，必须是 PHOTO_COLUMNS 中的列
+        columnar (bool): True 时按列返回，逐页读取，不为每张照片保留一个行对象，适合很大的照片库
+
+        返回:
+        list: 默认返回行列表，每行可以按列名取值，例如 row.FilePath
+        dict: columnar 为 True 时返回 {列名: 该列的全部值}，PhotoID 列为 array('q')，其余列为 list
+        """
+        columns = tuple(columns)
+        unknown = [column for column in columns if column not in PHOTO_COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的照片列: {unknown}")
+        query = f"SELECT {', '.join(columns)} FROM PhotoInfoTable ORDER BY PhotoID"
+        if not columnar:
+            return self.execute_read(query, row_type=photo_row_type(columns))
+
+        if self.conn is None:
+            print("数据库连接未初始化。")
+            return None
+        result = {column: array('q') if column == 'PhotoID' else [] for column in columns}
+        with self.read_cursor() as cursor:
+            try:
+                cursor.execute(query)
+                while True:
+                    rows = cursor.fetchmany(PAGE_SIZE)
+                    if not rows:
+                        break
+                    for column, values in zip(columns, zip(*rows)):
+                        result[column].extend(values)
+            except sqlite3.DatabaseError as e:
+                print(f"执行查询时出错: {query}, 错误: {e}")
+                return None
+        return result
+
+    def execute_many(self, query, seq_of_params):
+        # 批量执行同一条写语句，返回影响的行数
+        if self.conn is None:
+            print("数据库连接未初始化。")
+            return None
+
+        with self.pool.write_lock, closing(self.conn.cursor()) as cursor:
+            try:
+                cursor.executemany(query, seq_of_params)
+                self.commit()
+                return cursor.rowcount
+            except sqlite3.DatabaseError as e:
+                print(f"执行批量查询时出错: {query}, 错误: {e}")
+                return None
+
     def get_max_face_id(self):
         query = "SELECT MAX(FaceID) FROM Faces"
-        result = self.execute_query(query, fetch_one=True)
+        result = self.execute_read(query, fetch_one=True)
         return result[0] if result else None
 
     def link_face_to_photo(self, photo_id, face_id):
-        query = 'INSERT INTO PhotoFaceLink (PhotoID, FaceID) VALUES (?, ?)'
+        query = 'INSERT OR IGNORE INTO PhotoFaceLink (PhotoID, FaceID) VALUES (?, ?)'
         try:
             self.execute_query(query, (photo_id, face_id))
             print(f"成功关联照片ID {photo_id} 和人脸ID {face_id}")  # 添加调试信息
         except Exception as e:
             print(f"关联照片ID {photo_id} 和人脸ID {face_id} 时出错: {e}")  # 添加错误信息
 
+    def link_faces(self, links):
+        # 批量写入照片与人脸的关联，links 的每个元素是 (PhotoID, FaceID)，已存在的关联被忽略，
+        # 同一张照片中匹配到同一人物的多张人脸只记录一次
+        query = 'INSERT OR IGNORE INTO PhotoFaceLink (PhotoID, FaceID) VALUES (?, ?)'
+        self.execute_many(query, links)
+
     def query_photo_info_by_hash(self, file_hash):
-        result = self.execute_query('SELECT * FROM PhotoInfoTable WHERE FileHash=?', (file_hash,), True)
+        result = self.execute_read('SELECT * FROM PhotoInfoTable WHERE FileHash=?', (file_hash,), True)
         if result:
             print(f"成功查询到照片信息: {result}")  # 添加调试信息
         else:
             print(f"未查询到照片信息，文件哈希: {file_hash}")  # 添加调试信息
         return result
 
+    def query_photo_id_by_hash(self, file_hash):
+        # 只取 PhotoID，用于查重和把文件哈希转换为照片 ID，不存在时返回 None
+        row = self.execute_read('SELECT PhotoID FROM PhotoInfoTable WHERE FileHash=?', (file_hash,), True)
+        return row[0] if row else None
+
+    def query_file_fingerprint(self, source_path, file_size, mtime, inode):
+        # 源文件大小、修改时间和 inode 都未变化时返回上次计算的哈希，否则返回 None
+        result = self.execute_read('''
+            SELECT FileHash FROM FileFingerprints WHERE SourcePath=? AND FileSize=? AND MTime=? AND Inode=?
+        ''', (source_path, file_size, mtime, inode), True)
+        return result[0] if result else None
+
+    def add_file_fingerprints(self, fingerprints):
+        # 批量写入文件指纹，每个元素是 (SourcePath, FileSize, MTime, Inode, FileHash)，同一路径覆盖旧记录
+        if fingerprints:
+            self.execute_many('INSERT OR REPLACE INTO FileFingerprints VALUES (?, ?, ?, ?, ?)', fingerprints)
+
     def query_faces_by_photo(self, photo_id):
         """
         查询与特定照片ID关联的所有人脸信息
@@ -135,7 +755,7 @@ class DBprocess:
             WHERE PFL.PhotoID = ?
         '''
         try:  # 添加 try 块，用于捕捉和处理异常
-            result = self.execute_query(query, (photo_id,))
+            result = self.execute_read(query, (photo_id,))
             if result is None:  # 添加检查，确保返回结果不是 None
                 print(f"没有找到与照片ID {photo_id} 关联的人脸信息")  # 打印调试信息
                 return []
@@ -144,6 +764,26 @@ class DBprocess:
             print(f"查询人脸信息时发生错误: {e}")  # 打印错误信息
             return []
 
+    def query_photos_by_faces(self, face_ids):
+        """
+        查询包含任一给定人脸的照片，例如相似人脸搜索的结果
+
+        参数:
+        face_ids (list): FaceID 列表
+
+        返回:
+        list: 照片信息列表，每张照片只出现一次
+        """
+        face_ids = list(face_ids)
+        if not face_ids:
+            return []
+        placeholders = ', '.join('?' * len(face_ids))
+        return self.execute_read(f'''
+            SELECT * FROM PhotoInfoTable WHERE PhotoID IN (
+                SELECT PhotoID FROM PhotoFaceLink WHERE FaceID IN ({placeholders})
+            )
+        ''', face_ids)
+
     def add_photo_info(self, photo_info):
         try:
             self.execute_query('''
@@ -154,6 +794,17 @@ class DBprocess:
         except Exception as e:
             print(f"添加照片信息失败: {e}")
 
+    def add_photo_infos(self, photo_infos):
+        # 批量添加照片信息，每个元素的格式与 add_photo_info 相同
+        try:
+            self.execute_many('''
+                        INSERT OR IGNORE INTO PhotoInfoTable
+                        (FileName, FileSize, FileFormat, CaptureTime, IsCaptureTimeAccurate, CaptureLocation, CameraModel, FilePath, Thumbnail, ThumbnailPath, FileHash, IsLandscape)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', [photo_info[:12] for photo_info in photo_infos])
+        except Exception as e:
+            print(f"批量添加照片信息失败: {e}")
+
     def update_photo_info(self, photo_id, new_info):
         self.execute_query('''
                     UPDATE PhotoInfoTable
@@ -172,32 +823,162 @@ class DBprocess:
     # 清除所有照片的方法
     def clear_all_photos(self):
         try:
-            with self.conn:
+            with self.transaction():
                 query = "DELETE FROM PhotoInfoTable"
                 self.execute_query(query)
                 query = "DELETE FROM PhotoFaceLink"
                 self.execute_query(query)  # 同时清除人脸关系表中的信息
                 query = "DELETE FROM Faces"
                 self.execute_query(query)  # 同时清除人脸表中的信息
+                query = "DELETE FROM FaceEmbeddings"
+                self.execute_query(query)  # 人脸编码矩阵在下次打开时随之清空
+                query = "DELETE FROM ThumbnailBlobs"
+                self.execute_query(query)  # 打包缩略图文件在下次导入时随之清空
             print("成功清除所有照片信息")
         except Exception as e:
             print(f"清除所有照片时出现错误: {e}")
 
     def delete_photo_info(self, photo_id):
         try:
-            self.execute_query('DELETE FROM PhotoInfoTable WHERE PhotoID=?', (photo_id,))
-            self.execute_query('DELETE FROM PhotoFaceLink WHERE PhotoID=?', (photo_id,))  # 同时删除人脸关系表中的信息
+            with self.transaction():
+                self.execute_query('''
+                    DELETE FROM ThumbnailBlobs WHERE FileHash IN (SELECT FileHash FROM PhotoInfoTable WHERE PhotoID=?)
+                ''', (photo_id,))
+                self.execute_query('DELETE FROM PhotoInfoTable WHERE PhotoID=?', (photo_id,))
+                self.execute_query('DELETE FROM PhotoFaceLink WHERE PhotoID=?', (photo_id,))  # 同时删除人脸关系表中的信息
         except Exception as e:
             print(f"删除照片信息失败: {e}")
 
     def query_all_photo_info(self):
-        return self.execute_query('SELECT * FROM PhotoInfoTable')
+        return self.execute_read('SELECT * FROM PhotoInfoTable')
 
     def query_all_photo_info_face(self):
-        return self.execute_query('SELECT * FROM PhotoInfoTable,PhotoFaceLink,Faces where PhotoInfoTable.PhotoID=PhotoFaceLink.PhotoID and PhotoFaceLink.FaceID=Faces.FaceID')
+        # 照片表只取最初的列，保证人脸关联和人脸表的列位置不随照片表新增的列变化
+        columns = ', '.join(f'PhotoInfoTable.{column}' for column in PHOTO_INFO_COLUMNS.split(', '))
+        return self.execute_read(f'SELECT {columns}, PhotoFaceLink.*, Faces.* FROM PhotoInfoTable,PhotoFaceLink,Faces where PhotoInfoTable.PhotoID=PhotoFaceLink.PhotoID and PhotoFaceLink.FaceID=Faces.FaceID')
+
+    def photos_by_date(self, after_key=None, limit=PAGE_SIZE, descending=False):
+        """
+        按拍摄时间分页查询照片，使用 (CaptureKey, PhotoID) 索引做键集分页，不需要 OFFSET，也不在 Python 中排序
+
+        参数:
+        after_key (tuple): 上一页最后一张照片的 (CaptureKey, PhotoID)，None 表示查询第一页
+        limit (int): 每页最多的照片数
+        descending (bool): True 表示从最新的照片开始
+
+        返回:
+        list: [(PhotoID, FilePath, ThumbnailPath, CaptureTime, FileHash, CaptureKey), ...]，可以按列名取值；
+        下一页的 after_key 为最后一行的 (CaptureKey, PhotoID)。拍摄时间无法识别的照片 CaptureKey 为空字符串，排在最早
+        """
+        order = 'DESC' if descending else 'ASC'
+        where = ''
+        params = ()
+        if after_key is not None:
+            where = f"WHERE (CaptureKey, PhotoID) {'<' if descending else '>'} (?, ?)"
+            params = tuple(after_key)
+        return self.execute_read(f'''
+            SELECT PhotoID, FilePath, ThumbnailPath, CaptureTime, FileHash, CaptureKey FROM PhotoInfoTable
+            {where}
+            ORDER BY CaptureKey {order}, PhotoID {order}
+            LIMIT ?
+        ''', params + (limit,), row_type=photo_row_type(GRID_PHOTO_COLUMNS + ('CaptureKey',)))
+
+    @staticmethod
+    def month_seek_key(month, descending=False):
+        """
+        按日期分页时跳转到某个月份：返回紧挨在该月第一张照片之前的 after_key，直接从该月份开始查询，不读取之前的页
+
+        参数:
+        month (str): 'YYYY-MM'，拍摄时间无法识别的照片为 ''
+        descending (bool): 与 photos_by_date 的排序方向相同
+
+        返回:
+        tuple: 传给 photos_by_date 的 (CaptureKey, PhotoID)
+        """
+        if not descending:
+            return month, 0  # 该月的 CaptureKey 都以 month 为前缀，比 month 本身大；PhotoID 从 1 开始
+        if month:
+            return month + '~', 0  # CaptureKey 只含数字、'-'、' ' 和 ':'，都小于 '~'
+        return '', MAX_PHOTO_ID
+
+    def query_persons(self, descending=False):
+        """
+        人物列表：每个有照片的人物一行，照片数读取 PersonStats，封面为该人物最早导入的照片
+
+        参数:
+        descending (bool): True 表示按 FaceID 从大到小排列
+
+        返回:
+        list: [(FaceID, FaceLabel, 照片数, 封面 FileHash, 封面 ThumbnailPath), ...]
+        """
+        order = 'DESC' if descending else 'ASC'
+        return self.execute_read(f'''
+            SELECT F.FaceID, F.FaceLabel, S.PhotoCount, P.FileHash, P.ThumbnailPath FROM Faces F
+            JOIN PersonStats S ON S.FaceID = F.FaceID AND S.PhotoCount > 0
+            LEFT JOIN PhotoInfoTable P ON P.PhotoID = (SELECT MIN(L.PhotoID) FROM PhotoFaceLink L WHERE L.FaceID = F.FaceID)
+            ORDER BY F.FaceID {order}
+        ''')
+
+    def photos_by_person(self, face_id, after_photo_id=None, limit=PAGE_SIZE):
+        """
+        分页查询一个人物的照片，按 PhotoID 排序，使用 (FaceID, PhotoID) 索引做键集分页
+
+        参数:
+        face_id (int): 人物的 FaceID
+        after_photo_id (int): 上一页最后一张照片的 PhotoID，None 表示查询第一页
+        limit (int): 每页最多的照片数
+
+        返回:
+        list: [(PhotoID, FilePath, ThumbnailPath, CaptureTime, FileHash), ...]，可以按列名取值
+        """
+        return self.execute_read('''
+            SELECT P.PhotoID, P.FilePath, P.ThumbnailPath, P.CaptureTime, P.FileHash FROM PhotoFaceLink L
+            JOIN PhotoInfoTable P ON P.PhotoID = L.PhotoID
+            WHERE L.FaceID = ? AND L.PhotoID > ?
+            ORDER BY L.PhotoID
+            LIMIT ?
+        ''', (face_id, -1 if after_photo_id is None else after_photo_id, limit), row_type=photo_row_type(GRID_PHOTO_COLUMNS))
+
+    def search_photos(self, text, limit=PAGE_SIZE, offset=0):
+        """
+        在文件名、相机型号、拍摄地点和人物姓名中全文搜索照片，按相关度（bm25）排序
+
+        bm25 需要统计每个词在整个照片库中出现的照片数，常见的词（例如 IMG、相机品牌）可能匹配大部分照片，
+        排序的代价随之增长。因此匹配数超过 SEARCH_RANK_LIMIT 时不计算相关度，按导入先后从新到旧排列。
+
+        参数:
+        text (str): 搜索内容，以空格分隔的每个词都要匹配，按词的前缀匹配
+        limit (int): 每页最多的照片数
+        offset (int): 跳过前面已经取得的照片数
+
+        返回:
+        list: [(PhotoID, FilePath, ThumbnailPath, CaptureTime, FileHash), ...]，可以按列名取值
+        """
+        match = search_match_expression(text)
+        if not match:
+            return []
+        # 不计算相关度时读取匹配很快，先确定匹配数是否超过 SEARCH_RANK_LIMIT
+        count = self.execute_read('''
+            SELECT COUNT(*) FROM (SELECT rowid FROM PhotoSearch WHERE PhotoSearch MATCH ? LIMIT ?)
+        ''', (match, SEARCH_RANK_LIMIT + 1), True)
+        if not count or not count[0]:
+            return []
+        order = 'S.rank' if count[0] <= SEARCH_RANK_LIMIT else 'S.rowid DESC'
+        return self.execute_read(f'''
+            SELECT P.PhotoID, P.FilePath, P.ThumbnailPath, P.CaptureTime, P.FileHash FROM PhotoSearch S
+            JOIN PhotoInfoTable P ON P.PhotoID = S.rowid
+            WHERE PhotoSearch MATCH ?
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+        ''', (match, limit, offset), row_type=photo_row_type(GRID_PHOTO_COLUMNS))
+
+    def merge_search_index(self, pages=SEARCH_MERGE_PAGES):
+        # 合并全文索引中逐条写入产生的小段，最多写入 pages 页。不做完整的 'optimize'：照片多时重写整个索引
+        # 需要较长时间并一直持有写锁，剩余的小段由 FTS5 的自动合并和之后的导入继续处理
+        self.execute_query("INSERT INTO PhotoSearch (PhotoSearch, rank) VALUES ('merge', ?)", (pages,))
 
     def query_photo_info(self, photo_id):
-        return self.execute_query('SELECT * FROM PhotoInfoTable WHERE PhotoID=?', (photo_id,))
+        return self.execute_read('SELECT * FROM PhotoInfoTable WHERE PhotoID=?', (photo_id,))
 
     # def update_person_name(self, old_name, new_name):
     #     self.execute_query('UPDATE Faces SET FaceLabel = ? WHERE FaceLabel = ?', (new_name, old_name))
@@ -206,17 +987,96 @@ class DBprocess:
         self.execute_query('INSERT INTO SWConfig VALUES (?, ?, ?, ?)', config)
     
     def query_all_faces(self):
-        return self.execute_query('SELECT * FROM Faces')
+        return self.execute_read('SELECT * FROM Faces')
+
+    def query_face_labels(self):
+        # 只取 FaceID 和 FaceLabel，不读取人脸编码
+        return self.execute_read('SELECT FaceID, FaceLabel FROM Faces')
+
+    def query_faces_without_embedding(self):
+        # 还没有写入人脸编码矩阵的旧人脸记录
+        return self.execute_read('''
+            SELECT F.FaceID, F.FaceHash FROM Faces F
+            LEFT JOIN FaceEmbeddings E ON F.FaceID = E.FaceID
+            WHERE E.FaceID IS NULL
+            ORDER BY F.FaceID
+        ''')
+
+    def query_face_detection(self, file_hash, settings_key):
+        # 返回 (FaceLocations, FaceLandmarks, Encodings)，没有缓存时返回 None
+        return self.execute_read('''
+            SELECT FaceLocations, FaceLandmarks, Encodings FROM FaceDetectionCache WHERE FileHash=? AND SettingsKey=?
+        ''', (file_hash, settings_key), True)
+
+    def add_face_detections(self, detections):
+        # detections 的每个元素是 (FileHash, SettingsKey, FaceLocations, FaceLandmarks, Encodings)
+        if detections:
+            self.execute_many('INSERT OR REPLACE INTO FaceDetectionCache VALUES (?, ?, ?, ?, ?)', detections)
+
+    def has_face_embeddings(self):
+        return bool(self.execute_read('SELECT 1 FROM FaceEmbeddings LIMIT 1'))
+
+    def query_face_embedding_rows(self):
+        return self.execute_read('SELECT FaceID, EmbeddingRow FROM FaceEmbeddings ORDER BY EmbeddingRow')
+
+    def add_face_embedding_rows(self, rows):
+        # rows 的每个元素是 (FaceID, EmbeddingRow)
+        if rows:
+            self.execute_many('INSERT OR REPLACE INTO FaceEmbeddings (FaceID, EmbeddingRow) VALUES (?, ?)', rows)
+
+    def query_thumbnail_blobs(self, size):
+        # 返回指定尺寸的 [(FileHash, Offset, Length), ...]，按在打包文件中的位置排序
+        return self.execute_read('SELECT FileHash, Offset, Length FROM ThumbnailBlobs WHERE Size=? ORDER BY Offset', (size,))
+
+    def query_thumbnail_pack_end(self):
+        # 打包缩略图文件中已记录的数据的末尾位置
+        row = self.execute_read('SELECT MAX(Offset + Length) FROM ThumbnailBlobs', fetch_one=True)
+        return row[0] if row and row[0] is not None else 0
+
+    def add_thumbnail_blobs(self, blobs):
+        # blobs 的每个元素是 (FileHash, Size, Offset, Length)
+        if blobs:
+            self.execute_many('INSERT OR REPLACE INTO ThumbnailBlobs (FileHash, Size, Offset, Length) VALUES (?, ?, ?, ?)', blobs)
+
+    def query_library_stats(self):
+        """
+        读取由触发器维护的统计信息，不扫描照片表
+
+        返回:
+        dict: {'PhotoCount': 照片数, 'TotalBytes': 照片总字节数, 'FaceCount': 人脸数}
+        """
+        stats = {'PhotoCount': 0, 'TotalBytes': 0, 'FaceCount': 0}
+        stats.update(self.execute_read('SELECT Name, Value FROM LibraryStats') or [])
+        return stats
+
+    def query_month_counts(self, descending=False):
+        """
+        每月照片数，顺序与 photos_by_date 相同
+
+        返回:
+        list: [('YYYY-MM', 照片数), ...]，拍摄时间无法识别的照片计入月份 ''
+        """
+        order = 'DESC' if descending else 'ASC'
+        return self.execute_read(f'SELECT Month, PhotoCount FROM MonthStats WHERE PhotoCount > 0 ORDER BY Month {order}')
+
+    def query_person_photo_counts(self):
+        # 每个人物（FaceID）关联的照片数，返回 [(FaceID, FaceLabel, 照片数), ...]
+        return self.execute_read('''
+            SELECT F.FaceID, F.FaceLabel, COALESCE(S.PhotoCount, 0) FROM Faces F
+            LEFT JOIN PersonStats S ON F.FaceID = S.FaceID
+        ''')
 
     def update_sw_config(self, key, new_value):
         self.execute_query(f'UPDATE SWConfig SET {key}=?', (new_value,))
 
     def get_sw_config(self, key):
-        return self.execute_query(f'SELECT {key} FROM SWConfig', fetch_one=True)
+        return self.execute_read(f'SELECT {key} FROM SWConfig', fetch_one=True)
 
     def close(self):
+        # 连接由连接池共用，最后一个使用者关闭时才真正断开
         if self.conn:
-            self.conn.close()
+            self.conn = None
+            self.pool.release()
 
 # 示例使用
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import face_encoder
+from photo_ingest import iter_photo_files
+
+# 对比原图检测和缩小后检测的速度与召回率
+# 用法: python benchmark_face_detection.py [照片目录] [长边像素数 ...]
+
+
+def box_iou(a, b):
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    if right <= left or bottom <= top:
+        return 0.0
+    intersection = (right - left) * (bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return intersection / (area_a + area_b - intersection)
+
+
+def detect_all(images, detection_max_edge):
+    start = time.perf_counter()
+    results = [face_encoder.locate_faces(image_array, detection_max_edge) for image_array in images]
+    return results, time.perf_counter() - start
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'photo_examples')
+    max_edges = [int(edge) for edge in sys.argv[2:]] or [2400, 1600, 1024, 800]
+
+    face_encoder.init_face_worker()
+    paths = sorted(iter_photo_files(folder))
+    images = [face_encoder._face_recognition.load_image_file(path) for path in paths]
+
+    baseline, baseline_time = detect_all(images, None)
+    baseline_faces = sum(len(boxes) for boxes in baseline)
+    print(f"照片数: {len(images)}，原图检测到人脸: {baseline_faces}")
+    print(f"{'长边':>8} {'耗时(s)':>10} {'张/秒':>8} {'加速':>6} {'人脸数':>6} {'召回率':>8}")
+    print(f"{'原图':>8} {baseline_time:>10.2f} {len(images) / baseline_time:>8.2f} {1.0:>6.2f} {baseline_faces:>6} {1.0:>8.2%}")
+
+    for max_edge in max_edges:
+        results, elapsed = detect_all(images, max_edge)
+        # 与原图检测结果按 IoU >= 0.5 匹配，统计召回率
+        matched = sum(
+            1 for reference, boxes in zip(baseline, results)
+            for ref_box in reference if any(box_iou(ref_box, box) >= 0.5 for box in boxes)
+        )
+        found = sum(len(boxes) for boxes in results)
+        recall = matched / baseline_faces if baseline_faces else 1.0
+        print(f"{max_edge:>8} {elapsed:>10.2f} {len(images) / elapsed:>8.2f} {baseline_time / elapsed:>6.2f} {found:>6} {recall:>8.2%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    人脸编码矩阵存储
+
+    所有人脸编码以 float32 按行追加写入一个文件，读取时通过内存映射得到一个 (n, 128) 的数组，
+    不需要为每张人脸创建 Python 对象。FaceID 与行号的对应关系保存在数据库的 FaceEmbeddings 表中。
+    read_only 为 True 时只读取，不截断、不迁移编码文件，可以在导入正在追加编码时使用。
+    """
+    dimensions = 128
+
+    def __init__(self, db_processor, file_path=None, read_only=False):
+        self.db_processor = db_processor
+        self.file_path = file_path or db_processor.config.get('EmbeddingFilePath', 'data/face_embeddings.f32')
+        self.row_bytes = self.dimensions * np.dtype(np.float32).itemsize
+        if not read_only:
+            db_processor.ensure_directory_exists(os.path.dirname(self.file_path))
+            self.open()
+
+    def open(self):
+        # 截掉上次异常退出时没写完的行；数据库中没有任何行号记录时（例如清除数据后）清空文件
+        if os.path.exists(self.file_path):
+            size = os.path.getsize(self.file_path)
+            valid_size = size - size % self.row_bytes if self.db_processor.has_face_embeddings() else 0
+            if valid_size != size:
+                with open(self.file_path, 'r+b') as f:
+                    f.truncate(valid_size)
+
+        # 把旧版本保存在 Faces.FaceHash 中的编码迁移到矩阵文件
+        legacy_faces = self.db_processor.query_faces_without_embedding() or []
+        if legacy_faces:
+            with self.db_processor.transaction():
+                self.append([face_id for face_id, _ in legacy_faces],
+                            [np.frombuffer(face_hash, dtype=np.float64) for _, face_hash in legacy_faces])
+            print(f"已将 {len(legacy_faces)} 个人脸编码迁移到编码矩阵文件")
+
+    def __len__(self):
+        if not os.path.exists(self.file_path):
+            return 0
+        return os.path.getsize(self.file_path) // self.row_bytes
+
+    def matrix(self):
+        # 整个编码矩阵的只读内存映射，不复制数据
+        rows = len(self)
+        if rows == 0:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        return np.memmap(self.file_path, dtype=np.float32, mode='r', shape=(rows, self.dimensions))
+
+    def row_face_ids(self):
+        # 每一行对应的 FaceID，没有对应人脸的行为 -1
+        face_ids = np.full(len(self), -1, dtype=np.int64)
+        rows = np.array(self.db_processor.query_face_embedding_rows() or [], dtype=np.int64).reshape(-1, 2)
+        rows = rows[rows[:, 1] < len(face_ids)]
+        face_ids[rows[:, 1]] = rows[:, 0]
+        return face_ids
+
+    def load(self):
+        """
+        读取所有有效的人脸编码
+
+        返回:
+        tuple: (face_ids, encodings)，face_ids 为 int64 数组，encodings 为 (n, 128) float32 数组；
+        所有行都有效时 encodings 就是内存映射本身
+        """
+        face_ids = self.row_face_ids()
+        matrix = self.matrix()
+        valid = face_ids >= 0
+        if valid.all():
+            return face_ids, matrix
+        return face_ids[valid], matrix[valid]
+
+    def append(self, face_ids, encodings):
+        """
+        追加人脸编码并记录行号，应在调用方的事务中执行，使行号记录与人脸记录一起提交
+
+        参数:
+        face_ids (list): FaceID 列表
+        encodings (list): 与 face_ids 一一对应的 128 维编码
+        """
+        if len(face_ids) == 0:
+            return
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimensions)
+        start_row = len(self)
+        with open(self.file_path, 'ab') as f:
+            f.write(encodings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())  # 先保证编码落盘，再提交数据库中的行号
+        self.db_processor.add_face_embedding_rows(
+            [(int(face_id), start_row + i) for i, face_id in enumerate(face_ids)])
@@ -0,0 +1,66 @@
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+# 与已有人脸的距离小于该值时视为同一个人，剩余人脸之间的聚类也使用同一个距离
+MATCH_DISTANCE = 0.6
+MIN_SAMPLES = 3
+
+# 分块计算距离时每块的行数，限制临时距离矩阵的内存
+EXISTING_CHUNK_SIZE = 16384
+QUERY_CHUNK_SIZE = 1024
+
+
+def nearest_existing(existing_encodings, encodings):
+    """
+    为每个新编码查找距离最近的已有编码（分块暴力计算）
+
+    参数:
+    existing_encodings (numpy.ndarray): (n, 128) 已有编码，可以是内存映射
+    encodings (numpy.ndarray): (m, 128) 新编码
+
+    返回:
+    tuple: (indices, distances)，没有已有编码时 indices 全为 -1，distances 全为 inf
+    """
+    encodings = np.asarray(encodings, dtype=np.float32)
+    best_indices = np.full(len(encodings), -1, dtype=np.int64)
+    best_squared = np.full(len(encodings), np.inf, dtype=np.float32)
+
+    for query_start in range(0, len(encodings), QUERY_CHUNK_SIZE):
+        queries = encodings[query_start:query_start + QUERY_CHUNK_SIZE]
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        for start in range(0, len(existing_encodings), EXISTING_CHUNK_SIZE):
+            chunk = np.asarray(existing_encodings[start:start + EXISTING_CHUNK_SIZE], dtype=np.float32)
+            # |a - b|^2 = |a|^2 - 2ab + |b|^2
+            squared = query_norms[:, None] - 2 * queries @ chunk.T + np.einsum('ij,ij->i', chunk, chunk)[None, :]
+            chunk_best = squared.argmin(axis=1)
+            chunk_squared = squared[np.arange(len(queries)), chunk_best]
+            improved = chunk_squared < best_squared[query_start:query_start + len(queries)]
+            best_indices[query_start:query_start + len(queries)][improved] = start + chunk_best[improved]
+            best_squared[query_start:query_start + len(queries)][improved] = chunk_squared[improved]
+
+    return best_indices, np.sqrt(np.maximum(best_squared, 0))
+
+
+def assign_faces(face_index, encodings, eps=MATCH_DISTANCE, min_samples=MIN_SAMPLES):
+    """
+    增量人脸归类：先把新编码与已有人脸做最近邻匹配，只对没有匹配上的剩余编码重新聚类
+
+    参数:
+    face_index (FaceIndex): 已有人脸编码的索引
+    encodings (numpy.ndarray): (m, 128) 本次新检测到的编码
+    eps (float): 匹配和聚类的距离阈值
+    min_samples (int): 剩余编码聚类时成簇所需的最少人脸数
+
+    返回:
+    tuple: (matches, clusters)，均为长度 m 的数组。matches[i] >= 0 表示归入编码矩阵第 matches[i] 行的已有人脸；
+    否则 clusters[i] >= 0 表示剩余编码之间的新簇编号，-1 表示噪声（单独成为一个新人物）
+    """
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, face_index.embedding_store.dimensions)
+    matches, distances = face_index.nearest(encodings)
+    matches[distances >= eps] = -1
+
+    clusters = np.full(len(encodings), -1, dtype=np.int64)
+    leftovers = np.flatnonzero(matches < 0)
+    if len(leftovers) >= min_samples:
+        clusters[leftovers] = DBSCAN(eps=eps, min_samples=min_samples, metric="euclidean").fit(encodings[leftovers]).labels_
+    return matches, clusters
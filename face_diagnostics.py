@@ -0,0 +1,117 @@
+import os
+import json
+import numpy as np
+
+# 估计距离分布时最多采样的人脸对数，内存占用与人脸数量无关
+MAX_SAMPLE_PAIRS = 100000
+# 导入时最多保留的人脸编码数，超过后用蓄水池抽样替换，内存占用与导入的人脸数量无关
+ENCODING_SAMPLE_SIZE = 4000
+HISTOGRAM_BINS = 50
+_PAIR_BLOCK_SIZE = 10000
+
+
+class EncodingSample:
+    """
+    人脸编码的蓄水池抽样
+
+    逐批接收人脸编码，只保留 size 个均匀抽样的编码（float32），用于估计距离分布。
+    """
+
+    def __init__(self, size=ENCODING_SAMPLE_SIZE, seed=0):
+        self.encodings = np.empty((size, 128), dtype=np.float32)
+        self.seen = 0  # 已接收的人脸编码数
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, encodings):
+        size = len(self.encodings)
+        for encoding in encodings:
+            if self.seen < size:
+                self.encodings[self.seen] = encoding
+            else:
+                # 第 seen+1 个编码以 size/(seen+1) 的概率替换一个已保留的编码
+                index = self.rng.integers(0, self.seen + 1)
+                if index < size:
+                    self.encodings[index] = encoding
+            self.seen += 1
+
+    def sample(self):
+        return self.encodings[:min(self.seen, len(self.encodings))]
+
+
+def sample_pair_distances(encodings, max_pairs=MAX_SAMPLE_PAIRS, seed=0):
+    """
+    采样人脸对并计算欧氏距离；总对数不超过 max_pairs 时使用全部人脸对
+
+    参数:
+    encodings (numpy.ndarray): (n, 128) 人脸编码
+    max_pairs (int): 最多采样的人脸对数
+    seed (int): 随机种子，保证同一批数据的结果可复现
+
+    返回:
+    numpy.ndarray: 采样到的距离
+    """
+    encodings = np.asarray(encodings, dtype=np.float32)
+    count = len(encodings)
+    total_pairs = count * (count - 1) // 2
+    if total_pairs == 0:
+        return np.empty(0, dtype=np.float32)
+
+    if total_pairs <= max_pairs:
+        first, second = np.triu_indices(count, k=1)
+    else:
+        rng = np.random.default_rng(seed)
+        first = rng.integers(0, count, max_pairs)
+        second = (first + rng.integers(1, count, max_pairs)) % count  # 保证两张人脸不同
+
+    distances = np.empty(len(first), dtype=np.float32)
+    for start in range(0, len(first), _PAIR_BLOCK_SIZE):
+        end = start + _PAIR_BLOCK_SIZE
+        distances[start:end] = np.linalg.norm(encodings[first[start:end]] - encodings[second[start:end]], axis=1)
+    return distances
+
+
+def write_distance_report(encodings, output_dir, max_pairs=MAX_SAMPLE_PAIRS, total_faces=None):
+    """
+    把人脸编码距离分布的统计信息和直方图写入文件
+
+    参数:
+    encodings (numpy.ndarray): (n, 128) 人脸编码
+    output_dir (str): 输出目录，生成 face_distance_stats.json 和 face_distance_hist.png
+    total_faces (int): encodings 是抽样结果时的人脸总数，None 表示 encodings 就是全部人脸
+
+    返回:
+    dict: 统计信息
+    """
+    distances = sample_pair_distances(encodings, max_pairs)
+    counts, edges = np.histogram(distances, bins=HISTOGRAM_BINS) if len(distances) else (np.zeros(0), np.zeros(0))
+    stats = {
+        'faces': len(encodings) if total_faces is None else total_faces,
+        'sampled_faces': len(encodings),
+        'sampled_pairs': len(distances),
+        'mean': float(distances.mean()) if len(distances) else None,
+        'std': float(distances.std()) if len(distances) else None,
+        'percentiles': {str(p): float(np.percentile(distances, p)) for p in (1, 5, 25, 50, 75, 95, 99)} if len(distances) else {},
+        'histogram': {'counts': counts.astype(int).tolist(), 'bin_edges': edges.tolist()},
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'face_distance_stats.json'), 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+
+    if len(distances):
+        # 只在生成诊断报告时才导入 matplotlib，且使用不弹出窗口的后端
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        plt.rcParams['font.sans-serif'] = ['SimHei']  # 指定默认字体
+        plt.rcParams['axes.unicode_minus'] = False  # 解决保存图像时负号 '-' 显示为方块的问题
+        figure, axes = plt.subplots()
+        axes.hist(distances, bins=HISTOGRAM_BINS)
+        axes.set_xlabel('距离')
+        axes.set_ylabel('频率')
+        axes.set_title('人脸编码距离分布')
+        figure.savefig(os.path.join(output_dir, 'face_distance_hist.png'))
+        plt.close(figure)
+
+    print(f"人脸距离诊断已写入 {output_dir}")
+    return stats
@@ -0,0 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from import_pipeline import bounded_map
+
+# 人脸编码参数
+NUM_JITTERS = 5
+ENCODING_MODEL = 'large'
+# 人脸检测时图片长边的最大像素数，超过时先缩小再检测；None 表示始终在原图上检测
+DETECTION_MAX_EDGE = 1600
+
+# 检测器名称，写入检测结果缓存的设置键
+DETECTOR_MODEL = 'hog'
+
+# 工作进程内的 face_recognition 模块和检测分辨率，由 init_face_worker 设置
+_face_recognition = None
+_detection_max_edge = DETECTION_MAX_EDGE
+
+
+def init_face_worker(detection_max_edge=DETECTION_MAX_EDGE):
+    # 进程池初始化：face_recognition 在导入时加载 dlib 的人脸检测器、关键点模型和 ResNet 编码模型，
+    # 每个工作进程只导入一次，之后处理的所有照片复用这些模型
+    global _face_recognition, _detection_max_edge
+    import face_recognition
+    _face_recognition = face_recognition
+    _detection_max_edge = detection_max_edge
+
+
+def locate_faces(image_array, detection_max_edge):
+    """
+    在缩小的副本上检测人脸，再把人脸框映射回原图坐标
+
+    参数:
+    image_array (numpy.ndarray): 原始分辨率的图片
+    detection_max_edge (int): 检测用图片长边的最大像素数，None 表示不缩小
+
+    返回:
+    list: 原图坐标下的人脸框 (top, right, bottom, left)
+    """
+    height, width = image_array.shape[:2]
+    long_edge = max(height, width)
+    if not detection_max_edge or long_edge <= detection_max_edge:
+        return _face_recognition.face_locations(image_array)
+
+    scale = detection_max_edge / long_edge
+    small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    small_array = np.asarray(Image.fromarray(image_array).resize(small_size, Image.BILINEAR))
+    face_locations = []
+    for top, right, bottom, left in _face_recognition.face_locations(small_array):
+        face_locations.append((
+            max(0, int(top / scale)),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(left / scale)),
+        ))
+    return face_locations
+
+
+def face_settings_key(detection_max_edge=DETECTION_MAX_EDGE):
+    # 影响检测和编码结果的全部设置，设置不同的缓存结果不能复用
+    return f"detector={DETECTOR_MODEL};max_edge={detection_max_edge};model={ENCODING_MODEL};jitters={NUM_JITTERS}"
+
+
+def encode_photo(photo):
+    """
+    检测并编码一张照片中的所有人脸
+
+    参数:
+    photo (tuple): (photo_path, file_hash)
+
+    返回:
+    tuple: (photo_path, file_hash, face_locations, face_landmarks, face_encodings)，人脸位置为 (top, right, bottom, left)；
+    处理失败时 face_locations 和 face_landmarks 为 None，结果不应写入缓存
+    """
+    if _face_recognition is None:
+        init_face_worker()
+    photo_path, file_hash = photo
+    try:
+        image_array = _face_recognition.load_image_file(photo_path)
+        face_locations = locate_faces(image_array, _detection_max_edge)
+        # 编码仍然使用原始分辨率的图片
+        face_encodings = _face_recognition.face_encodings(image_array, known_face_locations=face_locations,
+                                                          num_jitters=NUM_JITTERS, model=ENCODING_MODEL)
+        face_landmarks = _face_recognition.face_landmarks(image_array, face_locations=face_locations) if face_locations else []
+        return photo_path, file_hash, face_locations, face_landmarks, face_encodings
+    except Exception as e:
+        print(f"人脸编码失败: {photo_path}, 错误: {e}")
+        return photo_path, file_hash, None, None, []
+
+
+def iter_face_encodings(photo_source, workers=1, detection_max_edge=DETECTION_MAX_EDGE):
+    # 按输入顺序逐张产出编码结果；workers 大于 1 时由进程池并行处理，photo_source 可以是逐步产生的流
+    if workers <= 1:
+        init_face_worker(detection_max_edge)
+        yield from bounded_map(encode_photo, photo_source)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_face_worker,
+                             initargs=(detection_max_edge,)) as executor:
+        yield from bounded_map(encode_photo, photo_source, executor)
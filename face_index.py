@@ -0,0 +1,277 @@
+import os
+import threading
+import numpy as np
+from face_clustering import nearest_existing, MATCH_DISTANCE
+from embedding_store import EmbeddingStore
+from face_encoder import encode_photo
+
+# 人脸数少于该值时不划分聚类中心，直接精确比对全部人脸
+MIN_TRAIN_SIZE = 20000
+# 人脸数增长到上次训练时的若干倍后重新训练聚类中心
+RETRAIN_FACTOR = 4
+# 查询时搜索的最近聚类中心数
+NPROBE = 16
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE_PER_LIST = 32
+_ASSIGN_BLOCK_SIZE = 65536
+
+# 每个数据库在本进程中共用的人脸索引，数据库路径 -> FaceIndex
+_shared_indexes = {}
+_shared_indexes_lock = threading.Lock()
+
+
+class FaceIndex:
+    """
+    人脸编码的倒排文件（IVF）索引
+
+    用 k-means 聚类中心把人脸编码矩阵的每一行划分到一个列表中，查询时只比对距离最近的 nprobe 个列表。
+    聚类中心和每一行所属的列表保存在索引文件中，编码本身仍从 EmbeddingStore 的内存映射中读取。
+    查询和更新可以在不同线程中进行，由 lock 保证查询看到的是完整的一次更新；read_only 为 True 时不写索引文件。
+    """
+
+    def __init__(self, embedding_store, index_path=None, nprobe=NPROBE, read_only=False):
+        self.embedding_store = embedding_store
+        self.index_path = index_path or embedding_store.db_processor.config.get('FaceIndexFilePath', 'data/face_index.npz')
+        self.nprobe = nprobe
+        self.read_only = read_only
+        self.lock = threading.RLock()
+        self.centroids = np.empty((0, embedding_store.dimensions), dtype=np.float32)
+        self.row_lists = np.empty(0, dtype=np.int32)  # 每一行所属的列表编号
+        self.trained_rows = 0  # 上次训练聚类中心时的人脸数
+        self.load()
+        self.sync()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with np.load(self.index_path) as data:
+                centroids = data['centroids']
+                row_lists = data['row_lists']
+                trained_rows = int(data['trained_rows'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"人脸索引文件无法读取，将重新建立: {e}")
+            return
+        # 编码矩阵被清空或截断后，旧索引不再有效
+        if len(row_lists) <= len(self.embedding_store):
+            self.centroids, self.row_lists, self.trained_rows = centroids, row_lists, trained_rows
+
+    def save(self):
+        # 先写临时文件再替换，避免写到一半时留下损坏的索引
+        with self.lock:
+            if self.read_only:
+                return
+            temp_path = self.index_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                np.savez(f, centroids=self.centroids, row_lists=self.row_lists, trained_rows=np.array(self.trained_rows))
+            os.replace(temp_path, self.index_path)
+
+    def sync(self):
+        """
+        把编码矩阵中尚未建立索引的行加入索引并保存；人脸数增长较多时重新训练聚类中心
+        """
+        with self.lock:
+            self.matrix = self.embedding_store.matrix()
+            self.row_face_ids = self.embedding_store.row_face_ids()
+            total_rows = len(self.matrix)
+            indexed_rows = len(self.row_lists)
+
+            if total_rows < indexed_rows:
+                self.trained_rows = 0
+                indexed_rows = 0
+            if self.needs_training(total_rows):
+                self.train()
+            elif total_rows > indexed_rows:
+                self.row_lists = np.concatenate([self.row_lists[:indexed_rows], self.assign_rows(indexed_rows, total_rows)])
+
+            self.build_lists()
+            if len(self.row_lists) != indexed_rows or not os.path.exists(self.index_path):
+                self.save()
+
+    def attach(self, embedding_store):
+        """
+        导入开始时调用：改为使用导入方已整理好的编码存储（截断未写完的行、迁移旧编码之后），
+        同步到编码矩阵文件的当前状态，之后可以写索引文件
+        """
+        with self.lock:
+            self.embedding_store = embedding_store
+            self.read_only = False
+            self.sync()
+
+    def extend(self, face_ids):
+        """
+        EmbeddingStore.append 之后把新追加的行加入索引，不重新读取全部行号；需要时重新训练。
+        只更新内存中的索引，由调用方在一批写入结束后调用 save
+        """
+        with self.lock:
+            self.matrix = self.embedding_store.matrix()
+            indexed_rows = len(self.row_lists)
+            self.row_face_ids = np.concatenate([self.row_face_ids, np.asarray(face_ids, dtype=np.int64)])
+            if self.needs_training(len(self.matrix)):
+                self.train()
+            else:
+                self.row_lists = np.concatenate([self.row_lists, self.assign_rows(indexed_rows, len(self.matrix))])
+            self.build_lists()
+
+    def needs_training(self, total_rows):
+        if total_rows == 0:
+            return self.trained_rows != 0
+        if self.trained_rows == 0:
+            return True
+        if total_rows >= MIN_TRAIN_SIZE and (len(self.centroids) <= 1 or total_rows > self.trained_rows * RETRAIN_FACTOR):
+            return True
+        return False
+
+    def train(self):
+        total_rows = len(self.matrix)
+        self.trained_rows = total_rows
+        if total_rows < MIN_TRAIN_SIZE:
+            # 数据量小，只用一个列表，查询时精确比对
+            self.centroids = np.zeros((1 if total_rows else 0, self.embedding_store.dimensions), dtype=np.float32)
+            self.row_lists = np.zeros(total_rows, dtype=np.int32)
+            return
+
+        list_count = min(4096, int(4 * np.sqrt(total_rows)))
+        rng = np.random.default_rng(0)
+        sample_size = min(total_rows, list_count * KMEANS_SAMPLE_PER_LIST)
+        sample = np.asarray(self.matrix[np.sort(rng.choice(total_rows, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, list_count, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment, _ = nearest_existing(centroids, sample)
+            counts = np.bincount(assignment, minlength=list_count)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        self.centroids = centroids
+        self.row_lists = self.assign_rows(0, total_rows)
+        print(f"人脸索引已重新训练：{total_rows} 个人脸，{list_count} 个列表")
+
+    def assign_rows(self, start, end):
+        # 把第 start 到 end 行分配到最近的聚类中心
+        row_lists = np.empty(end - start, dtype=np.int32)
+        for block_start in range(start, end, _ASSIGN_BLOCK_SIZE):
+            block_end = min(end, block_start + _ASSIGN_BLOCK_SIZE)
+            if len(self.centroids) == 1:
+                row_lists[block_start - start:block_end - start] = 0
+            else:
+                row_lists[block_start - start:block_end - start], _ = nearest_existing(self.centroids, self.matrix[block_start:block_end])
+        return row_lists
+
+    def build_lists(self):
+        # 按列表编号排序得到每个列表包含的行号
+        self.list_rows = np.argsort(self.row_lists, kind='stable')
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.row_lists, minlength=len(self.centroids)))])
+
+    def search(self, encodings, k=10, max_distance=MATCH_DISTANCE):
+        """
+        查询与每个编码最相似的人脸
+
+        参数:
+        encodings (numpy.ndarray): (m, 128) 或 (128,) 的查询编码
+        k (int): 每个查询最多返回的人脸数
+        max_distance (float): 最大欧氏距离，None 表示不限制
+
+        返回:
+        list: 每个查询对应一个按距离升序排列的 [(行号, 距离), ...] 列表
+        """
+        with self.lock:
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.embedding_store.dimensions)
+            if len(self.row_lists) == 0:
+                return [[] for _ in encodings]
+
+            nprobe = min(self.nprobe, len(self.centroids))
+            if nprobe < len(self.centroids):
+                centroid_distances = (np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+                                      - 2 * encodings @ self.centroids.T)
+                probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+            else:
+                probes = np.tile(np.arange(len(self.centroids)), (len(encodings), 1))
+
+            results = []
+            for encoding, query_probes in zip(encodings, probes):
+                rows = np.concatenate([self.list_rows[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in query_probes])
+                rows = np.sort(rows[self.row_face_ids[rows] >= 0])  # 排除已删除的人脸，按行号顺序读取内存映射
+                distances = np.linalg.norm(self.matrix[rows] - encoding, axis=1)
+                if max_distance is not None:
+                    within = distances <= max_distance
+                    rows, distances = rows[within], distances[within]
+                if len(rows) > k:
+                    nearest = np.argpartition(distances, k - 1)[:k]
+                    rows, distances = rows[nearest], distances[nearest]
+                order = np.argsort(distances)
+                results.append(list(zip(rows[order].tolist(), distances[order].tolist())))
+            return results
+
+    def nearest(self, encodings):
+        # 每个编码最近的一行及其距离，没有结果时为 (-1, inf)
+        results = self.search(encodings, k=1, max_distance=None)
+        rows = np.array([result[0][0] if result else -1 for result in results], dtype=np.int64)
+        distances = np.array([result[0][1] if result else np.inf for result in results], dtype=np.float32)
+        return rows, distances
+
+    def search_similar_faces(self, encoding, k=10, max_distance=MATCH_DISTANCE):
+        """
+        查找与给定人脸编码相似的人脸
+
+        返回:
+        list: 按距离升序排列的 [(FaceID, 距离), ...]
+        """
+        with self.lock:
+            return [(int(self.row_face_ids[row]), distance) for row, distance in self.search(encoding, k, max_distance)[0]]
+
+
+def shared_face_index(db_processor):
+    """
+    返回该数据库在本进程中共用的人脸索引，第一次调用时以只读方式从编码矩阵文件和索引文件建立。
+    之后由导入时的 FaceProcessor 通过 extend 保持最新，查询不再重新读取 FaceEmbeddings 表，
+    也不会截断、迁移编码文件或写索引文件，导入正在追加编码时也可以查询。
+    """
+    key = os.path.abspath(db_processor.db_path)
+    with _shared_indexes_lock:
+        face_index = _shared_indexes.get(key)
+        if face_index is None:
+            face_index = FaceIndex(EmbeddingStore(db_processor, read_only=True), read_only=True)
+            _shared_indexes[key] = face_index
+        return face_index
+
+
+def open_face_index(embedding_store):
+    # 导入时使用：取得共用的人脸索引，并改为使用导入方的编码存储，导入中新增的人脸查询时立即可见
+    face_index = shared_face_index(embedding_store.db_processor)
+    face_index.attach(embedding_store)
+    return face_index
+
+
+def forget_face_index(db_processor):
+    # 清除数据后丢弃共用的人脸索引，下次使用时重新建立
+    with _shared_indexes_lock:
+        _shared_indexes.pop(os.path.abspath(db_processor.db_path), None)
+
+
+def search_similar_faces(db_processor, encoding, k=10, max_distance=MATCH_DISTANCE):
+    """
+    查找与给定人脸编码相似的人脸
+
+    参数:
+    db_processor (DBprocess): 数据库处理对象
+    encoding (numpy.ndarray): 128 维人脸编码
+    k (int): 最多返回的人脸数
+    max_distance (float): 最大欧氏距离
+
+    返回:
+    list: 按距离升序排列的 [(FaceID, 距离), ...]
+    """
+    return shared_face_index(db_processor).search_similar_faces(encoding, k, max_distance)
+
+
+def search_similar_faces_in_image(db_processor, image_path, k=10, max_distance=MATCH_DISTANCE):
+    """
+    对上传的图片做人脸检测，查找与其中每张人脸相似的人脸
+
+    返回:
+    list: 图片中每张人脸对应一个 [(FaceID, 距离), ...] 列表
+    """
+    face_encodings = encode_photo((image_path, None))[4]  # (路径, 哈希, 位置, 关键点, 编码)
+    face_index = shared_face_index(db_processor)
+    return [face_index.search_similar_faces(encoding, k, max_distance) for encoding in face_encodings]
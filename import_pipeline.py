@@ -0,0 +1,68 @@
+import threading
+from collections import deque
+
+# 阶段之间队列的容量
+STAGE_QUEUE_SIZE = 64
+# 每个进程池同时在处理中的最大任务数
+MAX_PENDING_TASKS = 64
+
+# 阶段结束标记
+STAGE_DONE = object()
+
+
+def bounded_map(fn, iterable, executor=None, max_pending=MAX_PENDING_TASKS):
+    """
+    按输入顺序逐个产出 fn(item)，同一时刻最多只有 max_pending 个任务已提交但未取走结果
+
+    与 Executor.map 不同，不会一次性提交全部输入，内存占用与输入数量无关。executor 为 None 时在当前线程中依次执行。
+    """
+    if executor is None:
+        for item in iterable:
+            yield fn(item)
+        return
+
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        # 已完成的结果尽早交出，避免输入流较慢时结果积压
+        while pending and pending[0].done():
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_queue(source_queue):
+    # 从队列中逐个取出元素，直到遇到 STAGE_DONE
+    while True:
+        item = source_queue.get()
+        if item is STAGE_DONE:
+            return
+        yield item
+
+
+def take_until(iterable, stop_event):
+    # 逐个产出元素，stop_event 被设置后不再取下一个元素
+    for item in iterable:
+        if stop_event.is_set():
+            return
+        yield item
+
+
+def start_stage(name, results, output_queue):
+    """
+    在后台线程中运行一个阶段：把 results 产出的每个结果以 (name, 结果) 放入 output_queue，
+    结束时放入 (name, STAGE_DONE)，出现异常时先放入 (name, 异常) 再结束。output_queue 已满时阶段会等待。
+    """
+    def run():
+        try:
+            for result in results:
+                output_queue.put((name, result))
+        except Exception as e:
+            output_queue.put((name, e))
+        output_queue.put((name, STAGE_DONE))
+
+    thread = threading.Thread(target=run, name=f"import-{name}", daemon=True)
+    thread.start()
+    return thread
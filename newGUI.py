@@ -1,85 +1,37 @@
 import sys
 import os
 import subprocess
-from PyQt5.QtWidgets import QScrollArea, QToolTip, QInputDialog, QScrollBar, QGridLayout, QVBoxLayout, QLabel,  QWidget, QPushButton, QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QListWidget, QListWidgetItem, QAction, QToolButton, QMenu, QLabel, QPushButton, QFileDialog, QMessageBox
-from PyQt5.QtGui import QIcon, QPixmap, QCursor
-from PyQt5.QtCore import QSize, Qt, QTimer, QRunnable, pyqtSlot, pyqtSignal, QObject, QThreadPool
-from DBprocess import DBprocess
+import multiprocessing
+from PyQt5.QtWidgets import (QInputDialog, QLineEdit, QVBoxLayout, QLabel, QWidget, QPushButton, QApplication, QMainWindow,
+                             QHBoxLayout, QAction, QToolButton, QMenu, QFileDialog, QMessageBox)
+from PyQt5.QtGui import QIcon, QCursor
+from PyQt5.QtCore import QSize, QRunnable, pyqtSlot, pyqtSignal, QObject, QThreadPool
+from DBprocess import DBprocess, PAGE_SIZE, GRID_PHOTO_COLUMNS
 from photo_importer import PhotoImporter
-
-
-class ClickableLabel(QLabel):
-    def __init__(self, pixmap, file_path, photo_id, parent=None, db_processor = None):
-        super().__init__(parent)
-        print(f"Creating ClickableLabel for {file_path}")  # 打印信息帮助追踪
-        self.setPixmap(pixmap)
-        self.file_path = file_path
-        self.db_processor = db_processor
-        self.parent = parent
-        self.photo_id = photo_id
-
-    def mouseDoubleClickEvent(self, event):
-        subprocess.Popen([self.file_path], shell=True)
-
-    def contextMenuEvent(self, event):
-        menu = QMenu(self)
-        delete_action = menu.addAction("删除照片")
-        action = menu.exec_(event.globalPos())
-        if action == delete_action:
-            self.delete_photo()
-
-    def delete_photo(self):
-        if os.path.exists(self.file_path):
-            os.remove(self.file_path)
-            self.db_processor.delete_photo_info(self.photo_id)
-            self.parent.load_photos()
-
-
-class CustomFaceLabel(QLabel):
-    def __init__(self, text, face_id, parent=None, db_processor = None):
-        super().__init__(text, parent)
-        self.face_id = face_id
-        self.db_processor = db_processor
-
-    def contextMenuEvent(self, event):
-        menu = QMenu(self)
-        edit_action = menu.addAction("修改姓名")
-        action = menu.exec_(event.globalPos())
-        if action == edit_action:
-            self.edit_name()
-
-    def edit_name(self):
-        new_name, ok = QInputDialog.getText(self, '修改姓名', '输入新的姓名:')
-        if ok and new_name:
-            try:
-                self.setText(new_name)
-                self.db_processor.update_face_name(self.face_id, new_name)
-            except Exception as e:
-                QMessageBox.warning(self, "修改错误", f"无法修改姓名: {e}")
+from photo_grid import PhotoGridView, PhotoItem, GridHeader, THUMBNAIL_SIZE, format_month
+from thumbnail_store import ThumbnailStore, thumbnail_variant
+from face_index import forget_face_index
 
 
 class LoadPhotosTask(QRunnable):
-    def __init__(self, photo_width_with_padding, photos_per_row):
+    def __init__(self, thumbnail_store):
         super().__init__()
-        self.photo_width_with_padding = photo_width_with_padding
-        self.photos_per_row = photos_per_row
+        self.thumbnail_store = thumbnail_store
         self.signals = LoadPhotosTaskSignals()
 
     @pyqtSlot()
     def run(self):
         try:
             print("子线程：开始加载照片数据")
-            # 在子线程中创建新的数据库连接
+            # 子线程使用自己的 DBprocess，与主窗口共用连接池，查询走只读连接，不等待导入的写事务
             db_processor = DBprocess()
-            photos = db_processor.query_all_photo_info()
+            # 只读取网格需要的列，不读取缩略图数据、相机型号等其他列
+            photos = db_processor.query_photo_columns(GRID_PHOTO_COLUMNS)
             photo_data = []
-            for index, photo in enumerate(photos):
-                thumbnail_path = photo[10]
-                capture_date = photo[4]  # 假设第 3 个字段是拍摄日期
-                if os.path.exists(thumbnail_path):
-                    row = index // self.photos_per_row
-                    col = index % self.photos_per_row
-                    photo_data.append((thumbnail_path, photo[8], row, col, capture_date, photo[0]))
+            for photo in photos:
+                # 有打包缩略图，或者有旧版本的缩略图文件
+                if self.thumbnail_store.has(photo.FileHash) or os.path.exists(photo.ThumbnailPath):
+                    photo_data.append(photo)
             db_processor.close()  # 确保关闭数据库连接
             self.signals.finished.emit(photo_data)
             print("子线程：照片数据加载完毕，准备发送信号")
@@ -91,36 +43,25 @@ class LoadPhotosTaskSignals(QObject):
     finished = pyqtSignal(list)  # 参数为加载完成的照片数据列表
 
 
-class CustomScrollArea(QScrollArea):
-    def __init__(self, parent=None):
-        super(CustomScrollArea, self).__init__(parent)
-        self.verticalScrollBar().valueChanged.connect(self.showYearMonthTooltip)
-
-        # 用于延迟显示提示的计时器
-        self.tooltipTimer = QTimer(self)
-        self.tooltipTimer.setSingleShot(True)
-        self.tooltipTimer.timeout.connect(self.displayTooltip)
+class ImportPhotosTask(QRunnable):
+    def __init__(self, photo_importer, folder):
+        super().__init__()
+        self.photo_importer = photo_importer
+        self.folder = folder
+        self.signals = ImportPhotosTaskSignals()
 
-    def showYearMonthTooltip(self):
-        # 延迟显示，以避免在快速滚动时频繁更新
-        self.tooltipTimer.start(500)
+    @pyqtSlot()
+    def run(self):
+        try:
+            # 在子线程中导入，导入器使用自己的 DBprocess，进度和结果通过信号交回主线程
+            self.photo_importer.import_from_folder(self.folder)
+        except Exception as e:
+            print(f"导入线程运行时出现异常：{e}")
+            self.signals.failed.emit(str(e))
 
-    def displayTooltip(self):
-        # 计算并显示年月信息
-        if self.parent().showYearMonthInfo:
-            year_month = self.calculateYearMonth(self.verticalScrollBar().value())
-            if year_month:
-                QToolTip.showText(self.mapToGlobal(self.rect().center()), year_month)
 
-    def calculateYearMonth(self, scroll_position):
-        # 下面这个逻辑有问题，滚动条的位置年月不应是固定距离，应该是动态计算的。可能需要计算所有照片的数量，计算所有月份数量，对应的长度。
-        # 这里需要一些逻辑来根据滚动条的位置确定年月
-        # 示例：仅为演示，应根据您的数据结构进行调整
-        # 假设每100个滚动单位对应一个月份
-        month_index = scroll_position // 100
-        year = 2020 + month_index // 12  # 示例年份计算
-        month = month_index % 12 + 1      # 示例月份计算
-        return f"{year}年{month}月"
+class ImportPhotosTaskSignals(QObject):
+    failed = pyqtSignal(str)  # 参数为异常信息
 
 
 class PhotoAlbumApp(QMainWindow):
@@ -128,15 +69,23 @@ class PhotoAlbumApp(QMainWindow):
         super().__init__()
         self.threadpool = QThreadPool()
         # 初始化数据库处理和照片导入器
-        self.db_processor = DBprocess()
-        self.photo_importer = PhotoImporter(self.db_processor)
+        self.db_processor = DBprocess(use_wal=True)
+        # 打包缩略图，高分辨率屏幕上使用大尺寸的缩略图
+        self.device_pixel_ratio = QApplication.instance().devicePixelRatio()
+        self.thumbnail_variant = thumbnail_variant(THUMBNAIL_SIZE * self.device_pixel_ratio)
+        self.thumbnail_store = ThumbnailStore(self.db_processor)
+        self.thumbnail_store.load_index(self.thumbnail_variant)
+        self.photo_importer = PhotoImporter(self.db_processor, workers=os.cpu_count() or 1)
 
         # 连接信号和槽
         self.photo_importer.request_directory.connect(self.select_directory)
         self.photo_importer.import_finished.connect(self.on_import_finished)
+        self.photo_importer.import_progress.connect(self.on_import_progress)
+        self.import_running = False
+        self.close_pending = False  # 关闭窗口时导入还在运行，等导入结束后再关闭
 
         # 获取初始化照片数量
-        self.initial_photo_count = len(self.db_processor.query_all_photo_info())
+        self.initial_photo_count = self.db_processor.query_library_stats()['PhotoCount']
 
         # 设置窗口标题和大小
         self.setWindowTitle("家庭相册智能管理")
@@ -164,11 +113,14 @@ class PhotoAlbumApp(QMainWindow):
 
         # 初始化状态栏
         self.statusBar().showMessage("照片总数: 0 | 已用存储空间: 0MB")
+        self.cancel_import_button = QPushButton("取消导入")
+        self.cancel_import_button.clicked.connect(self.cancel_import)
+        self.cancel_import_button.hide()
+        self.statusBar().addPermanentWidget(self.cancel_import_button)
 
         # 定时清理数据库
 #        self.setup_cleanup_timer()
 
-        self.scroll_area = CustomScrollArea() # 使用 CustomScrollArea 鼠标滚动显示日期
         self.showYearMonthInfo = False  # 初始化时不显示年月信息
 
         self.isDateSortAscending = True  # 初始设置为升序排序
@@ -176,6 +128,7 @@ class PhotoAlbumApp(QMainWindow):
     # 添加一个方法来关闭年月信息的显示
     def disableYearMonthDisplay(self):
         self.showYearMonthInfo = False
+        self.photo_view.set_month_counts(None)
 
     # 在切换到其他状态（如普通视图）时调用这个方法
     def switchToOtherView(self):
@@ -184,15 +137,14 @@ class PhotoAlbumApp(QMainWindow):
         # ...
 
     def setup_photo_area(self, layout):
-        # 创建滚动区域和照片显示区域
-        self.scroll_area = QScrollArea()
-        self.photo_area = QWidget()
-        self.photo_layout = QGridLayout()
-        self.photo_layout.setVerticalSpacing(10)
-        self.photo_area.setLayout(self.photo_layout)
-        self.scroll_area.setWidget(self.photo_area)
-        self.scroll_area.setWidgetResizable(True)
-        layout.addWidget(self.scroll_area)
+        # 创建照片网格视图，只绘制可见的行，不为每张照片创建控件
+        self.photo_view = PhotoGridView(thumbnail_store=self.thumbnail_store, device_pixel_ratio=self.device_pixel_ratio)
+        self.photo_model = self.photo_view.photo_model
+        self.photo_view.photo_activated.connect(self.open_photo)
+        self.photo_view.delete_requested.connect(self.delete_photo)
+        self.photo_view.rename_requested.connect(self.edit_person_name)
+        self.photo_view.month_requested.connect(self.load_photos_by_date)
+        layout.addWidget(self.photo_view)
         self.load_photos()  # 加载并显示照片
 
     # def setup_cleanup_timer(self):
@@ -221,6 +173,11 @@ class PhotoAlbumApp(QMainWindow):
         # 创建搜索栏和日期按钮
         top_bar_layout = QHBoxLayout()
         top_bar_layout.addWidget(QLabel("搜索: "))
+        # 按回车在文件名、相机型号、拍摄地点和人物姓名中搜索，清空后按回车显示全部照片
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("文件名、相机、地点或人物")
+        self.search_edit.returnPressed.connect(self.search_photos)
+        top_bar_layout.addWidget(self.search_edit)
         date_button = QPushButton("日期")
         date_button.clicked.connect(self.sort_photos_by_date)
         top_bar_layout.addWidget(date_button)
@@ -237,7 +194,7 @@ class PhotoAlbumApp(QMainWindow):
         return tool_button
 
     def cleanup_resources(self):
-        # 关闭数据库连接等资源清理操作
+        # 关闭数据库连接等资源清理操作，导入已在 closeEvent 中等待结束
         if self.db_processor:
             self.db_processor.close()
 
@@ -250,14 +207,30 @@ class PhotoAlbumApp(QMainWindow):
     #     self.load_photos()
 
     def closeEvent(self, event):
+        if self.close_pending:
+            # 用户已确认关闭，导入结束后由 on_import_finished 再次调用 close()
+            if self.import_running:
+                event.ignore()
+            else:
+                self.cleanup_resources()
+                event.accept()
+            return
+
         # 提示用户关闭信息
-        final_photo_count = len(self.db_processor.query_all_photo_info())
+        final_photo_count = self.db_processor.query_library_stats()['PhotoCount']
         new_photos = final_photo_count - self.initial_photo_count
         reply = QMessageBox.information(self, "关闭提示", f"此次会话新增照片数: {new_photos}",
                                         QMessageBox.Ok | QMessageBox.Cancel, QMessageBox.Ok)
 
         # 根据用户选择处理
         if reply == QMessageBox.Ok:
+            if self.import_running:
+                # 取消正在进行的导入，已处理的文件写入数据库并完成人脸识别后再关闭，等待期间界面保持响应
+                self.close_pending = True
+                self.cancel_import()
+                self.statusBar().showMessage("正在完成人脸识别，完成后自动关闭窗口...")
+                event.ignore()
+                return
             self.cleanup_resources()  # 清理资源
             event.accept()  # 接受关闭事件
         else:
@@ -265,11 +238,8 @@ class PhotoAlbumApp(QMainWindow):
 
     def load_photos(self):
         try:
-            print("主线程：开始清除布局")
-            # 清除现有的所有控件
-            self.clear_layout(self.photo_layout)
-            print("主线程：清除布局完成，开始后台加载任务")
-            task = LoadPhotosTask(110, self.calculate_photos_per_row())
+            print("主线程：开始后台加载任务")
+            task = LoadPhotosTask(self.thumbnail_store)
             task.signals.finished.connect(self.display_loaded_photos)
             self.threadpool.start(task)
             print("主线程：后台加载任务启动")
@@ -296,43 +266,16 @@ class PhotoAlbumApp(QMainWindow):
 
     def display_loaded_photos(self, photo_data):
         print("主线程：收到子线程信号，开始更新UI")
-        for thumbnail_path, file_path, row, col, capture_date, photo_id in photo_data:
-            pixmap = QPixmap(thumbnail_path)
-            if not pixmap.isNull():
-                photo_widget = QWidget()
-                photo_layout = QVBoxLayout(photo_widget)
-
-                photo_label = ClickableLabel(pixmap.scaled(100, 100, Qt.KeepAspectRatio), file_path, photo_id, self, self.db_processor)
-                photo_layout.addWidget(photo_label)
-
-                # date_label = QLabel(capture_date)
-                # photo_layout.addWidget(date_label)
-
-                self.photo_layout.addWidget(photo_widget, row, col)
-            print(f"主线程：正在添加照片 {file_path} 到UI")
+        # 行的列顺序与 PhotoItem 的字段顺序相同
+        items = [PhotoItem(*photo) for photo in photo_data]
+        # 缩略图在绘制可见的行时才读取
+        self.photo_model.set_items(items, self.calculate_photos_per_row())
+        self.disableYearMonthDisplay()
         self.update_status_bar()  # 更新状态栏信息
         print("主线程：UI更新完成")
 
     def calculate_photos_per_row(self):
-        scroll_area_width = self.scroll_area.width()
-        photo_width_with_padding = 110  # 假设每张图片的宽度加上左右边距共110
-        return max(1, scroll_area_width // photo_width_with_padding)
-
-    def resizeEvent(self, event):
-        print(f"主线程：检测到窗口大小变化，旧宽度：{self.scroll_area.width()}，新宽度：{event.size().width()}")
-        if self.scroll_area.width() != event.size().width():  # 检查宽度是否真的改变
-            print("主线程：窗口宽度变化，需要重新加载照片")
-            self.load_photos()
-        super(PhotoAlbumApp, self).resizeEvent(event)
-
-    def clear_layout(self, layout):
-        try:
-            while layout.count():
-                child = layout.takeAt(0)
-                if child.widget():
-                    child.widget().deleteLater()
-        except Exception as e:
-            QMessageBox.warning(self, "清除布局错误", f"无法清除布局: {e}")
+        return self.photo_view.columns_for_width()
 
     def clear_data(self):
         reply = QMessageBox.question(self, '确认', '是否删除所有照片数据？', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
@@ -362,6 +305,10 @@ class PhotoAlbumApp(QMainWindow):
 
                 # 清除数据库中的所有照片信息
                 self.db_processor.clear_all_photos()
+                forget_face_index(self.db_processor)  # 共用的人脸索引随之失效
+                self.thumbnail_store.close()
+                self.thumbnail_store.load_index(self.thumbnail_variant)
+                self.photo_model.thumbnail_cache.clear()  # 缩略图已删除，缓存失效
 
                 QMessageBox.information(self, "数据清除", "照片数据已成功删除。")
                 self.load_photos()
@@ -370,11 +317,23 @@ class PhotoAlbumApp(QMainWindow):
                 QMessageBox.warning(self, "清除数据错误", f"无法清除数据: {e}")
 
     def calculate_storage_usage(self):
-        total_size = sum(os.path.getsize(f[7]) for f in self.db_processor.query_all_photo_info() if os.path.exists(f[7]))
-        return total_size // (1024 * 1024)
+        # 照片总字节数由数据库触发器维护，不需要逐个读取文件大小
+        return self.db_processor.query_library_stats()['TotalBytes'] // (1024 * 1024)
+
+    def on_import_progress(self, progress):
+        self.statusBar().showMessage(
+            f"正在导入: 已处理 {progress['scanned']} 个文件（导入 {progress['imported']}，跳过 {progress['skipped']}，"
+            f"失败 {progress['errors']}），{progress['files_per_second']:.1f} 个/秒 | "
+            f"人脸识别: {progress['faces_done']}/{progress['faces_queued']} 张，{progress['photos_per_second']:.1f} 张/秒")
 
     def on_import_finished(self, photo_count, thumbnail_count):
-        QMessageBox.information(self, "导入完成", f"导入照片数: {photo_count}\n生成缩略图数: {thumbnail_count}")
+        self.end_import()
+        if self.close_pending:
+            self.close()
+            return
+        title = "导入已取消" if self.photo_importer.cancel_event.is_set() else "导入完成"
+        QMessageBox.information(self, title, f"导入照片数: {photo_count}\n生成缩略图数: {thumbnail_count}")
+        self.thumbnail_store.load_index(self.thumbnail_variant)  # 新导入的缩略图已写入打包文件
         self.load_photos()  # 刷新显示区域
         self.update_status_bar()  # 更新状态栏
 
@@ -382,70 +341,95 @@ class PhotoAlbumApp(QMainWindow):
         QMessageBox.warning(self, "导入错误", error_message)
         self.update_status_bar()  # 即使出错，也更新状态栏
 
-    def open_photo(self, item):
-        file_path = item.data(Qt.UserRole)
-        if os.path.exists(file_path):
-            subprocess.Popen([file_path], shell=True)
+    def open_photo(self, photo):
+        if os.path.exists(photo.file_path):
+            subprocess.Popen([photo.file_path], shell=True)
+
+    def edit_person_name(self, header):
+        new_name, ok = QInputDialog.getText(self, '修改姓名', '输入新的姓名:')
+        if ok and new_name:
+            try:
+                self.db_processor.update_face_name(header.face_id, new_name)
+                self.photo_model.rename_header(header.face_id, new_name)
+            except Exception as e:
+                QMessageBox.warning(self, "修改错误", f"无法修改姓名: {e}")
 
-    def on_context_menu(self, point):
-        item = self.photo_display.itemAt(point)
-        if item:
-            menu = QMenu()
-            delete_action = menu.addAction("删除照片")
-            action = menu.exec_(self.photo_display.mapToGlobal(point))
-            if action == delete_action:
-                self.delete_photo(item)
+    def on_import_failed(self, error_message):
+        self.end_import()
+        if self.close_pending:
+            self.close()
+            return
+        QMessageBox.warning(self, "导入错误", f"导入失败: {error_message}")
+        self.thumbnail_store.load_index(self.thumbnail_variant)
+        self.load_photos()
+        self.update_status_bar()
 
     def select_directory(self):
+        if self.import_running:
+            QMessageBox.information(self, "导入", "正在导入照片，请等待当前导入完成或取消后再试。")
+            return
         folder = QFileDialog.getExistingDirectory(self, "Select Folder", "")
         if folder:
-            self.photo_importer.import_from_folder(folder)
+            # 在后台线程中导入照片，界面保持响应
+            task = ImportPhotosTask(self.photo_importer, folder)
+            task.signals.failed.connect(self.on_import_failed)
+            self.import_running = True
+            self.cancel_import_button.setText("取消导入")
+            self.cancel_import_button.setEnabled(True)
+            self.cancel_import_button.show()
+            self.statusBar().showMessage("正在导入照片并进行人脸识别，请稍后...")
+            self.threadpool.start(task)
+
+    def cancel_import(self):
+        # 导入在下一个文件边界停止，已处理的文件照常写入数据库，并等待这些照片完成人脸识别
+        self.photo_importer.cancel_import()
+        self.cancel_import_button.setText("正在完成人脸识别...")
+        self.cancel_import_button.setEnabled(False)
+
+    def end_import(self):
+        self.import_running = False
+        self.cancel_import_button.hide()
 
     def sort_photos_by_date(self):
 
         # 切换排序顺序
         self.isDateSortAscending = not self.isDateSortAscending
 
-        photos = self.db_processor.query_all_photo_info()
-        # 根据当前的排序顺序对照片进行排序
-        photos.sort(key=lambda x: x[4], reverse=self.isDateSortAscending)
+        self.load_photos_by_date()
 
-        self.clear_layout(self.photo_layout)
+    def load_photos_by_date(self, start_month=None):
+        # 按拍摄时间显示照片；start_month 不为 None 时从该月份开始读取（用于跳转），之前的月份不加载
+        descending = self.isDateSortAscending  # 与原来的排序方向保持一致
 
+        # 由数据库按规范化的拍摄时间索引逐页读取，视图滚动到底部时才加载下一页
+        after_key = None if start_month is None else self.db_processor.month_seek_key(start_month, descending)
         current_month = None
-        row, col = 0, 0
-        for index, photo in enumerate(photos):
-            thumbnail_path = photo[10]
-            capture_date = photo[4]
-            photo_month = capture_date[:7]  # 提取年月
-
-            # 将日期格式从 'YYYY-MM' 转换为 'YYYY年MM月'
-            formatted_month = f"{photo_month[:4]}年{photo_month[5:7]}月"
-
-            if formatted_month != current_month:
-                # 新月份，添加月份标签
-                if col != 0:  # 如果当前行不为空，则开始新行
-                    row += 1
-                    col = 0
-                month_label = QLabel(formatted_month)
-                self.photo_layout.addWidget(month_label, row, col, 1, self.calculate_photos_per_row())  # 跨越整行
-                row += 1  # 移动到下一行
-                current_month = formatted_month
-                col = 0  # 从新的一行开始
-
-            if os.path.exists(thumbnail_path):
-                photo_widget = QWidget()
-                photo_layout = QVBoxLayout(photo_widget)
-
-                photo_label = ClickableLabel(QPixmap(thumbnail_path).scaled(100, 100, Qt.KeepAspectRatio), photo[8], photo[0], self, self.db_processor)
-                photo_layout.addWidget(photo_label)
-
-                self.photo_layout.addWidget(photo_widget, row, col)
-                col += 1
-                if col >= self.calculate_photos_per_row():  # 到达每行的图片数量上限
-                    row += 1
-                    col = 0
+
+        def fetch_page():
+            nonlocal after_key, current_month
+            items = []
+            while not items:
+                photos = self.db_processor.photos_by_date(after_key, descending=descending)
+                if not photos:
+                    break
+                after_key = (photos[-1].CaptureKey, photos[-1].PhotoID)
+                for photo_id, file_path, thumbnail_path, capture_date, file_hash, capture_key in photos:
+                    formatted_month = format_month(capture_key[:7])
+
+                    if formatted_month != current_month:
+                        # 新月份，添加占据整行的月份标题
+                        items.append(GridHeader(formatted_month, None))
+                        current_month = formatted_month
+
+                    if self.has_thumbnail(file_hash, thumbnail_path):
+                        items.append(PhotoItem(photo_id, file_path, thumbnail_path, capture_date, file_hash))
+            return items
+
+        self.photo_model.set_items(fetch_page(), self.calculate_photos_per_row(), fetch_page)
+        self.photo_view.scrollToTop()
         self.showYearMonthInfo = True # 启用显示年月信息
+        # 每月照片数由数据库预先统计，滚动位置与年月的换算不需要加载全部照片
+        self.photo_view.set_month_counts(self.db_processor.query_month_counts(descending), start_month)
 
     def show_options_menu(self):
         menu = QMenu(self)
@@ -472,64 +456,91 @@ class PhotoAlbumApp(QMainWindow):
         # 切换排序顺序
         self.isDateSortAscending = not self.isDateSortAscending
 
-        photos = self.db_processor.query_all_photo_info_face()
-        photos.sort(key=lambda x: x[14], reverse=self.isDateSortAscending)
-
-        self.clear_layout(self.photo_layout)
-           
-        row, col = 0, 0
-        current_faceid = None
-        for index, photo in enumerate(photos):
-            thumbnail_path = photo[10]
-            capture_faceid = photo[14]
-
-            if capture_faceid != current_faceid:
-                current_faceid = capture_faceid
-                #
-                if col != 0:  # 如果当前行不为空，则开始新行
-                    row += 1
-                    col = 0
-                face_label = CustomFaceLabel(photo[17], capture_faceid, self, self.db_processor)
-                self.photo_layout.addWidget(face_label, row, col, 1, self.calculate_photos_per_row())  # 跨越整行
-                row += 1  # 移动到下一行
-                col = 0  # 从新的一行开始
-
-            if os.path.exists(thumbnail_path):
-                photo_widget = QWidget()
-                photo_layout = QVBoxLayout(photo_widget)
-
-                photo_label = ClickableLabel(QPixmap(thumbnail_path).scaled(100, 100, Qt.KeepAspectRatio), photo[8], photo[0], self, self.db_processor)
-                photo_layout.addWidget(photo_label)
-
-                self.photo_layout.addWidget(photo_widget, row, col)
-                col += 1
-                if col >= self.calculate_photos_per_row():  # 到达每行的图片数量上限
-                    row += 1
-                    col = 0
+        # 人物列表（照片数和封面）一次查询取得，每个人物的照片在其分组滚动到可见区域时才逐页读取
+        persons = self.db_processor.query_persons(descending=self.isDateSortAscending)
+        person_index = 0
+        after_photo_id = None
+
+        def fetch_page():
+            nonlocal person_index, after_photo_id
+            items = []
+            while person_index < len(persons) and len(items) < PAGE_SIZE:
+                face_id, face_label, photo_count, cover_hash, cover_thumbnail_path = persons[person_index]
+                if after_photo_id is None:
+                    # 新人物，添加占据整行的姓名标题，右键可以修改姓名
+                    cover = None
+                    if cover_hash and self.has_thumbnail(cover_hash, cover_thumbnail_path):
+                        cover = PhotoItem(None, '', cover_thumbnail_path, '', cover_hash)
+                    items.append(GridHeader(face_label, face_id, photo_count, cover))
+
+                photos = self.db_processor.photos_by_person(face_id, after_photo_id)
+                if len(photos) < PAGE_SIZE:
+                    person_index += 1
+                    after_photo_id = None
+                else:
+                    after_photo_id = photos[-1].PhotoID
+                items.extend(PhotoItem(*photo) for photo in photos if self.has_thumbnail(photo.FileHash, photo.ThumbnailPath))
+            return items
+
+        self.photo_model.set_items(fetch_page(), self.calculate_photos_per_row(), fetch_page)
+        self.disableYearMonthDisplay()
+
+    def search_photos(self):
+        text = self.search_edit.text().strip()
+        if not text:
+            self.load_photos()
+            return
+
+        # 由数据库的全文索引按相关度逐页读取，视图滚动到底部时才加载下一页
+        offset = 0
+
+        def fetch_page():
+            nonlocal offset
+            items = []
+            while not items:
+                photos = self.db_processor.search_photos(text, offset=offset)
+                if not photos:
+                    break
+                offset += len(photos)
+                items.extend(PhotoItem(*photo) for photo in photos if self.has_thumbnail(photo.FileHash, photo.ThumbnailPath))
+            return items
+
+        self.photo_model.set_items(fetch_page(), self.calculate_photos_per_row(), fetch_page)
+        self.disableYearMonthDisplay()
+        if self.photo_model.rowCount() == 0:
+            self.statusBar().showMessage(f"没有找到与“{text}”相关的照片")
+
+    def has_thumbnail(self, file_hash, thumbnail_path):
+        # 有打包缩略图，或者有旧版本的缩略图文件
+        return self.thumbnail_store.has(file_hash) or os.path.exists(thumbnail_path)
 
     def update_status_bar(self):
         try:
             # 更新状态栏信息
-            total_photos = len(self.db_processor.query_all_photo_info())
-            total_size = self.calculate_storage_usage()
-            self.statusBar().showMessage(f"照片总数: {total_photos} | 已用存储空间: {total_size}MB")
+            stats = self.db_processor.query_library_stats()
+            total_photos = stats['PhotoCount']
+            total_size = stats['TotalBytes'] // (1024 * 1024)
+            self.statusBar().showMessage(f"照片总数: {total_photos} | 人脸数: {stats['FaceCount']} | 已用存储空间: {total_size}MB")
         except Exception as e:
             QMessageBox.warning(self, "更新状态栏错误", f"无法更新状态栏: {e}")
 
-    def delete_photo(self, item):
-        file_path = item.data(Qt.UserRole)
-        if os.path.exists(file_path):
+    def delete_photo(self, photo):
+        if os.path.exists(photo.file_path):
             reply = QMessageBox.question(self, '确认', '确定要删除这张照片吗？', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                os.remove(file_path)
-                self.db_processor.delete_photo_info(os.path.basename(file_path))
-                self.load_photos()
+                os.remove(photo.file_path)
+                self.db_processor.delete_photo_info(photo.photo_id)
+                self.photo_model.remove_photo(photo.photo_id)
+                if self.showYearMonthInfo:
+                    self.photo_view.set_month_counts(self.db_processor.query_month_counts(self.isDateSortAscending),
+                                                     self.photo_view.start_month)
         self.update_status_bar()  # 更新状态栏信息
 
     def import_photos_and_refresh(self):
         self.photo_importer.import_photos()  # 直接调用 PhotoImporter 的 import_photos 方法
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # 打包后的可执行文件中支持导入进程池
     app = QApplication(sys.argv)
     mainWin = PhotoAlbumApp()
     mainWin.show()
@@ -0,0 +1,401 @@
+from bisect import bisect_right
+from collections import namedtuple
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QMenu, QToolTip
+from PyQt5.QtGui import QColor, QPainter
+from PyQt5.QtCore import Qt, QSize, QRect, QTimer, QAbstractListModel, QModelIndex, pyqtSignal
+from thumbnail_cache import ThumbnailCache, THUMBNAIL_CACHE_BYTES
+
+# 缩略图显示尺寸和每个格子的尺寸（含边距）
+THUMBNAIL_SIZE = 100
+CELL_SIZE = 110
+HEADER_HEIGHT = 30
+# 滚动时在可见区域上下各预取的行数
+PREFETCH_ROWS = 3
+# 窗口大小停止变化多久（毫秒）后重新分行
+RELAYOUT_DELAY_MS = 150
+# 滚动停止多久（毫秒）后显示当前年月
+MONTH_TOOLTIP_DELAY_MS = 500
+
+# 网格中的一张照片
+PhotoItem = namedtuple('PhotoItem', ['photo_id', 'file_path', 'thumbnail_path', 'capture_time', 'file_hash'])
+# 占据整行的分组标题（月份或人物），face_id 不为 None 时可以修改姓名；人物标题带有照片数和作为封面的 PhotoItem
+GridHeader = namedtuple('GridHeader', ['text', 'face_id', 'count', 'cover'], defaults=(None, None))
+
+
+def format_month(month):
+    # 将月份从 'YYYY-MM' 转换为 'YYYY年MM月'，拍摄时间无法识别的照片月份为 ''
+    return f"{month[:4]}年{month[5:7]}月" if month else "未知日期"
+
+
+class MonthTimeline:
+    """
+    按日期排列的网格中每个月份的起始位置
+
+    由数据库中预先统计的每月照片数和网格的列数、行高直接算出每个月份标题在网格中的纵向位置，
+    不需要加载照片；滚动位置换算为月份时在位置列表中二分查找。
+    """
+
+    def __init__(self, month_counts, columns):
+        self.columns = columns
+        self.months = []
+        self.offsets = []  # 每个月份标题的纵向位置（像素），递增
+        offset = 0
+        for month, count in month_counts:
+            self.months.append(month)
+            self.offsets.append(offset)
+            offset += HEADER_HEIGHT + -(-count // columns) * CELL_SIZE
+        self.height = offset
+
+    def month_at(self, offset):
+        # 纵向位置 offset 所在的月份，没有月份时返回 None
+        if not self.months:
+            return None
+        return self.months[max(0, bisect_right(self.offsets, offset) - 1)]
+
+
+class PhotoGridModel(QAbstractListModel):
+    """
+    照片网格模型
+
+    模型中的每一行是网格中的一行：一个分组标题，或者最多 columns 张照片。
+    不为照片创建控件，视图只绘制可见的行；列数变化时只需重新分行。
+    设置了 fetch_page 时按 Qt 的 canFetchMore/fetchMore 机制分页加载，视图滚动到底部时才取下一页。
+    """
+
+    def __init__(self, parent=None, cache_bytes=THUMBNAIL_CACHE_BYTES, thumbnail_store=None, device_pixel_ratio=1.0):
+        super().__init__(parent)
+        self.items = []  # 按显示顺序排列的 PhotoItem 和 GridHeader
+        self.rows = []  # 每行为一个 GridHeader 或一个 PhotoItem 列表
+        self.row_starts = []  # 每行第一个元素在 items 中的下标
+        self.rows_by_thumbnail = {}  # 文件哈希 -> 所在的行号列表，缩略图解码完成后只刷新这些行
+        self.columns = 1
+        self.fetch_page = None  # 返回下一页元素列表的函数，没有更多数据时返回空列表
+        self.thumbnail_cache = ThumbnailCache(THUMBNAIL_SIZE, cache_bytes, self, thumbnail_store, device_pixel_ratio)
+        self.thumbnail_cache.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+    def set_items(self, items, columns, fetch_page=None):
+        self.items = list(items)
+        self.columns = max(1, columns)
+        self.fetch_page = fetch_page
+        self.relayout()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.fetch_page is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.fetch_page is None:
+            return
+        items = self.fetch_page()
+        if items:
+            self.append_items(items)
+        else:
+            self.fetch_page = None
+
+    def append_items(self, items):
+        # 在末尾追加元素：未排满的最后一行与新元素一起重新分行，其余的行保持不变
+        start_item = len(self.items)
+        self.items.extend(items)
+        first_row = len(self.rows)
+        if self.rows and not isinstance(self.rows[-1], GridHeader) and len(self.rows[-1]) < self.columns:
+            first_row -= 1
+            start_item = self.row_starts[-1]
+        rows, row_starts = self.split_rows(start_item)
+        if first_row < len(self.rows):
+            self.rows[first_row], self.row_starts[first_row] = rows[0], row_starts[0]
+            index = self.index(first_row)
+            self.dataChanged.emit(index, index)
+            rows, row_starts = rows[1:], row_starts[1:]
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.row_starts.extend(row_starts)
+            self.endInsertRows()
+        for item_index in range(len(self.items) - len(items), len(self.items)):
+            photo = self.item_thumbnail(self.items[item_index])
+            if photo is not None:
+                self.rows_by_thumbnail.setdefault(photo.file_hash, []).append(self.row_of_item(item_index))
+
+    def set_columns(self, columns):
+        # 只重新分行，不重新读取数据
+        columns = max(1, columns)
+        if columns != self.columns:
+            self.columns = columns
+            self.relayout()
+
+    def split_rows(self, start_item):
+        # 把 items[start_item:] 分行，返回 (行列表, 每行第一个元素的下标列表)
+        rows = []
+        row_starts = []
+        current_row = []
+        for item_index in range(start_item, len(self.items)):
+            item = self.items[item_index]
+            if isinstance(item, GridHeader):
+                if current_row:
+                    rows.append(current_row)
+                    current_row = []
+                row_starts.append(item_index)
+                rows.append(item)
+                continue
+            if not current_row:
+                row_starts.append(item_index)
+            current_row.append(item)
+            if len(current_row) >= self.columns:
+                rows.append(current_row)
+                current_row = []
+        if current_row:
+            rows.append(current_row)
+        return rows, row_starts
+
+    def relayout(self):
+        self.beginResetModel()
+        self.rows, self.row_starts = self.split_rows(0)
+        self.rows_by_thumbnail = {}
+        for row, content in enumerate(self.rows):
+            for photo in [content.cover] if isinstance(content, GridHeader) else content:
+                if photo is not None:
+                    self.rows_by_thumbnail.setdefault(photo.file_hash, []).append(row)
+        self.endResetModel()
+
+    def item_thumbnail(self, item):
+        # 元素需要显示的缩略图：照片本身，或人物标题的封面
+        return item.cover if isinstance(item, GridHeader) else item
+
+    def row_of_item(self, item_index):
+        # items 中第 item_index 个元素当前所在的行号
+        return max(0, bisect_right(self.row_starts, item_index) - 1)
+
+    def remove_photo(self, photo_id):
+        self.items = [item for item in self.items if not (isinstance(item, PhotoItem) and item.photo_id == photo_id)]
+        self.relayout()
+
+    def rename_header(self, face_id, text):
+        for row, content in enumerate(self.rows):
+            if isinstance(content, GridHeader) and content.face_id == face_id:
+                self.rows[row] = content._replace(text=text)
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+        self.items = [item._replace(text=text) if isinstance(item, GridHeader) and item.face_id == face_id else item
+                      for item in self.items]
+
+    def photo_count(self):
+        return sum(1 for item in self.items if isinstance(item, PhotoItem))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return None
+        content = self.rows[index.row()]
+        if role == Qt.UserRole:
+            return content
+        if role == Qt.DisplayRole and isinstance(content, GridHeader):
+            return content.text
+        if role == Qt.SizeHintRole:
+            if isinstance(content, GridHeader):
+                return QSize(self.columns * CELL_SIZE, HEADER_HEIGHT)
+            return QSize(self.columns * CELL_SIZE, CELL_SIZE)
+        return None
+
+    def thumbnail(self, photo):
+        # 绘制时才取缩略图；尚未解码时返回 None 并在后台解码，完成后刷新所在的行
+        return self.thumbnail_cache.get(photo.file_hash, photo.thumbnail_path)
+
+    def row_photos(self, first_row, last_row):
+        # 第 first_row 到 last_row 行（含）中的所有照片
+        return [photo for content in self.rows[max(0, first_row):last_row + 1]
+                if not isinstance(content, GridHeader) for photo in content]
+
+    def on_thumbnail_ready(self, file_hash):
+        for row in self.rows_by_thumbnail.get(file_hash, []):
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+
+class PhotoGridDelegate(QStyledItemDelegate):
+    # 绘制网格中的一行：分组标题文字，或一行照片缩略图
+
+    def paint(self, painter, option, index):
+        content = index.data(Qt.UserRole)
+        model = index.model()
+        if isinstance(content, GridHeader):
+            text_rect = option.rect.adjusted(5, 0, 0, 0)
+            if content.cover is not None:
+                # 人物封面缩小画在标题左侧
+                cover = QRect(option.rect.x() + 5, option.rect.y() + 2, HEADER_HEIGHT - 4, HEADER_HEIGHT - 4)
+                pixmap = model.thumbnail(content.cover)
+                if pixmap is None:
+                    painter.fillRect(cover, QColor(230, 230, 230))
+                elif not pixmap.isNull():
+                    size = pixmap.size().scaled(cover.size(), Qt.KeepAspectRatio)
+                    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+                    painter.drawPixmap(QRect(cover.x(), cover.y() + (cover.height() - size.height()) // 2, size.width(), size.height()), pixmap)
+                text_rect.setLeft(cover.right() + 6)
+            text = content.text if content.count is None else f"{content.text}（{content.count} 张）"
+            painter.drawText(text_rect, Qt.AlignLeft | Qt.AlignVCenter, text)
+            return
+        for column, photo in enumerate(content):
+            cell = QRect(option.rect.x() + column * CELL_SIZE, option.rect.y(), CELL_SIZE, CELL_SIZE)
+            pixmap = model.thumbnail(photo)
+            if pixmap is None:
+                # 缩略图正在后台解码，先画占位方块
+                painter.fillRect(cell.adjusted(5, 5, -5, -5), QColor(230, 230, 230))
+                continue
+            if pixmap.isNull():
+                continue
+            # 高分辨率屏幕上的缩略图按逻辑尺寸居中
+            x = cell.x() + (CELL_SIZE - round(pixmap.width() / pixmap.devicePixelRatio())) // 2
+            y = cell.y() + (CELL_SIZE - round(pixmap.height() / pixmap.devicePixelRatio())) // 2
+            painter.drawPixmap(x, y, pixmap)
+
+    def sizeHint(self, option, index):
+        return index.data(Qt.SizeHintRole)
+
+
+class PhotoGridView(QListView):
+    """
+    照片网格视图：双击打开照片，右键删除照片或修改人物姓名，具体操作通过信号交给主窗口处理。
+    按日期显示时设置每月照片数，滚动时提示当前年月，右键月份标题可以跳转到其他月份；
+    目标月份尚未加载时发出 month_requested，由主窗口从该月份开始重新加载，不在界面线程中逐页加载。
+    重新加载后网格从目标月份开始，之前的月份不在网格中，不能向上滚动回去，只能再通过跳转菜单选择。
+    """
+    photo_activated = pyqtSignal(object)  # 参数为 PhotoItem
+    delete_requested = pyqtSignal(object)  # 参数为 PhotoItem
+    rename_requested = pyqtSignal(object)  # 参数为 GridHeader
+    month_requested = pyqtSignal(str)  # 参数为 'YYYY-MM'，拍摄时间无法识别的照片为 ''
+
+    def __init__(self, parent=None, cache_bytes=THUMBNAIL_CACHE_BYTES, thumbnail_store=None, device_pixel_ratio=1.0):
+        super().__init__(parent)
+        self.photo_model = PhotoGridModel(self, cache_bytes, thumbnail_store, device_pixel_ratio)
+        self.setModel(self.photo_model)
+        self.setItemDelegate(PhotoGridDelegate(self))
+        self.setSelectionMode(QListView.NoSelection)
+        self.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.setSpacing(0)
+        self.verticalScrollBar().valueChanged.connect(self.prefetch_thumbnails)
+        self.photo_model.modelReset.connect(self.prefetch_thumbnails)
+        # 拖动窗口边缘时会连续收到大小变化事件，停止变化后才重新分行
+        self.relayout_timer = QTimer(self)
+        self.relayout_timer.setSingleShot(True)
+        self.relayout_timer.timeout.connect(self.relayout)
+        self.month_counts = None  # 按显示顺序排列的 [(月份, 照片数), ...]，不按日期显示时为 None
+        self.start_month = None  # 网格从该月份开始加载，None 表示从第一个月份开始
+        self.month_timeline = None  # 按当前列数计算的 MonthTimeline
+        # 延迟显示年月，以避免在快速滚动时频繁更新
+        self.month_tooltip_timer = QTimer(self)
+        self.month_tooltip_timer.setSingleShot(True)
+        self.month_tooltip_timer.timeout.connect(self.show_month_tooltip)
+        self.verticalScrollBar().valueChanged.connect(self.on_scrolled)
+
+    def visible_rows(self):
+        # 可见区域第一行和最后一行的行号，没有数据时返回 (0, -1)
+        rect = self.viewport().rect()
+        first = self.indexAt(rect.topLeft())
+        last = self.indexAt(rect.bottomLeft())
+        if not first.isValid():
+            return 0, -1
+        return first.row(), last.row() if last.isValid() else self.photo_model.rowCount() - 1
+
+    def prefetch_thumbnails(self):
+        # 预取可见区域上下 PREFETCH_ROWS 行的缩略图，并取消已经滚出这一范围的排队任务
+        first, last = self.visible_rows()
+        if last < first:
+            return
+        cache = self.photo_model.thumbnail_cache
+        wanted = self.photo_model.row_photos(first - PREFETCH_ROWS, last + PREFETCH_ROWS)
+        cache.cancel_pending({photo.file_hash for photo in wanted})
+        for photo in self.photo_model.row_photos(last + 1, last + PREFETCH_ROWS):
+            cache.request(photo.file_hash, photo.thumbnail_path)
+        for photo in self.photo_model.row_photos(first - PREFETCH_ROWS, first - 1):
+            cache.request(photo.file_hash, photo.thumbnail_path)
+
+    def set_month_counts(self, month_counts, start_month=None):
+        # month_counts 为全部月份，用于跳转菜单；网格从 start_month 开始加载时，时间轴也从该月份开始计算
+        self.month_counts = month_counts
+        self.start_month = start_month
+        self.month_timeline = None
+
+    def timeline(self):
+        # 列数变化后重新计算各月份的位置
+        if self.month_counts is None:
+            return None
+        if self.month_timeline is None or self.month_timeline.columns != self.photo_model.columns:
+            months = [month for month, _ in self.month_counts]
+            start = months.index(self.start_month) if self.start_month in months else 0
+            self.month_timeline = MonthTimeline(self.month_counts[start:], self.photo_model.columns)
+        return self.month_timeline
+
+    def on_scrolled(self):
+        if self.month_counts is not None:
+            self.month_tooltip_timer.start(MONTH_TOOLTIP_DELAY_MS)
+
+    def show_month_tooltip(self):
+        timeline = self.timeline()
+        month = timeline.month_at(self.verticalScrollBar().value()) if timeline is not None else None
+        if month is not None:
+            QToolTip.showText(self.mapToGlobal(self.rect().center()), format_month(month))
+
+    def scroll_to_month(self, month):
+        # 目标月份已经加载时滚动到标题处；否则请求从该月份开始重新加载，不逐页加载中间的月份。
+        # 重新加载后目标月份之前的月份不再显示，向上滚动无法回到这些月份，需要再次从跳转菜单选择
+        model = self.photo_model
+        text = format_month(month)
+        for row, content in enumerate(model.rows):
+            if isinstance(content, GridHeader) and content.face_id is None and content.text == text:
+                self.scrollTo(model.index(row), QListView.PositionAtTop)
+                return
+        self.month_requested.emit(month)
+
+    def columns_for_width(self):
+        return max(1, self.viewport().width() // CELL_SIZE)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.relayout_timer.start(RELAYOUT_DELAY_MS)
+
+    def relayout(self):
+        # 按新的宽度重新分行，只重排已加载的照片，不读取数据库，缩略图仍从缓存中取得；保持可见区域第一行的照片不变
+        model = self.photo_model
+        columns = self.columns_for_width()
+        if columns == model.columns:
+            return
+        first, _ = self.visible_rows()
+        item_index = model.row_starts[first] if first < len(model.row_starts) else 0
+        model.set_columns(columns)
+        if model.rows:
+            self.scrollTo(model.index(model.row_of_item(item_index)), QListView.PositionAtTop)
+
+    def item_at(self, pos):
+        # 返回位置 pos 处的 PhotoItem 或 GridHeader，没有时返回 None
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return None
+        content = index.data(Qt.UserRole)
+        if isinstance(content, GridHeader):
+            return content
+        column = (pos.x() - self.visualRect(index).x()) // CELL_SIZE
+        return content[column] if 0 <= column < len(content) else None
+
+    def mouseDoubleClickEvent(self, event):
+        item = self.item_at(event.pos())
+        if isinstance(item, PhotoItem):
+            self.photo_activated.emit(item)
+
+    def contextMenuEvent(self, event):
+        item = self.item_at(event.pos())
+        menu = QMenu(self)
+        if isinstance(item, PhotoItem):
+            delete_action = menu.addAction("删除照片")
+            if menu.exec_(event.globalPos()) == delete_action:
+                self.delete_requested.emit(item)
+        elif isinstance(item, GridHeader) and item.face_id is not None:
+            edit_action = menu.addAction("修改姓名")
+            if menu.exec_(event.globalPos()) == edit_action:
+                self.rename_requested.emit(item)
+        elif isinstance(item, GridHeader) and self.month_counts:
+            jump_menu = menu.addMenu("跳转到")
+            for month, count in self.month_counts:
+                jump_menu.addAction(f"{format_month(month)}（{count} 张）").setData(month)
+            action = menu.exec_(event.globalPos())
+            if action is not None and action.data() is not None:
+                self.scroll_to_month(action.data())
@@ -1,23 +1,43 @@
 import os
-import shutil
-import hashlib
 import time
-from PIL import Image, ExifTags, UnidentifiedImageError
+import threading
+from queue import Queue, Full, Empty
+from concurrent.futures import ProcessPoolExecutor
 from PyQt5.QtCore import QObject, pyqtSignal
 from DBprocess import DBprocess  # 确保 DBprocess 模块已按之前建议进行修改
-from PyQt5.QtWidgets import QApplication, QMessageBox, QFileDialog
-from process_photos import process_photos
+from PyQt5.QtWidgets import QFileDialog
+from process_photos import FaceProcessor
+from thumbnail_store import ThumbnailStore
+from face_encoder import iter_face_encodings, DETECTION_MAX_EDGE
+from import_pipeline import STAGE_DONE, STAGE_QUEUE_SIZE, bounded_map, iter_queue, start_stage, take_until
+from photo_ingest import (INGEST_OK, INGEST_SKIPPED, INGEST_FAILED, iter_photo_files, ingest_file, ingest_worker,
+                          init_ingest_worker, commit_ingested_file, discard_ingested_file, remove_stale_ingest_files,
+                          calculate_file_hash, create_thumbnail)
+
+# 两次导入进度信号之间的最短间隔（秒），避免大量信号拥塞界面线程
+PROGRESS_INTERVAL = 0.25
+# 导入异常结束时等待各阶段结果的间隔（秒）
+STOP_POLL_INTERVAL = 0.05
 
 class PhotoImporter(QObject):
+    batch_size = 200  # 每批写入数据库的照片数，每批只提交一次事务
+
     request_directory = pyqtSignal()
     import_finished = pyqtSignal(int, int)  # 新信号，参数为导入照片数和生成缩略图数
     import_error = pyqtSignal(str)  # 新增错误处理信号
+    import_progress = pyqtSignal(dict)  # 导入进度，参数为各阶段的计数和速率，见 progress_snapshot
 
-    def __init__(self, db_processor, photo_storage_path='images', thumbnail_storage_path='thumbnails'):
+    def __init__(self, db_processor, photo_storage_path='images', thumbnail_storage_path='thumbnails', workers=1,
+                 diagnostics_dir=None, detection_max_edge=DETECTION_MAX_EDGE):
         super().__init__()
         self.db_processor = db_processor
         self.photo_storage_path = photo_storage_path
-        self.thumbnail_storage_path = thumbnail_storage_path
+        self.thumbnail_storage_path = thumbnail_storage_path  # 旧版本单独保存缩略图文件的目录，新导入的缩略图写入打包文件
+        self.workers = workers  # 并行导入的工作进程数，1 表示在当前进程中逐个处理
+        self.diagnostics_dir = diagnostics_dir  # 人脸距离诊断输出目录，None 表示不生成
+        self.detection_max_edge = detection_max_edge  # 人脸检测前把照片缩小到的最长边，检测结果缓存按该设置区分
+        self.cancel_event = threading.Event()
+        self.last_progress_time = 0.0
         self.create_directory(self.photo_storage_path)
         self.create_directory(self.thumbnail_storage_path)
 
@@ -25,174 +45,277 @@ class PhotoImporter(QObject):
         # 发出信号，请求主线程打开文件夹选择对话框
         self.request_directory.emit()
 
-    def import_from_folder(self, folder_path):
+    def cancel_import(self):
+        # 请求取消导入：不再开始处理新的文件，已处理完的文件照常写入数据库并完成人脸识别，可以从任意线程调用
+        self.cancel_event.set()
+
+    def iter_ingest_results(self, file_paths, workers):
+        # 逐个产出单文件处理结果；多进程模式下由进程池处理，结果统一交回导入线程写入数据库
+        if workers <= 1:
+            init_ingest_worker(self.db_processor.db_path, self.photo_storage_path)
+            yield from bounded_map(ingest_worker, file_paths)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_ingest_worker,
+                                 initargs=(self.db_processor.db_path, self.photo_storage_path)) as executor:
+            yield from bounded_map(ingest_worker, file_paths, executor)
+
+    def import_from_folder(self, folder_path, workers=None):
+        """
+        流水线导入：遍历 -> 哈希查重 -> EXIF/缩略图 -> 复制 由导入阶段完成，人脸检测编码由人脸阶段完成，
+        两个阶段在后台线程中运行，通过有界队列把结果交回当前线程统一写入数据库。
+        每批照片写入后立即送去人脸检测，人脸识别与文件导入同时进行，内存占用与文件夹大小无关。
+
+        导入使用单独的 DBprocess，不操作界面，可以在 QThreadPool 等后台线程中调用；进度通过 import_progress 信号发出。
+        调用 cancel_import 后在文件边界停止：不再处理新的文件，已处理完的照片照常写入数据库，并完成这些照片的人脸识别。
+        """
         photo_count = 0
         thumbnail_count = 0
         error_count = 0  # 新增错误计数
         skip_count = 0
-        all_file_paths = []
-        all_file_hashes = []
+        failed_count = 0  # 无法读取的文件数，只用于进度统计
+        imported = {}  # 本次已导入的文件哈希 -> 照片路径，用于并行模式下的批内查重
+        pending_photo_infos = []  # 尚未写入数据库的照片信息
+        pending_thumbnails = []  # 尚未写入打包缩略图文件的 (哈希, 尺寸, JPEG 数据)
+        pending_photos = []  # 与 pending_photo_infos 对应的 (源文件路径, 哈希)，写入后送去人脸检测
+        pending_fingerprints = []  # 尚未写入指纹缓存的 (源路径, 大小, 修改时间, inode, 哈希)
+        workers = self.workers if workers is None else workers
+        self.cancel_event.clear()
+        start_time = time.monotonic()
+
+        # 导入线程使用自己的 DBprocess（与调用方共用连接池），导入结束时关闭不影响调用方
+        db_processor = self.db_processor.clone()
+        events = Queue(maxsize=STAGE_QUEUE_SIZE)  # 导入阶段的结果
+        face_events = Queue(maxsize=STAGE_QUEUE_SIZE)  # 人脸阶段的结果，与导入阶段分开排队
+        photos_to_encode = Queue(maxsize=STAGE_QUEUE_SIZE)  # 待人脸识别的 (路径, 哈希)，已满时导入随之等待
+        ingest_running = False
+        faces_running = False
+        try:
+            thumbnail_store = ThumbnailStore(db_processor)
+            thumbnail_store.recover()
+            remove_stale_ingest_files(self.photo_storage_path)
+            face_processor = FaceProcessor(db_processor, self.detection_max_edge, self.diagnostics_dir)
+            start_stage('ingest', self.iter_ingest_results(take_until(iter_photo_files(folder_path), self.cancel_event), workers), events)
+            ingest_running = True
+            # 人脸阶段不随取消停止：已写入数据库的照片在重新导入时会被跳过，必须在本次导入中完成人脸识别
+            start_stage('faces', iter_face_encodings(iter_queue(photos_to_encode), workers, self.detection_max_edge), face_events)
+            faces_running = True
+
+            def report_progress(force=False):
+                self.emit_progress(self.progress_snapshot(
+                    start_time, photo_count, skip_count, error_count + failed_count, len(imported), face_processor), force)
 
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', ".bmp", ".gif", ".tiff", ".webp", ".heic")):
+            def handle_face_event(event):
+                nonlocal faces_running
+                stage, result = event
+                if result is STAGE_DONE:
+                    faces_running = False
+                elif isinstance(result, Exception):
+                    print(f"导入阶段 {stage} 出现错误: {result}")
+                    self.import_error.emit(f"Import stage {stage} failed: {result}")
+                else:
                     try:
-                        file_hash = self.calculate_file_hash(file_path)  # 计算文件哈希值
-                        if self.db_processor.query_photo_info_by_hash(file_hash):
-                            skip_count += 1  # 增加跳过计数
-                            print(f"照片 {file_path} 已经存在于数据库中，跳过。")
-                            continue
-
-                        if self.process_file(file_path):
-                            photo_count += 1
-                            thumbnail_count += 1
-                            all_file_paths.append(file_path)  # 记录文件路径
-                            all_file_hashes.append(self.calculate_file_hash(file_path))  # 记录文件哈希值
+                        face_processor.add_result(result)
                     except Exception as e:
-                        error_count += 1
-                        self.import_error.emit(f"Error processing file {file_path}: {e}")
+                        print(f"人脸识别或存储操作失败: {e}")
+                    report_progress()
+
+            def put_face_work(item):
+                # 人脸队列已满时只处理人脸阶段的结果来腾出位置，不读取导入阶段的结果，两个队列不会互相等待
+                while faces_running:
+                    try:
+                        photos_to_encode.put_nowait(item)
+                        return
+                    except Full:
+                        handle_face_event(face_events.get())
+                if item is not STAGE_DONE:
+                    print(f"人脸阶段已结束，照片 {item[0]} 未进行人脸识别")
+
+            while ingest_running or faces_running:
+                # 导入阶段结束后只等待人脸阶段；否则先处理已经就绪的人脸结果，再读取导入阶段的结果
+                if not ingest_running:
+                    handle_face_event(face_events.get())
+                    continue
+                while not face_events.empty():
+                    handle_face_event(face_events.get_nowait())
 
+                stage, result = events.get()
+                if result is STAGE_DONE:
+                    ingest_running = False
+                    self.write_batch(db_processor, thumbnail_store, pending_photo_infos, pending_fingerprints, pending_thumbnails)
+                    self.queue_face_detection(pending_photos, face_processor, put_face_work)
+                    put_face_work(STAGE_DONE)
+                    continue
+                if isinstance(result, Exception):
+                    print(f"导入阶段 {stage} 出现错误: {result}")
+                    self.import_error.emit(f"Import stage {stage} failed: {result}")
+                    continue
+
+                status, file_path, file_hash, payload, fingerprint_row = result
+                if fingerprint_row is not None:
+                    pending_fingerprints.append(fingerprint_row)
+                if status == INGEST_SKIPPED or (status == INGEST_OK and file_hash in imported):
+                    if status == INGEST_OK:
+                        discard_ingested_file(payload[2])
+                    skip_count += 1  # 增加跳过计数
+                    print(f"照片 {file_path} 已经存在于数据库中，跳过。")
+                elif status == INGEST_OK:
+                    photo_info, thumbnails, temp_path = payload
+                    # 接受该哈希后才把临时副本改名为正式文件，同名的不同照片不会互相覆盖
+                    try:
+                        photo_info = commit_ingested_file(photo_info, temp_path)
+                    except Exception:
+                        discard_ingested_file(temp_path)
+                        raise
+                    pending_photo_infos.append(photo_info)
+                    pending_thumbnails.extend((file_hash, size, data) for size, data in thumbnails)
+                    pending_photos.append((file_path, file_hash))
+                    imported[file_hash] = photo_info[7]
+                    photo_count += 1
+                    thumbnail_count += 1
+                elif status == INGEST_FAILED:
+                    failed_count += 1
+                    self.import_error.emit(payload)
+                else:
+                    error_count += 1
+                    self.import_error.emit(f"Error processing file {file_path}: {payload}")
+                if len(pending_photo_infos) >= self.batch_size or len(pending_fingerprints) >= self.batch_size:
+                    self.write_batch(db_processor, thumbnail_store, pending_photo_infos, pending_fingerprints, pending_thumbnails)
+                    self.queue_face_detection(pending_photos, face_processor, put_face_work)
+                report_progress()
+
+            try:
+                face_processor.finish()
+            except Exception as e:
+                print(f"人脸识别或存储操作失败: {e}")
+            report_progress(force=True)
+            if photo_count:
+                db_processor.merge_search_index()  # 人脸姓名写入后合并一部分全文索引小段，搜索时少读几个小段
+        finally:
+            # 出现异常时两个阶段可能还在运行：通知它们停止并读完结果，直到都报告结束，工作进程池随之关闭
+            if ingest_running or faces_running:
+                self.cancel_event.set()
+                self.stop_stages(events, face_events, photos_to_encode, ingest_running, faces_running)
+                # 未能写入数据库的照片已经改名为正式文件，删除这些没有记录的文件
+                for photo_info in pending_photo_infos:
+                    discard_ingested_file(photo_info[7])
+            db_processor.close()
+
+        if self.cancel_event.is_set():
+            print(f"导入已取消，已导入 {photo_count} 张照片。")
         self.import_finished.emit(photo_count, thumbnail_count)  # 发送成功导入的统计信息
         if error_count > 0:
             self.import_error.emit(f"Failed to import {error_count} files.")  # 发送错误统计信息
         if skip_count > 0:
             print(f"Skipped {skip_count} files because they already exist in the database.")  # 输出跳过文件数目
             self.import_error.emit(f"Skipped {skip_count} files due to duplication.")  # 发送跳过文件的统计信息
-
-        # 在所有信息识别和文件存储完成后，调用process_photos进行人脸识别和信息存储
-        try:
-                # 弹出正在进行人脸识别的信息框
-            msgBox = QMessageBox()
-            msgBox.setText("正在进行人脸识别，请稍后...")
-            msgBox.setStandardButtons(QMessageBox.NoButton)
-            msgBox.show()
-            QApplication.processEvents()
-
-            # 调用process_photos进行人脸识别和信息存储
-            process_photos(list(zip(all_file_paths, all_file_hashes)), self.db_processor)
-            #            process_photos(all_file_paths, self.db_processor)
-
-                # 关闭信息框
-            msgBox.close()
-        except Exception as e:
-            print(f"人脸识别或存储操作失败: {e}")
         print(f"成功导入 {photo_count} 张照片。")
         if skip_count > 0:
             self.import_error.emit(f"Skippd to import {skip_count} files due to duplication.")
 
-    def get_decimal_from_dms(self, dms, ref):
-        degrees, minutes, seconds = dms
-        decimal = degrees + (minutes / 60.0) + (seconds / 3600.0)
-        if ref in ['S', 'W']:
-            decimal = -decimal
-        return decimal
-
-    def get_gps_location_from_exif(self, exif_data):
-        if 'GPSInfo' not in exif_data:
-            return 'Unknown location'
-
-        gps_info = exif_data['GPSInfo']
-        gps_latitude = gps_info.get("GPSLatitude")
-        gps_latitude_ref = gps_info.get('GPSLatitudeRef')
-        gps_longitude = gps_info.get('GPSLongitude')
-        gps_longitude_ref = gps_info.get('GPSLongitudeRef')
-
-        if gps_latitude and gps_latitude_ref and gps_longitude and gps_longitude_ref:
-            lat = self.get_decimal_from_dms(gps_latitude, gps_latitude_ref)
-            lon = self.get_decimal_from_dms(gps_longitude, gps_longitude_ref)
-            return f"{lat}, {lon}"
-        return 'Unknown location'
-
-    def extract_capture_info(self, exif_data, file_path):
-        if 'DateTimeOriginal' in exif_data:
-            capture_date = exif_data['DateTimeOriginal']
-            is_capture_time_accurate = 1
-        else:
-            # 使用文件的创建时间作为备选的拍摄时间
-            capture_date = time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(os.path.getctime(file_path)))
-            is_capture_time_accurate = 0
-
-        capture_location = self.get_gps_location_from_exif(exif_data)
-        return capture_date, capture_location, is_capture_time_accurate
+    def stop_stages(self, events, face_events, photos_to_encode, ingest_running, faces_running):
+        # 导入异常结束时调用：取消导入阶段，通知人脸阶段没有新的照片，读完两个阶段的结果直到都报告结束，
+        # 导入阶段已写出的临时副本随之删除
+        stop_sent = False
+        while ingest_running or faces_running:
+            if faces_running and not stop_sent:
+                try:
+                    photos_to_encode.put_nowait(STAGE_DONE)
+                    stop_sent = True
+                except Full:
+                    pass
+            for stage_queue in (events, face_events):
+                try:
+                    stage, result = stage_queue.get(timeout=STOP_POLL_INTERVAL)
+                except Empty:
+                    continue
+                if result is STAGE_DONE:
+                    if stage == 'ingest':
+                        ingest_running = False
+                    else:
+                        faces_running = False
+                elif stage == 'ingest' and not isinstance(result, Exception) and result[0] == INGEST_OK:
+                    discard_ingested_file(result[3][2])
+
+    def progress_snapshot(self, start_time, photo_count, skip_count, error_count, queued_photos, face_processor):
+        """
+        汇总当前导入进度
+
+        返回:
+        dict: scanned（已处理的文件数）、imported、skipped、errors、faces_queued（需要人脸识别的照片数）、
+        faces_done（已完成人脸识别的照片数）、faces_found（检测到的人脸数）、files_per_second、photos_per_second（人脸阶段）、
+        elapsed（秒）、cancelled
+        """
+        elapsed = time.monotonic() - start_time
+        scanned = photo_count + skip_count + error_count
+        return {
+            'scanned': scanned,
+            'imported': photo_count,
+            'skipped': skip_count,
+            'errors': error_count,
+            'faces_queued': queued_photos,
+            'faces_done': face_processor.photo_count,
+            'faces_found': face_processor.face_count,
+            'files_per_second': scanned / elapsed if elapsed > 0 else 0.0,
+            'photos_per_second': face_processor.photo_count / elapsed if elapsed > 0 else 0.0,
+            'elapsed': elapsed,
+            'cancelled': self.cancel_event.is_set(),
+        }
+
+    def emit_progress(self, progress, force=False):
+        # 限制发送频率，两次进度信号之间至少间隔 PROGRESS_INTERVAL 秒；force 为 True 时总是发送
+        now = time.monotonic()
+        if force or now - self.last_progress_time >= PROGRESS_INTERVAL:
+            self.last_progress_time = now
+            self.import_progress.emit(progress)
+
+    def queue_face_detection(self, photos, face_processor, put_face_work):
+        # 已写入数据库的照片：有检测缓存的直接归类，其余通过 put_face_work 送入人脸阶段，然后清空列表
+        for file_path, file_hash in photos:
+            cached = face_processor.cached_result(file_path, file_hash)
+            if cached is None:
+                put_face_work((file_path, file_hash))
+            else:
+                face_processor.add_result(cached, from_cache=True)
+        photos.clear()
+
+    def write_batch(self, db_processor, thumbnail_store, photo_infos, fingerprints, thumbnails):
+        # 在一个事务中写入一批照片信息、文件指纹和缩略图位置，缩略图在提交前顺序追加到打包文件，然后清空列表
+        if photo_infos or fingerprints:
+            with db_processor.transaction():
+                db_processor.add_photo_infos(photo_infos)
+                db_processor.add_file_fingerprints(fingerprints)
+                thumbnail_store.append(thumbnails)
+            photo_infos.clear()
+            fingerprints.clear()
+            thumbnails.clear()
 
     def process_file(self, file_path):
-        file_hash = self.calculate_file_hash(file_path)
-        if self.db_processor.query_photo_info_by_hash(file_hash):
+        status, file_path, file_hash, payload, fingerprint_row = ingest_file(
+            file_path, self.photo_storage_path,
+            self.db_processor.query_photo_id_by_hash, self.db_processor.query_file_fingerprint)
+        if fingerprint_row is not None:
+            self.db_processor.add_file_fingerprints([fingerprint_row])
+        if status == INGEST_SKIPPED:
             print("File already exists in database")
             return
-
-        try:
-            with Image.open(file_path) as image:
-                exif_data_raw = image._getexif()  # 获取原始EXIF数据
-                if exif_data_raw is not None:  # 检查EXIF数据是否存在
-                    exif_data = {ExifTags.TAGS[k]: v for k, v in exif_data_raw.items() if k in ExifTags.TAGS}
-                else:
-                    exif_data = {}  # 如果没有EXIF数据，使用空字典
-
-                gps_location = self.get_gps_location_from_exif(exif_data)
-                capture_date, capture_location, is_capture_time_accurate = self.extract_capture_info(exif_data,
-                                                                                                     file_path)
-                camera_model = exif_data.get('Make', 'Unknown')
-
-                thumbnail = self.create_thumbnail(image)
-                thumbnail_filename = os.path.basename(file_path).replace('.', '_thumb.')
-                thumbnail_path = os.path.join(self.thumbnail_storage_path, thumbnail_filename)
-                thumbnail.save(thumbnail_path)
-
-                shutil.copy2(file_path, os.path.join(self.photo_storage_path, os.path.basename(file_path)))
-
-                is_capture_time_accurate = 1 if 'DateTimeOriginal' in exif_data else 0
-                capture_location = 'Yes' if 'GPSInfo' in exif_data else 'No'  # 简化处理
-
-                photo_info = (
-                    os.path.basename(file_path),
-                    os.path.getsize(file_path),
-                    image.format,
-                    capture_date,
-                    int(is_capture_time_accurate),
-                    gps_location,
-                    camera_model,
-                    os.path.join(self.photo_storage_path, os.path.basename(file_path)),
-                    thumbnail_filename,
-                    thumbnail_path,
-                    file_hash,
-                    0  # IsLandscape
-                    )
+        if status == INGEST_OK:
+            photo_info, thumbnails, temp_path = payload
+            photo_info = commit_ingested_file(photo_info, temp_path)
+            thumbnail_store = ThumbnailStore(self.db_processor)
+            thumbnail_store.recover()
+            with self.db_processor.transaction():
                 self.db_processor.add_photo_info(photo_info)
-                return True
-        except UnidentifiedImageError:
-            print(f"Unidentified image format: {file_path}")
-            self.import_error.emit(f"Unidentified image format: {file_path}")
-            return False
-        except Exception as e:
-            print(f"Exception in process_file: {file_path}, Error: {e}")
-            self.import_error.emit(f"Exception in process_file: {file_path}, Error: {e}")
-            return False
+                thumbnail_store.append([(file_hash, size, data) for size, data in thumbnails])
+            return True
+        self.import_error.emit(payload if status == INGEST_FAILED else f"Exception in process_file: {file_path}, Error: {payload}")
+        return False
 
     def calculate_file_hash(self, file_path):
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+        return calculate_file_hash(file_path)
 
     def create_thumbnail(self, image, size=(128, 128)):
-        thumbnail = image.copy()
-        thumbnail.thumbnail(size)
-        return thumbnail
-
-    def get_exif_data(self, image):
-        try:
-            return {ExifTags.TAGS[k]: v for k, v in image._getexif().items() if k in ExifTags.TAGS}
-        except AttributeError:
-            return {}
-
-    def extract_capture_info(self, exif_data, file_path):
-        capture_date = exif_data.get('DateTimeOriginal', time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(os.path.getctime(file_path))))
-        capture_location = exif_data.get('GPSInfo', 'Unknown location')
-        is_capture_time_accurate = 0 if 'DateTimeOriginal' not in exif_data else 1
-        return capture_date, capture_location, is_capture_time_accurate
+        return create_thumbnail(image, size)
 
     def create_directory(self, path):
         if not os.path.exists(path):
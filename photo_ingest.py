@@ -0,0 +1,252 @@
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+import time
+import sqlite3
+from pathlib import Path
+from PIL import Image, ExifTags, UnidentifiedImageError
+from thumbnail_store import encode_thumbnails
+
+# 支持导入的图片扩展名
+PHOTO_EXTENSIONS = ('.png', '.jpg', '.jpeg', ".bmp", ".gif", ".tiff", ".webp", ".heic")
+
+# 计算哈希时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 单个文件处理结果的状态
+INGEST_OK = 'ok'            # 处理成功，附带 (photo_info, 缩略图列表, 临时副本路径)
+INGEST_SKIPPED = 'skipped'  # 数据库中已存在相同哈希
+INGEST_FAILED = 'failed'    # 图片无法识别等处理失败，附带错误信息
+INGEST_ERROR = 'error'      # 意外异常，计入错误数
+
+# 工作进程写出的临时副本的文件名前缀，导入线程接受该照片后才改名为正式文件
+INGEST_TEMP_PREFIX = '.ingest-'
+
+# 工作进程内的状态，由 init_ingest_worker 初始化
+_worker_conn = None
+_worker_storage = None
+
+
+def iter_photo_files(folder_path):
+    # 遍历目录，逐个产出支持的图片文件路径
+    for root, dirs, files in os.walk(folder_path):
+        for file in files:
+            if file.lower().endswith(PHOTO_EXTENSIONS):
+                yield os.path.join(root, file)
+
+
+def calculate_file_hash(file_path):
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for byte_block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+def file_fingerprint(file_path):
+    # 文件的廉价指纹：大小、修改时间（纳秒）和 inode，只需一次 stat，不读取文件内容
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def read_file_buffer(file_path):
+    # 一次性读入整个文件，哈希、EXIF、缩略图和复制都复用这份数据
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def write_file_buffer(buffer, source_path, target_path):
+    # 用已读入的数据写出副本，并像 shutil.copy2 一样保留源文件的时间戳等元数据
+    with open(target_path, "wb") as f:
+        f.write(buffer)
+    shutil.copystat(source_path, target_path)
+
+
+def write_ingest_copy(buffer, source_path, photo_storage_path):
+    # 把照片写成照片库中唯一的临时文件，同名或重复的文件并行处理时互不覆盖，返回临时文件路径
+    fd, temp_path = tempfile.mkstemp(prefix=INGEST_TEMP_PREFIX, suffix=os.path.splitext(source_path)[1], dir=photo_storage_path)
+    os.close(fd)
+    try:
+        write_file_buffer(buffer, source_path, temp_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def create_thumbnail(image, size=(128, 128)):
+    thumbnail = image.copy()
+    thumbnail.thumbnail(size)
+    return thumbnail
+
+
+def get_decimal_from_dms(dms, ref):
+    degrees, minutes, seconds = dms
+    decimal = degrees + (minutes / 60.0) + (seconds / 3600.0)
+    if ref in ['S', 'W']:
+        decimal = -decimal
+    return decimal
+
+
+def get_gps_location_from_exif(exif_data):
+    if 'GPSInfo' not in exif_data:
+        return 'Unknown location'
+
+    gps_info = exif_data['GPSInfo']
+    gps_latitude = gps_info.get("GPSLatitude")
+    gps_latitude_ref = gps_info.get('GPSLatitudeRef')
+    gps_longitude = gps_info.get('GPSLongitude')
+    gps_longitude_ref = gps_info.get('GPSLongitudeRef')
+
+    if gps_latitude and gps_latitude_ref and gps_longitude and gps_longitude_ref:
+        lat = get_decimal_from_dms(gps_latitude, gps_latitude_ref)
+        lon = get_decimal_from_dms(gps_longitude, gps_longitude_ref)
+        return f"{lat}, {lon}"
+    return 'Unknown location'
+
+
+def extract_capture_info(exif_data, file_path):
+    capture_date = exif_data.get('DateTimeOriginal', time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(os.path.getctime(file_path))))
+    capture_location = exif_data.get('GPSInfo', 'Unknown location')
+    is_capture_time_accurate = 0 if 'DateTimeOriginal' not in exif_data else 1
+    return capture_date, capture_location, is_capture_time_accurate
+
+
+def ingest_file(file_path, photo_storage_path, hash_exists, lookup_fingerprint):
+    """
+    处理单个照片文件：计算哈希、解析EXIF、生成各尺寸的缩略图并复制为照片库中的临时文件，源文件只读取一次
+
+    参数:
+    file_path (str): 源文件路径
+    photo_storage_path (str): 照片库目录
+    hash_exists (callable): 判断哈希是否已存在于数据库的函数
+    lookup_fingerprint (callable): 按 (源路径, 大小, 修改时间, inode) 查询指纹缓存中已知哈希的函数
+
+    返回:
+    tuple: (状态, 文件路径, 文件哈希, 附加数据, 指纹记录)，成功时附加数据为 (photo_info, [(尺寸, JPEG 数据), ...], 临时副本路径)，
+    缩略图由调用方写入打包缩略图文件，临时副本由调用方用 commit_ingested_file 改名或用 discard_ingested_file 删除；
+    失败时附加数据为错误信息；
+    新计算出哈希时指纹记录为 (源路径, 大小, 修改时间, inode, 哈希)，需要由调用方写入指纹缓存，否则为 None
+    """
+    try:
+        source_path = os.path.abspath(file_path)
+        fingerprint = file_fingerprint(file_path)
+        # 文件自上次导入后没有变化且仍在库中时，直接跳过，不读取文件内容
+        cached_hash = lookup_fingerprint(source_path, *fingerprint)
+        if cached_hash and hash_exists(cached_hash):
+            return INGEST_SKIPPED, file_path, cached_hash, None, None
+
+        buffer = read_file_buffer(file_path)
+        file_hash = hashlib.sha256(buffer).hexdigest()
+        fingerprint_row = (source_path, *fingerprint, file_hash)
+        if hash_exists(file_hash):
+            return INGEST_SKIPPED, file_path, file_hash, None, fingerprint_row
+    except Exception as e:
+        return INGEST_ERROR, file_path, None, str(e), None
+
+    try:
+        with Image.open(io.BytesIO(buffer)) as image:
+            exif_data_raw = image._getexif()  # 获取原始EXIF数据
+            if exif_data_raw is not None:  # 检查EXIF数据是否存在
+                exif_data = {ExifTags.TAGS[k]: v for k, v in exif_data_raw.items() if k in ExifTags.TAGS}
+            else:
+                exif_data = {}  # 如果没有EXIF数据，使用空字典
+
+            gps_location = get_gps_location_from_exif(exif_data)
+            capture_date, capture_location, is_capture_time_accurate = extract_capture_info(exif_data, file_path)
+            camera_model = exif_data.get('Make', 'Unknown')
+
+            # 缩略图不再单独保存为文件，按文件哈希写入打包缩略图文件
+            thumbnails = encode_thumbnails(image)
+
+            temp_path = write_ingest_copy(buffer, file_path, photo_storage_path)
+
+            photo_info = (
+                os.path.basename(file_path),
+                len(buffer),
+                image.format,
+                capture_date,
+                int(is_capture_time_accurate),
+                gps_location,
+                camera_model,
+                os.path.join(photo_storage_path, os.path.basename(file_path)),  # 预期路径，改名时与已有文件重名则另取文件名
+                '',  # Thumbnail，旧版本的缩略图文件名
+                '',  # ThumbnailPath，旧版本的缩略图文件路径
+                file_hash,
+                0  # IsLandscape
+                )
+            return INGEST_OK, file_path, file_hash, (photo_info, thumbnails, temp_path), fingerprint_row
+    except UnidentifiedImageError:
+        print(f"Unidentified image format: {file_path}")
+        return INGEST_FAILED, file_path, file_hash, f"Unidentified image format: {file_path}", None
+    except Exception as e:
+        print(f"Exception in process_file: {file_path}, Error: {e}")
+        return INGEST_FAILED, file_path, file_hash, f"Exception in process_file: {file_path}, Error: {e}", None
+
+
+def unused_storage_path(target_path, file_hash):
+    # 照片库中已有同名文件（可能属于其他照片）时，在文件名后加上哈希前缀，仍然重名再加序号
+    if not os.path.exists(target_path):
+        return target_path
+    stem, ext = os.path.splitext(target_path)
+    candidate = f"{stem}_{file_hash[:8]}{ext}"
+    counter = 1
+    while os.path.exists(candidate):
+        candidate = f"{stem}_{file_hash[:8]}_{counter}{ext}"
+        counter += 1
+    return candidate
+
+
+def commit_ingested_file(photo_info, temp_path):
+    """
+    导入线程接受一张照片后调用：把临时副本改名为照片库中的正式文件，不覆盖任何已有文件
+
+    参数:
+    photo_info (tuple): ingest_file 返回的照片信息，第 8 项为预期的照片路径
+    temp_path (str): ingest_file 写出的临时副本路径
+
+    返回:
+    tuple: 照片路径更新为实际文件路径后的照片信息
+    """
+    file_path = unused_storage_path(photo_info[7], photo_info[10])
+    os.replace(temp_path, file_path)
+    return photo_info[:7] + (file_path,) + photo_info[8:]
+
+
+def discard_ingested_file(temp_path):
+    # 批次内的重复文件只删除自己的临时副本，已接受的照片文件不受影响
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+def remove_stale_ingest_files(photo_storage_path):
+    # 删除上次导入中断时遗留的临时副本，只能在没有其他导入进行时调用
+    for entry in os.scandir(photo_storage_path):
+        if entry.is_file() and entry.name.startswith(INGEST_TEMP_PREFIX):
+            os.remove(entry.path)
+
+
+def init_ingest_worker(db_path, photo_storage_path):
+    # 进程池初始化：每个工作进程打开一个只读数据库连接用于查重
+    global _worker_conn, _worker_storage
+    db_uri = Path(os.path.abspath(db_path)).as_uri() + '?mode=ro'
+    _worker_conn = sqlite3.connect(db_uri, uri=True, timeout=30)
+    _worker_storage = photo_storage_path
+
+
+def _worker_hash_exists(file_hash):
+    return _worker_conn.execute('SELECT 1 FROM PhotoInfoTable WHERE FileHash=?', (file_hash,)).fetchone() is not None
+
+
+def _worker_lookup_fingerprint(source_path, file_size, mtime, inode):
+    row = _worker_conn.execute('''
+        SELECT FileHash FROM FileFingerprints WHERE SourcePath=? AND FileSize=? AND MTime=? AND Inode=?
+    ''', (source_path, file_size, mtime, inode)).fetchone()
+    return row[0] if row else None
+
+
+def ingest_worker(file_path):
+    # 在工作进程中执行的单文件处理入口
+    return ingest_file(file_path, _worker_storage, _worker_hash_exists, _worker_lookup_fingerprint)
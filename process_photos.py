@@ -1,40 +1,165 @@
-import face_recognition
 import os
 import sys
+import json
 import numpy as np
-from sklearn.cluster import DBSCAN
-import matplotlib.pyplot as plt
-from scipy.spatial.distance import pdist, squareform
-import dlib
+from face_encoder import iter_face_encodings, face_settings_key, DETECTION_MAX_EDGE
+from embedding_store import EmbeddingStore
+from face_clustering import assign_faces
+from face_index import open_face_index
 
-def process_photos(photo_source, db_processor):
+# 每累计多少张照片的检测结果写入一次缓存
+DETECTION_CACHE_BATCH_SIZE = 100
+# 每累计多少张人脸进行一次归类和写入
+FACE_BATCH_SIZE = 256
+
+
+class FaceProcessor:
+    """
+    人脸归类和写入
+
+    逐张接收人脸检测和编码结果，按批与已有人脸匹配、对剩余人脸聚类，并在一个事务中写入人脸、照片关联和编码矩阵。
+    只保留当前一批人脸，内存占用与导入的照片数量无关。
+    """
+
+    def __init__(self, db_processor, detection_max_edge=DETECTION_MAX_EDGE, diagnostics_dir=None):
+        self.db_processor = db_processor
+        self.settings_key = face_settings_key(detection_max_edge)
+        self.diagnostics_dir = diagnostics_dir
+        self.diagnostic_sample = None  # 仅在生成诊断时保留固定数量的抽样编码
+        if diagnostics_dir:
+            from face_diagnostics import EncodingSample
+            self.diagnostic_sample = EncodingSample()
+
+        # 从人脸编码矩阵和索引中获取已有的人脸数据
+        self.embedding_store = EmbeddingStore(db_processor)
+        self.face_index = open_face_index(self.embedding_store)  # 与相似人脸查询共用同一个索引
+        self.label_by_face_id = dict(db_processor.query_face_labels() or [])
+
+        # 获取数据库中最大FaceID
+        max_face_id = db_processor.get_max_face_id()
+        self.unnamed_counter = max_face_id + 1 if max_face_id is not None else 1
+
+        self.encodings = []
+        self.photo_paths = []
+        self.file_hashes = []
+        self.detections = []  # 待写入缓存的检测结果
+        self.photo_count = 0  # 已处理的照片数（含读取缓存的照片）
+        self.face_count = 0  # 已检测到的人脸数
+
+    def cached_result(self, photo_path, file_hash):
+        # 读取检测结果缓存，返回值与 encode_photo 相同；没有缓存时返回 None
+        cached = self.db_processor.query_face_detection(file_hash, self.settings_key)
+        if cached is None:
+            return None
+        face_locations, face_landmarks, encodings_blob = cached
+        face_encodings = list(np.frombuffer(encodings_blob, dtype=np.float64).reshape(-1, 128))
+        return photo_path, file_hash, [tuple(box) for box in json.loads(face_locations)], json.loads(face_landmarks), face_encodings
+
+    def add_result(self, result, from_cache=False):
+        photo_path, file_hash, face_locations, face_landmarks, face_encodings = result
+        self.photo_count += 1
+        self.face_count += len(face_encodings)
+        if not from_cache and face_locations is not None:
+            self.detections.append((file_hash, self.settings_key, json.dumps(face_locations), json.dumps(face_landmarks),
+                                    np.asarray(face_encodings, dtype=np.float64).tobytes()))
+            if len(self.detections) >= DETECTION_CACHE_BATCH_SIZE:
+                self.write_detections()
+
+        if len(face_encodings) > 0:
+            self.encodings.extend(face_encodings)
+            self.photo_paths.extend([photo_path] * len(face_encodings))
+            self.file_hashes.extend([file_hash] * len(face_encodings))
+            if self.diagnostic_sample is not None:
+                self.diagnostic_sample.add(face_encodings)
+            print(f"检测到人脸在照片 {photo_path} 中")
+        else:
+            print(f"未在照片 {photo_path} 中检测到人脸")
+
+        if len(self.encodings) >= FACE_BATCH_SIZE:
+            self.flush()
+
+    def write_detections(self):
+        if self.detections:
+            with self.db_processor.transaction():
+                self.db_processor.add_face_detections(self.detections)
+            self.detections = []
+
+    def flush(self):
+        # 对当前一批人脸进行增量归类：先匹配已有人脸，只对剩余的人脸聚类
+        if len(self.encodings) == 0:
+            return
+        db_processor = self.db_processor
+        try:
+            matches, clusters = assign_faces(self.face_index, self.encodings)
+            cluster_faces = {}  # 剩余人脸的新簇编号 -> (FaceID, FaceLabel)
+            photo_id_map = {}  # 文件哈希 -> PhotoID，避免同一照片的多张人脸重复查询
+            links = []  # 待写入的 (PhotoID, FaceID)
+            new_faces = []  # 本批新增的 (FaceID, 编码)，写入人脸编码矩阵
+            # 本批人脸和关联在一个事务中写入
+            with db_processor.transaction():
+                for photo_path, encoding, match, cluster, file_hash in zip(self.photo_paths, self.encodings, matches, clusters, self.file_hashes):
+                    if match >= 0:
+                        # 归入已有人脸，使用已有的标签，确保标签一致性
+                        face_id = int(self.face_index.row_face_ids[match])
+                        face_label = self.label_by_face_id.get(face_id)
+                    elif cluster >= 0 and cluster in cluster_faces:
+                        face_id, face_label = cluster_faces[cluster]
+                    else:
+                        # 噪声点（未分类的人脸）或新簇的第一张人脸
+                        face_label = f"未命名{self.unnamed_counter}"
+                        face_id = db_processor.add_face_info(encoding.tobytes(), face_label)
+                        new_faces.append((face_id, encoding))
+                        self.label_by_face_id[face_id] = face_label
+                        self.unnamed_counter += 1
+                        if cluster >= 0:
+                            cluster_faces[cluster] = (face_id, face_label)
+
+                    # 转换photo_path为photo_info_id
+                    if file_hash not in photo_id_map:
+                        photo_id_map[file_hash] = db_processor.query_photo_id_by_hash(os.path.basename(file_hash))
+                    photo_info_id = photo_id_map[file_hash]
+                    if photo_info_id is not None:
+                        print(f"将人脸ID {face_id} 与照片ID {photo_info_id} 关联")
+                        links.append((photo_info_id, face_id))
+                        print(f"成功写入人脸信息: {face_label}")
+                    else:
+                        print(f"未找到与路径 {photo_path} 关联的照片信息")
+                db_processor.link_faces(links)
+                self.embedding_store.append([face_id for face_id, _ in new_faces], [encoding for _, encoding in new_faces])
+            # 新增的人脸加入相似度索引，后续批次可以直接匹配到
+            self.face_index.extend([face_id for face_id, _ in new_faces])
+        except Exception as e:
+            print(f"聚类过程中出现错误: {e}")
+        self.encodings = []
+        self.photo_paths = []
+        self.file_hashes = []
+
+    def finish(self):
+        self.write_detections()
+        self.flush()
+        self.face_index.save()
+        # 可选：采样估计人脸编码之间的距离分布，写入诊断文件
+        if self.diagnostic_sample is not None and self.diagnostic_sample.seen > 0:
+            from face_diagnostics import write_distance_report
+            write_distance_report(self.diagnostic_sample.sample(), self.diagnostics_dir,
+                                  total_faces=self.diagnostic_sample.seen)
+
+
+def process_photos(photo_source, db_processor, workers=1, detection_max_edge=DETECTION_MAX_EDGE, diagnostics_dir=None):
     """
     对一组照片进行人脸识别和聚类
 
     参数:
     photo_source (list): 照片来源列表，每个元素是一个包含文件路径和哈希值的元组 (photo_path, file_hash)
     db_processor (DBprocess): 数据库处理对象
+    workers (int): 人脸编码的工作进程数，1 表示在当前进程中逐张处理
+    detection_max_edge (int): 人脸检测时图片长边的最大像素数，None 表示在原图上检测
+    diagnostics_dir (str): 人脸距离分布诊断的输出目录，None 表示不生成诊断
 
     无返回值
 
     """
-    encodings = []
-    photo_paths = []
-    file_hashes = []
-
-    # 从数据库中获取已有的人脸数据
-    existing_encodings = []
-    existing_labels = []
-    face_id_map = {}  # 用于存储已有的FaceID和标签的映射
-    all_faces = db_processor.query_all_faces()
-    for face in all_faces:
-        existing_encodings.append(np.frombuffer(face[1], dtype=np.float64))  # face[1] 是人脸编码
-        existing_labels.append(face[2])  # face[2] 是人脸标签
-        face_id_map[face[2]] = face[0]  # face[0] 是 FaceID, face[2] 是 FaceLabel
-
-    # 获取数据库中最大FaceID
-    max_face_id = db_processor.get_max_face_id()
-    unnamed_counter = max_face_id + 1 if max_face_id is not None else 1
+    face_processor = FaceProcessor(db_processor, detection_max_edge, diagnostics_dir)
 
     # 获取当前脚本所在的目录
     if getattr(sys, 'frozen', False):
@@ -58,83 +183,14 @@ def process_photos(photo_source, db_processor):
     # # 加载人脸检测模型打包用的代码
     # face_detector = dlib.get_frontal_face_detector()
 
+    # 已缓存检测结果的照片直接读取缓存，其余照片进行人脸检测和编码
+    uncached = []
     for photo_path, file_hash in photo_source:
-        image_array = face_recognition.load_image_file(photo_path)
-        # # 使用dlib检测人脸位置 打包用的代码
-        # face_locations = face_detector(image_array, 1)
-        # # 获取每个检测到的人脸的关键点 打包用的代码
-        # face_encodings = []
-        # for face_location in face_locations:
-        #     shape = landmark_predictor(image_array, face_location)
-        #     face_encoding = np.array(face_rec_model.compute_face_descriptor(image_array, shape, num_jitters=10, model='large'))
-        #     face_encodings.append(face_encoding)
-
-        face_encodings = face_recognition.face_encodings(image_array, num_jitters=5, model='large')
-        # # 使用CNN算法进行人脸检测
-        #face_locations = face_recognition.face_locations(image_array, model='cnn')
-        #face_encodings = face_recognition.face_encodings(image_array, known_face_locations=face_locations)
-        if len(face_encodings) > 0:
-            encodings.extend(face_encodings)
-            photo_paths.extend([photo_path] * len(face_encodings))
-            file_hashes.extend([file_hash] * len(face_encodings))
-            print(f"检测到人脸在照片 {photo_path} 中")
-        else:
-            print(f"未在照片 {photo_path} 中检测到人脸")
-
-    # 合并新检测到的编码和已有的编码
-    all_encodings = existing_encodings + encodings
-
-    # 计算人脸编码之间的欧氏距离
-    distances = pdist(encodings, 'euclidean')
-    distance_matrix = squareform(distances)
-    # 设置中文字体
-    plt.rcParams['font.sans-serif'] = ['SimHei']  # 指定默认字体
-    plt.rcParams['axes.unicode_minus'] = False  # 解决保存图像时负号 '-' 显示为方块的问题
-    # 绘制距离分布图
-    plt.hist(distances, bins=50)
-    plt.xlabel('距离')
-    plt.ylabel('频率')
-    plt.title('人脸编码距离分布')
-    plt.show()
-
-    # 对人脸编码进行聚类
-    try:
-        if len(encodings) > 0:
-            clustering = DBSCAN(eps=0.6, min_samples=3, metric="euclidean").fit(all_encodings)
-            if hasattr(clustering, 'labels_'):  # 检查属性是否存在
-                labels = clustering.labels_
-                # 仅处理新检测到的编码部分
-                for i, (photo_path, encoding, label, file_hash) in enumerate(
-                        zip(photo_paths, encodings, labels[len(existing_encodings):], file_hashes)):
-                    if label == -1:  # 噪声点（未分类的人脸）
-                        face_label = f"未命名{unnamed_counter}"
-                        face_id = db_processor.add_face_info(encoding.tobytes(), face_label)
-                        unnamed_counter += 1
-                    else:
-                        # 使用已有的标签，确保标签一致性
-                        if label < len(existing_labels):
-                            face_label = existing_labels[label]  # 使用已有的标签
-                            face_id = face_id_map[face_label]  # 获取对应的FaceID
-                        else:
-                            face_label = f"未命名{unnamed_counter}"
-                            face_id = db_processor.add_face_info(encoding.tobytes(), face_label)
-                            unnamed_counter += 1
-                            # 更新标签映射
-                            existing_labels.append(face_label)
-                            face_id_map[face_label] = face_id
-
-                    # 转换photo_path为photo_info_id
-                    photo_info = db_processor.query_photo_info_by_hash(os.path.basename(file_hash))
-                    if photo_info:
-                        photo_info_id = photo_info[0]
-                        print(f"将人脸ID {face_id} 与照片ID {photo_info_id} 关联")
-                        db_processor.link_face_to_photo(photo_info_id, face_id)
-                        print(f"成功写入人脸信息: {face_label}")
-                    else:
-                        print(f"未找到与路径 {photo_path} 关联的照片信息")
-            else:
-                print("DBSCAN 聚类失败，未生成 labels_ 属性")
+        cached = face_processor.cached_result(photo_path, file_hash)
+        if cached is None:
+            uncached.append((photo_path, file_hash))
         else:
-            print("未检测到任何人脸编码")
-    except Exception as e:
-        print(f"聚类过程中出现错误: {e}")
\ No newline at end of file
+            face_processor.add_result(cached, from_cache=True)
+    for result in iter_face_encodings(uncached, workers, detection_max_edge):
+        face_processor.add_result(result)
+    face_processor.finish()
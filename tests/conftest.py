@@ -0,0 +1,11 @@
+import pytest
+from DBprocess import DBprocess
+
+
+@pytest.fixture
+def db_processor(tmp_path, monkeypatch):
+    # 数据库、编码矩阵、照片库和打包缩略图都使用相对路径，在临时目录中创建
+    monkeypatch.chdir(tmp_path)
+    db_processor = DBprocess()
+    yield db_processor
+    db_processor.close()
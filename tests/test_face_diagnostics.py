@@ -0,0 +1,17 @@
+import numpy as np
+from face_diagnostics import EncodingSample
+
+
+def test_encoding_sample_keeps_a_fixed_number_of_encodings():
+    sample = EncodingSample(size=50)
+    encodings = np.arange(1000, dtype=np.float64).repeat(128).reshape(-1, 128)
+    sample.add(encodings[:30])
+    assert sample.seen == 30
+    assert sample.sample()[:, 0].tolist() == list(range(30))
+
+    for start in range(30, 1000, 70):
+        sample.add(encodings[start:start + 70])
+    kept = sample.sample()[:, 0]
+    assert sample.seen == 1000
+    assert len(kept) == 50 and len(set(kept)) == 50
+    assert kept.max() >= 50  # 后来的编码也有机会被抽中
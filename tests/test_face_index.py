@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+import face_index
+from embedding_store import EmbeddingStore
+
+
+def add_faces(db_processor, encodings):
+    embedding_store = EmbeddingStore(db_processor)
+    with db_processor.transaction():
+        face_ids = db_processor.add_faces([(b'', f"未命名{i}") for i in range(len(encodings))])
+        embedding_store.append(face_ids, encodings)
+    return face_ids
+
+
+def test_search_similar_faces_in_image(db_processor, monkeypatch):
+    encodings = np.random.default_rng(0).random((3, 128), dtype=np.float32)
+    face_ids = add_faces(db_processor, encodings)
+    # 不做真实的人脸检测，图片中只有一张与第二个人脸相同的人脸
+    monkeypatch.setattr(face_index, 'encode_photo',
+                        lambda photo: (photo[0], photo[1], [(0, 1, 1, 0)], [{}], [encodings[1]]))
+
+    results = face_index.search_similar_faces_in_image(db_processor, 'query.jpg', k=1)
+
+    assert len(results) == 1
+    assert [face_id for face_id, _ in results[0]] == [face_ids[1]]
+    assert results[0][0][1] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_search_similar_faces_in_image_without_faces(db_processor, monkeypatch):
+    add_faces(db_processor, np.random.default_rng(1).random((2, 128), dtype=np.float32))
+    monkeypatch.setattr(face_index, 'encode_photo', lambda photo: (photo[0], photo[1], [], [], []))
+
+    assert face_index.search_similar_faces_in_image(db_processor, 'empty.jpg') == []
+
+
+def test_search_does_not_write_files(db_processor):
+    encodings = np.random.default_rng(2).random((3, 128), dtype=np.float32)
+    face_ids = add_faces(db_processor, encodings)
+    embedding_store = EmbeddingStore(db_processor, read_only=True)
+    # 模拟导入正在追加、尚未写完的一行编码
+    with open(embedding_store.file_path, 'ab') as f:
+        f.write(b'\0' * 100)
+    size = os.path.getsize(embedding_store.file_path)
+
+    results = face_index.search_similar_faces(db_processor, encodings[2], k=1)
+
+    assert [face_id for face_id, _ in results] == [face_ids[2]]
+    assert os.path.getsize(embedding_store.file_path) == size
+    assert not os.path.exists(face_index.shared_face_index(db_processor).index_path)
+
+
+def test_search_reuses_index_extended_by_import(db_processor):
+    encodings = np.random.default_rng(3).random((2, 128), dtype=np.float32)
+    assert face_index.search_similar_faces(db_processor, encodings[0]) == []
+    shared = face_index.shared_face_index(db_processor)
+
+    # 导入时的写入方式：追加编码后用 extend 更新共用的索引
+    embedding_store = EmbeddingStore(db_processor)
+    writer_index = face_index.open_face_index(embedding_store)
+    with db_processor.transaction():
+        face_ids = db_processor.add_faces([(b'', f"未命名{i}") for i in range(len(encodings))])
+        embedding_store.append(face_ids, encodings)
+    writer_index.extend(face_ids)
+
+    assert writer_index is shared
+    assert face_index.shared_face_index(db_processor) is shared
+    results = face_index.search_similar_faces(db_processor, encodings[1], k=1)
+    assert [face_id for face_id, _ in results] == [face_ids[1]]
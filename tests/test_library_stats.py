@@ -0,0 +1,52 @@
+def photo_info(name, file_size):
+    return (name, file_size, 'JPEG', '2023:05:01 10:00:00', 1, 'Unknown location', 'Unknown', f'images/{name}', '', '',
+            name, 0)
+
+
+def add_photos(db_processor, photos):
+    with db_processor.transaction():
+        db_processor.add_photo_infos([photo_info(name, file_size) for name, file_size in photos])
+    return {name: db_processor.query_photo_id_by_hash(name) for name, _ in photos}
+
+
+def person_counts(db_processor):
+    return {face_id: count for face_id, _, count, _, _ in db_processor.query_persons()}
+
+
+def test_library_stats_follow_photo_and_face_changes(db_processor):
+    photo_ids = add_photos(db_processor, [('a.jpg', 100), ('b.jpg', 250)])
+    db_processor.add_faces([(b'', '未命名1'), (b'', '未命名2')])
+    assert db_processor.query_library_stats() == {'PhotoCount': 2, 'TotalBytes': 350, 'FaceCount': 2}
+
+    db_processor.delete_photo_info(photo_ids['a.jpg'])
+    assert db_processor.query_library_stats() == {'PhotoCount': 1, 'TotalBytes': 250, 'FaceCount': 2}
+
+    db_processor.clear_all_photos()
+    assert db_processor.query_library_stats() == {'PhotoCount': 0, 'TotalBytes': 0, 'FaceCount': 0}
+
+
+def test_person_stats_follow_links_and_deletes(db_processor):
+    photo_ids = add_photos(db_processor, [('a.jpg', 1), ('b.jpg', 1), ('c.jpg', 1)])
+    alice, bob = db_processor.add_faces([(b'', 'Alice'), (b'', 'Bob')])
+    with db_processor.transaction():
+        db_processor.link_faces([(photo_ids['a.jpg'], alice), (photo_ids['b.jpg'], alice), (photo_ids['b.jpg'], bob)])
+    assert person_counts(db_processor) == {alice: 2, bob: 1}
+
+    db_processor.update_face_name(alice, 'Alice Smith')
+    assert person_counts(db_processor) == {alice: 2, bob: 1}
+
+    db_processor.delete_photo_info(photo_ids['b.jpg'])
+    assert person_counts(db_processor) == {alice: 1}
+    assert [photo.PhotoID for photo in db_processor.photos_by_person(alice)] == [photo_ids['a.jpg']]
+
+
+def test_person_stats_count_each_photo_once(db_processor):
+    photo_ids = add_photos(db_processor, [('a.jpg', 1), ('b.jpg', 1)])
+    alice, = db_processor.add_faces([(b'', 'Alice')])
+    # 照片 a 中的两张人脸都匹配到 Alice
+    with db_processor.transaction():
+        db_processor.link_faces([(photo_ids['a.jpg'], alice), (photo_ids['a.jpg'], alice), (photo_ids['b.jpg'], alice)])
+    with db_processor.transaction():
+        db_processor.link_faces([(photo_ids['b.jpg'], alice)])
+    assert person_counts(db_processor) == {alice: 2}
+    assert [photo.PhotoID for photo in db_processor.photos_by_person(alice)] == [photo_ids['a.jpg'], photo_ids['b.jpg']]
@@ -0,0 +1,56 @@
+import pytest
+from DBprocess import SCHEMA_MIGRATIONS
+
+
+def photo_info(name, capture_time):
+    return (name, 1, 'JPEG', capture_time, 1, 'Unknown location', 'Unknown', f'images/{name}', '', '', name, 0)
+
+
+def month_counts(db_processor):
+    return dict(db_processor.query_month_counts() or [])
+
+
+def add_photos(db_processor, photos):
+    with db_processor.transaction():
+        db_processor.add_photo_infos([photo_info(name, capture_time) for name, capture_time in photos])
+
+
+@pytest.mark.parametrize('capture_key_trigger_first', [False, True])
+def test_month_counts_do_not_depend_on_trigger_order(db_processor, capture_key_trigger_first):
+    if capture_key_trigger_first:
+        # SQLite 先执行后创建的触发器：重新创建 CaptureKey 触发器，使其在每月统计触发器之前执行
+        trigger_sql = db_processor.execute_read(
+            "SELECT sql FROM sqlite_master WHERE name = 'trg_PhotoInfo_Insert_CaptureKey'", fetch_one=True)[0]
+        with db_processor.transaction():
+            db_processor.execute_query('DROP TRIGGER trg_PhotoInfo_Insert_CaptureKey')
+            db_processor.execute_query(trigger_sql)
+
+    add_photos(db_processor, [('a.jpg', '2023:05:01 10:00:00'), ('b.jpg', '2023:05:20 08:00:00'),
+                              ('c.jpg', '2024-01-02 00:00:00'), ('d.jpg', 'unknown')])
+
+    assert month_counts(db_processor) == {'2023-05': 2, '2024-01': 1, '': 1}
+
+
+def test_month_counts_follow_capture_time_changes_and_deletes(db_processor):
+    add_photos(db_processor, [('a.jpg', '2023:05:01 10:00:00'), ('b.jpg', '2023:05:20 08:00:00')])
+
+    with db_processor.transaction():
+        db_processor.execute_query("UPDATE PhotoInfoTable SET CaptureTime = '2022:12:31 23:59:59' WHERE FileName = 'a.jpg'")
+    assert month_counts(db_processor) == {'2023-05': 1, '2022-12': 1}
+
+    with db_processor.transaction():
+        db_processor.execute_query("DELETE FROM PhotoInfoTable WHERE FileName = 'b.jpg'")
+    assert month_counts(db_processor) == {'2022-12': 1}
+    assert db_processor.execute_read('PRAGMA user_version', fetch_one=True)[0] == len(SCHEMA_MIGRATIONS)
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_month_seek_key_starts_at_first_photo_of_month(db_processor, descending):
+    add_photos(db_processor, [('a.jpg', '2023:05:01 10:00:00'), ('b.jpg', '2023:05:31 23:59:59'), ('c.jpg', 'unknown'),
+                              ('d.jpg', '2023:06:01 00:00:00'), ('e.jpg', '2024:01:15 12:00:00'), ('f.jpg', 'unknown')])
+    all_photos = db_processor.photos_by_date(descending=descending)
+
+    for month, _ in db_processor.query_month_counts(descending):
+        photos = db_processor.photos_by_date(db_processor.month_seek_key(month, descending), descending=descending)
+        first = [photo.CaptureKey[:7] for photo in all_photos].index(month)
+        assert photos == all_photos[first:]
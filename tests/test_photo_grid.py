@@ -0,0 +1,44 @@
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import pytest
+from PyQt5.QtWidgets import QApplication
+from photo_grid import PhotoGridView, PhotoItem, GridHeader, format_month
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+def month_items(month, count):
+    return [GridHeader(format_month(month), None)] + [
+        PhotoItem(i, f'{month}-{i}.jpg', '', f'{month}-01 00:00:00', f'{month}-{i}') for i in range(count)]
+
+
+def test_scroll_to_unloaded_month_requests_reload_without_paging(app):
+    view = PhotoGridView()
+    pages = []
+
+    def fetch_page():
+        pages.append(True)
+        return month_items('2023-06', 4)
+
+    view.photo_model.set_items(month_items('2023-05', 4), 2, fetch_page)
+    view.set_month_counts([('2023-05', 4), ('2023-06', 4), ('2024-01', 4)])
+    requested = []
+    view.month_requested.connect(requested.append)
+
+    view.scroll_to_month('2024-01')
+
+    assert requested == ['2024-01']
+    assert pages == []
+
+
+def test_timeline_starts_at_loaded_month(app):
+    view = PhotoGridView()
+    view.photo_model.set_items(month_items('2023-06', 4), 2)
+    view.set_month_counts([('2023-05', 4), ('2023-06', 4)], start_month='2023-06')
+
+    assert view.timeline().month_at(0) == '2023-06'
@@ -0,0 +1,143 @@
+import os
+import threading
+import pytest
+from PIL import Image
+import photo_importer
+from face_encoder import face_settings_key
+from photo_importer import PhotoImporter
+
+
+@pytest.fixture(autouse=True)
+def no_face_detection(monkeypatch):
+    # 不做真实的人脸检测，每张照片都没有人脸
+    def iter_face_encodings(photos, workers, detection_max_edge):
+        for file_path, file_hash in photos:
+            yield file_path, file_hash, [], [], []
+    monkeypatch.setattr(photo_importer, 'iter_face_encodings', iter_face_encodings)
+
+
+def save_image(path, color):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new('RGB', (32, 32), color).save(path)
+
+
+def stored_photos(db_processor):
+    return db_processor.execute_read('SELECT FilePath, FileHash FROM PhotoInfoTable')
+
+
+def test_duplicate_with_same_name_as_other_photo_keeps_files(db_processor, tmp_path):
+    # y/b.jpg 是 x/a.jpg 的副本，与另一张照片 z/b.jpg 同名
+    save_image(str(tmp_path / 'source' / 'x' / 'a.jpg'), 'red')
+    save_image(str(tmp_path / 'source' / 'z' / 'b.jpg'), 'blue')
+    os.makedirs(tmp_path / 'source' / 'y')
+    with open(tmp_path / 'source' / 'x' / 'a.jpg', 'rb') as f, open(tmp_path / 'source' / 'y' / 'b.jpg', 'wb') as out:
+        out.write(f.read())
+
+    PhotoImporter(db_processor).import_from_folder(str(tmp_path / 'source'), workers=1)
+
+    photos = stored_photos(db_processor)
+    assert len(photos) == 2
+    for file_path, file_hash in photos:
+        assert os.path.exists(file_path)
+        assert photo_importer.calculate_file_hash(file_path) == file_hash
+    assert not [name for name in os.listdir('images') if name.startswith('.ingest-')]
+
+
+def test_same_name_as_existing_photo_does_not_overwrite(db_processor, tmp_path):
+    save_image(str(tmp_path / 'first' / 'a.jpg'), 'red')
+    save_image(str(tmp_path / 'second' / 'a.jpg'), 'blue')
+    importer = PhotoImporter(db_processor)
+
+    importer.import_from_folder(str(tmp_path / 'first'), workers=1)
+    importer.import_from_folder(str(tmp_path / 'second'), workers=1)
+
+    photos = stored_photos(db_processor)
+    assert len({file_path for file_path, _ in photos}) == 2
+    for file_path, file_hash in photos:
+        assert photo_importer.calculate_file_hash(file_path) == file_hash
+
+
+def test_cancel_finishes_face_detection_of_imported_photos(db_processor, tmp_path, monkeypatch):
+    for i, color in enumerate(['red', 'green', 'blue']):
+        save_image(str(tmp_path / 'source' / f'{i}.jpg'), color)
+    importer = PhotoImporter(db_processor)
+
+    # 人脸阶段收到第一张照片时取消导入，其余照片已经写入数据库并排队等待人脸识别
+    def iter_face_encodings(photos, workers, detection_max_edge):
+        for file_path, file_hash in photos:
+            importer.cancel_import()
+            yield file_path, file_hash, [], [], []
+    monkeypatch.setattr(photo_importer, 'iter_face_encodings', iter_face_encodings)
+    progress = []
+    importer.import_progress.connect(progress.append)
+
+    importer.import_from_folder(str(tmp_path / 'source'), workers=1)
+
+    assert progress[-1]['cancelled']
+    assert progress[-1]['imported'] == 3
+    assert progress[-1]['faces_done'] == 3
+
+
+def test_full_face_queue_does_not_block_import(db_processor, tmp_path, monkeypatch):
+    for i in range(12):
+        save_image(str(tmp_path / 'source' / f'{i}.jpg'), (i * 20, 0, 0))
+    # 队列只有一个位置，写入一批照片时人脸队列和结果队列都会被填满
+    monkeypatch.setattr(photo_importer, 'STAGE_QUEUE_SIZE', 1)
+    importer = PhotoImporter(db_processor)
+    importer.batch_size = 5
+
+    # 在后台线程中导入，出现死锁时测试失败而不是一直等待
+    thread = threading.Thread(target=importer.import_from_folder, args=(str(tmp_path / 'source'),), kwargs={'workers': 1})
+    thread.start()
+    thread.join(timeout=60)
+
+    assert not thread.is_alive()
+    assert len(stored_photos(db_processor)) == 12
+    assert db_processor.execute_read('SELECT COUNT(*) FROM FaceDetectionCache', fetch_one=True)[0] == 12
+
+
+
+def test_detection_cache_uses_encoder_max_edge(db_processor, tmp_path, monkeypatch):
+    save_image(str(tmp_path / 'source' / 'a.jpg'), 'red')
+    max_edges = []
+
+    def iter_face_encodings(photos, workers, detection_max_edge):
+        max_edges.append(detection_max_edge)
+        for file_path, file_hash in photos:
+            yield file_path, file_hash, [], [], []
+    monkeypatch.setattr(photo_importer, 'iter_face_encodings', iter_face_encodings)
+
+    PhotoImporter(db_processor, detection_max_edge=800).import_from_folder(str(tmp_path / 'source'), workers=1)
+
+    assert max_edges == [800]
+    assert db_processor.execute_read('SELECT SettingsKey FROM FaceDetectionCache') == [(face_settings_key(800),)]
+
+@pytest.mark.parametrize('failing', ['write_batch', 'commit_ingested_file'])
+def test_failed_batch_stops_stages_and_removes_unrecorded_files(db_processor, tmp_path, monkeypatch, failing):
+    for i in range(8):
+        save_image(str(tmp_path / 'source' / f'{i}.jpg'), (0, i * 20, 0))
+    importer = PhotoImporter(db_processor)
+    importer.batch_size = 2
+    # 第二次写入一批照片（或第三次改名）时出错
+    target = PhotoImporter if failing == 'write_batch' else photo_importer
+    original = getattr(target, failing)
+    calls = []
+
+    def fail_later(*args):
+        calls.append(args)
+        if len(calls) == (2 if failing == 'write_batch' else 3):
+            raise RuntimeError('disk full')
+        return original(*args)
+    monkeypatch.setattr(target, failing, fail_later)
+    users = db_processor.pool.users
+
+    with pytest.raises(RuntimeError):
+        importer.import_from_folder(str(tmp_path / 'source'), workers=1)
+
+    for thread in threading.enumerate():
+        if thread.name.startswith('import-'):
+            thread.join(timeout=10)
+            assert not thread.is_alive()
+    assert db_processor.pool.users == users
+    stored = {os.path.basename(file_path) for file_path, _ in stored_photos(db_processor)}
+    assert set(os.listdir('images')) == stored
@@ -0,0 +1,42 @@
+def photo_info(name, camera_model='Unknown'):
+    return (name, 1, 'JPEG', '2023:05:01 10:00:00', 1, 'Unknown location', camera_model, f'images/{name}', '', '', name, 0)
+
+
+def search(db_processor, text):
+    return sorted(photo.PhotoID for photo in db_processor.search_photos(text))
+
+
+def test_search_follows_inserts_and_deletes(db_processor):
+    with db_processor.transaction():
+        db_processor.add_photo_infos([photo_info('beach.jpg', 'Canon'), photo_info('mountain.jpg', 'Nikon')])
+    beach = db_processor.query_photo_id_by_hash('beach.jpg')
+    mountain = db_processor.query_photo_id_by_hash('mountain.jpg')
+    assert search(db_processor, 'beach') == [beach]
+    assert search(db_processor, 'nik') == [mountain]
+
+    db_processor.delete_photo_info(beach)
+    assert search(db_processor, 'beach') == []
+    assert search(db_processor, 'canon') == []
+
+
+def test_search_follows_face_links_and_renames(db_processor):
+    with db_processor.transaction():
+        db_processor.add_photo_infos([photo_info('a.jpg'), photo_info('b.jpg')])
+    photo_a = db_processor.query_photo_id_by_hash('a.jpg')
+    photo_b = db_processor.query_photo_id_by_hash('b.jpg')
+    (face_id,) = db_processor.add_faces([(b'', '未命名1')])
+    with db_processor.transaction():
+        db_processor.link_faces([(photo_a, face_id)])
+    assert search(db_processor, '未命名1') == [photo_a]
+
+    db_processor.update_face_name(face_id, 'Alice Smith')
+    assert search(db_processor, 'alice smith') == [photo_a]
+    assert search(db_processor, '未命名1') == []
+
+    with db_processor.transaction():
+        db_processor.link_faces([(photo_b, face_id)])
+    assert search(db_processor, 'alice') == [photo_a, photo_b]
+
+    with db_processor.transaction():
+        db_processor.execute_query('DELETE FROM PhotoFaceLink WHERE PhotoID = ?', (photo_a,))
+    assert search(db_processor, 'alice') == [photo_b]
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+from contextlib import closing
+from DBprocess import DBprocess
+
+# 最初版本的表结构（user_version 为 0，没有任何索引和触发器）
+BASELINE_SCHEMA = '''
+    CREATE TABLE PhotoInfoTable (
+        PhotoID INTEGER PRIMARY KEY AUTOINCREMENT, FileName TEXT, FileSize INTEGER, FileFormat TEXT, CaptureTime TEXT,
+        IsCaptureTimeAccurate INTEGER, CaptureLocation TEXT, CameraModel TEXT, FilePath TEXT, Thumbnail TEXT,
+        ThumbnailPath TEXT, FileHash TEXT, IsLandscape INTEGER
+    );
+    CREATE TABLE Faces (FaceID INTEGER PRIMARY KEY AUTOINCREMENT, FaceHash TEXT, FaceLabel TEXT);
+    CREATE TABLE PhotoFaceLink (
+        PhotoID INTEGER, FaceID INTEGER,
+        FOREIGN KEY (PhotoID) REFERENCES PhotoInfoTable (PhotoID), FOREIGN KEY (FaceID) REFERENCES Faces (FaceID)
+    );
+    CREATE TABLE SWConfig (InterfaceColorScheme TEXT, BackgroundImage BLOB, PhotoStoragePath TEXT, DatabaseFilePath TEXT);
+'''
+
+
+def create_baseline_database(photos, faces, links, db_path='data/photodata.db'):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany('''
+            INSERT INTO PhotoInfoTable (PhotoID, FileName, FileSize, FileFormat, CaptureTime, IsCaptureTimeAccurate,
+                CaptureLocation, CameraModel, FilePath, Thumbnail, ThumbnailPath, FileHash, IsLandscape)
+            VALUES (?, ?, 1, 'JPEG', '2023:05:01 10:00:00', 1, 'Unknown location', 'Unknown', ?, '', '', ?, 0)
+        ''', [(photo_id, name, f'images/{name}', file_hash) for photo_id, name, file_hash in photos])
+        conn.executemany('INSERT INTO Faces (FaceID, FaceHash, FaceLabel) VALUES (?, NULL, ?)', faces)
+        conn.executemany('INSERT INTO PhotoFaceLink (PhotoID, FaceID) VALUES (?, ?)', links)
+        conn.commit()
+
+
+def test_merging_duplicate_photos_keeps_one_link_per_face(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # 照片 1 和 5 的哈希相同，都与 Alice 关联
+    create_baseline_database(
+        photos=[(1, 'a.jpg', 'h1'), (2, 'b.jpg', 'h2'), (3, 'c.jpg', 'h3'), (4, 'd.jpg', 'h4'), (5, 'a copy.jpg', 'h1')],
+        faces=[(1, 'Alice Smith'), (2, 'Bob')],
+        links=[(1, 1), (5, 1), (5, 2), (2, 1)])
+
+    db_processor = DBprocess()
+    try:
+        assert [photo.PhotoID for photo in db_processor.photos_by_person(1)] == [1, 2]
+        assert [photo.PhotoID for photo in db_processor.photos_by_person(2)] == [1]
+        assert {face_id: count for face_id, _, count, _, _ in db_processor.query_persons()} == {1: 2, 2: 1}
+        labels = db_processor.execute_read('SELECT FaceLabels FROM PhotoSearch WHERE rowid = 1', fetch_one=True)[0]
+        assert sorted(labels.split(' ')) == ['Alice', 'Bob', 'Smith']
+    finally:
+        db_processor.close()
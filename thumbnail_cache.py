@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+
+# 缩略图缓存的默认内存上限（字节）
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+# 同时解码缩略图的线程数
+DECODE_THREADS = 2
+
+
+class ThumbnailDecodeTask(QRunnable):
+    def __init__(self, cache, key, path):
+        super().__init__()
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self.setAutoDelete(False)  # 由 ThumbnailCache 持有，取消排队中的任务时仍可访问
+
+    def run(self):
+        # 在工作线程中解码为 QImage，QPixmap 只能在主线程中创建
+        self.cache.decoded.emit(self.key, self.cache.decode(self.key, self.path))
+
+
+class ThumbnailCache(QObject):
+    """
+    缩略图服务
+
+    在后台线程中从打包缩略图文件（没有时从旧版本的缩略图文件）解码出 QImage，回到主线程后转换为 QPixmap，
+    按最近使用顺序保存在缓存中，总字节数超过 max_bytes 时淘汰最久未使用的缩略图。缓存以照片的文件哈希为键。
+    """
+    decoded = pyqtSignal(str, QImage)  # 工作线程解码完成，在主线程中处理
+    thumbnail_ready = pyqtSignal(str)  # 参数为文件哈希，缩略图已可以通过 get 取得
+
+    def __init__(self, size, max_bytes=THUMBNAIL_CACHE_BYTES, parent=None, thumbnail_store=None, device_pixel_ratio=1.0):
+        super().__init__(parent)
+        self.size = size
+        self.max_bytes = max_bytes
+        self.thumbnail_store = thumbnail_store
+        self.device_pixel_ratio = device_pixel_ratio  # 高分辨率屏幕上按实际像素解码
+        self.pixmaps = OrderedDict()  # 文件哈希 -> QPixmap，按最近使用排序
+        self.total_bytes = 0
+        self.pending = {}  # 文件哈希 -> 已提交但尚未完成的 ThumbnailDecodeTask
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(DECODE_THREADS)
+        self.decoded.connect(self.on_decoded)
+
+    def get(self, key, path):
+        """
+        取得缩略图；不在缓存中时提交后台解码并返回 None，解码完成后发出 thumbnail_ready 信号
+
+        参数:
+        key (str): 照片的文件哈希，用于读取打包缩略图
+        path (str): 旧版本的缩略图文件路径，没有打包缩略图时读取
+        """
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+            return pixmap
+        self.request(key, path)
+        return None
+
+    def request(self, key, path):
+        # 预取：提交后台解码，不影响缓存的使用顺序
+        if key in self.pixmaps or key in self.pending:
+            return
+        task = ThumbnailDecodeTask(self, key, path)
+        self.pending[key] = task
+        self.thread_pool.start(task)
+
+    def decode(self, key, path):
+        # 在工作线程中执行：读取并缩放缩略图
+        data = self.thumbnail_store.read(key) if self.thumbnail_store is not None else None
+        image = QImage.fromData(data) if data else QImage(path)
+        if not image.isNull():
+            pixels = round(self.size * self.device_pixel_ratio)
+            image = image.scaled(pixels, pixels, Qt.KeepAspectRatio)
+            image.setDevicePixelRatio(self.device_pixel_ratio)
+        return image
+
+    def cancel_pending(self, keep_keys):
+        # 取消还在排队、且不在 keep_keys 中的解码任务，例如快速滚动后已经离开可见区域的缩略图
+        for key in [key for key in self.pending if key not in keep_keys]:
+            if self.thread_pool.tryTake(self.pending[key]):
+                del self.pending[key]
+
+    def on_decoded(self, key, image):
+        if self.pending.pop(key, None) is None:
+            return  # 缓存已被清空
+        pixmap = QPixmap.fromImage(image)
+        self.pixmaps[key] = pixmap
+        self.total_bytes += self.pixmap_bytes(pixmap)
+        while self.total_bytes > self.max_bytes and len(self.pixmaps) > 1:
+            _, evicted = self.pixmaps.popitem(last=False)
+            self.total_bytes -= self.pixmap_bytes(evicted)
+        self.thumbnail_ready.emit(key)
+
+    def pixmap_bytes(self, pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def clear(self):
+        # 缩略图被删除或替换后调用
+        self.thread_pool.clear()
+        self.pending.clear()
+        self.pixmaps.clear()
+        self.total_bytes = 0
@@ -0,0 +1,119 @@
+import io
+import os
+import mmap
+import threading
+
+# 每张照片生成的缩略图尺寸（长边像素），256 用于高分辨率屏幕
+THUMBNAIL_SIZES = (128, 256)
+THUMBNAIL_QUALITY = 85
+
+
+def thumbnail_variant(pixels):
+    # 不小于 pixels 的最小缩略图尺寸，都小于 pixels 时取最大的尺寸
+    return min((size for size in THUMBNAIL_SIZES if size >= pixels), default=THUMBNAIL_SIZES[-1])
+
+
+def encode_thumbnails(image):
+    """
+    为照片生成各个尺寸的 JPEG 缩略图
+
+    参数:
+    image (PIL.Image.Image): 已打开的照片
+
+    返回:
+    list: [(尺寸, JPEG 数据), ...]
+    """
+    thumbnails = []
+    for size in THUMBNAIL_SIZES:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size))
+        if thumbnail.mode not in ('RGB', 'L'):
+            thumbnail = thumbnail.convert('RGB')
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY)
+        thumbnails.append((size, buffer.getvalue()))
+    return thumbnails
+
+
+class ThumbnailStore:
+    """
+    打包缩略图存储
+
+    所有缩略图按导入顺序追加写入一个文件，每张缩略图在文件中的位置和长度按 (文件哈希, 尺寸) 记录在数据库的 ThumbnailBlobs 表中。
+    读取时通过内存映射直接切片，同一批导入的照片在文件中相邻，一页缩略图只需少量连续读取。
+    """
+
+    def __init__(self, db_processor, file_path=None):
+        self.db_processor = db_processor
+        self.file_path = file_path or db_processor.config.get('ThumbnailPackFilePath', 'data/thumbnails.pack')
+        db_processor.ensure_directory_exists(os.path.dirname(self.file_path))
+        self.offsets = {}  # 文件哈希 -> (位置, 长度)，由 load_index 读取
+        self.map = None
+        self.map_lock = threading.RLock()
+
+    def recover(self):
+        # 写入前截掉上次异常退出时已写入文件、但没有提交到数据库的数据；文件正被其他连接映射而无法截断时保留
+        if not os.path.exists(self.file_path):
+            return
+        end = self.db_processor.query_thumbnail_pack_end()
+        if os.path.getsize(self.file_path) > end:
+            try:
+                with open(self.file_path, 'r+b') as f:
+                    f.truncate(end)
+            except OSError as e:
+                print(f"无法截断缩略图文件，未使用的数据将保留: {e}")
+
+    def append(self, thumbnails):
+        """
+        追加缩略图并记录位置，应在调用方的事务中执行，使位置记录与照片记录一起提交
+
+        参数:
+        thumbnails (list): [(文件哈希, 尺寸, JPEG 数据), ...]
+        """
+        if not thumbnails:
+            return
+        blobs = []
+        with open(self.file_path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            for file_hash, size, data in thumbnails:
+                blobs.append((file_hash, size, offset, len(data)))
+                offset += len(data)
+            f.write(b''.join(data for _, _, data in thumbnails))
+            f.flush()
+            os.fsync(f.fileno())  # 先保证缩略图落盘，再提交数据库中的位置
+        self.db_processor.add_thumbnail_blobs(blobs)
+
+    def load_index(self, size):
+        # 读取指定尺寸的缩略图位置；整体替换字典，后台线程中的 read 不受影响
+        self.offsets = {file_hash: (offset, length)
+                        for file_hash, offset, length in self.db_processor.query_thumbnail_blobs(size) or []}
+
+    def has(self, file_hash):
+        return file_hash in self.offsets
+
+    def read(self, file_hash):
+        """
+        读取缩略图数据，可以在任意线程中调用
+
+        返回:
+        bytes: JPEG 数据，没有打包的缩略图时返回 None
+        """
+        location = self.offsets.get(file_hash)
+        if location is None:
+            return None
+        offset, length = location
+        with self.map_lock:
+            # 文件在映射之后又追加了数据时重新映射
+            if self.map is None or len(self.map) < offset + length:
+                self.close()
+                if not os.path.exists(self.file_path) or os.path.getsize(self.file_path) < offset + length:
+                    return None
+                with open(self.file_path, 'rb') as f:
+                    self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.map[offset:offset + length]
+
+    def close(self):
+        with self.map_lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None